@@ -0,0 +1,84 @@
+# ==============================================================================
+# aggregates.py - 占卜紀錄的累計統計 (增量維護)
+# ==============================================================================
+# 統計以計數器存在 history.db 的 aggregate_counts 表：(metric, key) -> value。
+# 每寫入一筆占卜，背景寫入執行緒就在同一個交易中把這筆的增量加上去，
+# 因此統計與紀錄永遠一致、可跨行程共用，儀表板讀取只需讀這張小表，與紀錄筆數無關。
+# 規則變更後以 HistoryStore.rebuild_aggregates() 從頭重算。
+#
+# metric：
+#   readings      key=single/full          成卦的占卜次數
+#   rejected      key=single/full          不成卦 (全紅/全黑，status 不是 VALID) 的次數；這些盤面不計入下列統計
+#   boards        key=''                   盤面數 (全盤流年每個階段各算一個)
+#   pattern       key=格局名稱             出現該格局的盤面數
+#   exemption     key=眾星拱月/一枝獨秀/無
+#   color         key=紅3黑2 ...           analyze_health_and_luck 的紅黑比例
+#   net_sum / net_count   key=模式         各模式 net_score 的總和與筆數 (平均 = 總和 / 筆數)
+#   net_hist:<模式>       key=分數         各模式 net_score 的分布
+
+from collections import Counter
+
+from patterns import pattern_label
+from rules import cached_call, check_special_patterns, check_exemption, analyze_health_and_luck, calculate_score_by_mode, SCORE_MODES
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS aggregate_counts (
+    metric TEXT NOT NULL,
+    key    TEXT NOT NULL,
+    value  REAL NOT NULL,
+    PRIMARY KEY (metric, key)
+) WITHOUT ROWID;
+"""
+
+def _score_key(value): return f"{value:g}"
+
+def board_deltas(gua):
+    """單一盤面對各計數器的增量"""
+    deltas = Counter({("boards", ""): 1})
+    for label in {pattern_label(p["name"]) for p in cached_call(check_special_patterns, gua)}: deltas[("pattern", label)] += 1
+    exemption = cached_call(check_exemption, gua)
+    deltas[("exemption", exemption[0] if exemption else "無")] += 1
+    health = cached_call(analyze_health_and_luck, gua)
+    deltas[("color", f"紅{health['red_count']}黑{health['black_count']}")] += 1
+    for mode in SCORE_MODES:
+        net = cached_call(calculate_score_by_mode, gua, mode)["net_score"]
+        deltas[("net_sum", mode)] += net
+        deltas[("net_count", mode)] += 1
+        deltas[(f"net_hist:{mode}", _score_key(net))] += 1
+    return deltas
+
+def reading_deltas(kind, boards, status="VALID"):
+    """一筆占卜 (單卦 1 個盤面，全盤流年 6 個) 的增量；不成卦的占卜只計入 rejected"""
+    if status not in (None, "VALID"): return Counter({("rejected", kind): 1})
+    deltas = Counter({("readings", kind): 1})
+    for gua in boards: deltas.update(board_deltas(gua))
+    return deltas
+
+def apply(conn, deltas):
+    """把增量加到計數器上 (由呼叫端控制交易)"""
+    conn.executemany(
+        "INSERT INTO aggregate_counts (metric, key, value) VALUES (?, ?, ?) "
+        "ON CONFLICT (metric, key) DO UPDATE SET value = value + excluded.value",
+        [(metric, key, value) for (metric, key), value in deltas.items()])
+
+def snapshot(conn):
+    """整理成儀表板用的結構：各格局/特殊格局/紅黑比例的次數，各模式 net_score 的平均與分布"""
+    raw = {}
+    for metric, key, value in conn.execute("SELECT metric, key, value FROM aggregate_counts"):
+        raw.setdefault(metric, {})[key] = value
+    count = lambda metric: {k: int(v) for k, v in sorted(raw.get(metric, {}).items(), key=lambda kv: -kv[1])}
+    net = {}
+    for mode in SCORE_MODES:
+        n = raw.get("net_count", {}).get(mode, 0)
+        hist = raw.get(f"net_hist:{mode}", {})
+        net[mode] = {"count": int(n), "mean": raw["net_sum"][mode] / n if n else None,
+                     "histogram": {k: int(v) for k, v in sorted(hist.items(), key=lambda kv: float(kv[0]))}}
+    return {
+        "readings": count("readings"),
+        "rejected": count("rejected"),
+        "boards": int(raw.get("boards", {}).get("", 0)),
+        "patterns": count("pattern"),
+        "exemption": count("exemption"),
+        "color": count("color"),
+        "net_score": net,
+    }
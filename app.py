@@ -1,17 +1,21 @@
 import streamlit as st
-import pandas as pd
 import time
 import os
-from data import ATTRIBUTES, POSITION_MAP, get_image_path, GEOMETRY_RELATION, LIFE_STAGES
+from data import POSITION_MAP, get_image_path, LIFE_STAGES
 from rules import (
-    generate_random_gua, generate_full_life_gua, check_exemption, 
-    calculate_score_by_mode, analyze_health_and_luck, is_all_same_color, 
-    get_marketing_strategy, get_past_life_reading, get_advanced_piece_analysis,
-    calculate_net_gain_from_gua, analyze_trinity_detailed, analyze_holistic_health,
-    analyze_coordinate_map, analyze_body_hologram, check_career_pattern, 
-    check_consumption_at_1_or_5, check_interference, check_wealth_pattern,
-    analyze_total_fate, get_decade_advice, analyze_color_flow
+    generate_full_life_gua, check_exemption, calculate_score_by_mode, analyze_trinity_detailed,
+    analyze_total_fate, get_decade_advice, analyze_color_flow, analyze_all, cached_call, is_all_same_color
 )
+from gua import Gua, POSITIONS
+import board_edit
+import history
+import instrument
+import sampler
+import startup
+# batch (numpy)、sprites (Pillow)、gua_table 在第一次使用時才 import，首頁不必等它們載入 (見 startup.py)
+
+# 洗牌/重抽動畫的停頓秒數倍率 (0 = 不停頓；壓力測試見 loadtest.py)
+SPINNER_DELAY = float(os.environ.get("XIANGBU_SPINNER_DELAY", "1"))
 
 # ----------------------------------------------
 # 輔助函數
@@ -30,6 +34,43 @@ def display_piece(gua_data, pos_num):
     except StopIteration:
         st.empty()
 
+def start_session_rng(seed_text):
+    # 每次占卜使用自己的亂數產生器；種子存在 session_state，輸入同一個種子即可重現整次占卜 (含自動重抽)
+    seed = int(seed_text) if seed_text.strip().isdigit() else sampler.new_seed()
+    st.session_state.seed = seed
+    return sampler.session_rng(seed)
+
+def full_life_summary(full_data):
+    # 六個階段的能量分數以 batch 一次向量化算出 (排盤時算一次)，展開前的標題只需要這個
+    import batch
+    codes = batch.encode_boards([full_data[stage] for stage in LIFE_STAGES])
+    nets = batch.score_boards(codes, "general")["net_score"]
+    return tuple(float(net) for net in nets)   # 依 LIFE_STAGES 順序
+
+def display_board(gua_data):
+    # 整個十字盤面合成一張圖 (依盤面快取)；無法合成時退回逐顆顯示
+    import sprites
+    board_png = sprites.render_board(gua_data)
+    if board_png is not None:
+        pieces = {p[0]: f"{p[2]}{p[1]}" for p in gua_data}
+        # 合成圖只有棋子，位置名稱與關係 (同 display_piece) 放在圖說
+        caption = "　".join(f"{POSITION_MAP[pos]['名稱'].split()[0]}：{pieces[pos]} ({POSITION_MAP[pos]['關係']})" for pos in [4, 2, 1, 3, 5])
+        st.image(board_png, caption=caption, width=sprites.CELL * 3 + sprites.GAP * 2)
+        return
+    c_u1, c_u2, c_u3 = st.columns([1,1,1])
+    with c_u2: 
+        display_piece(gua_data, 4)
+    c_m1, c_m2, c_m3 = st.columns([1,1,1])
+    with c_m1: 
+        display_piece(gua_data, 2)
+    with c_m2: 
+        display_piece(gua_data, 1)
+    with c_m3: 
+        display_piece(gua_data, 3)
+    c_d1, c_d2, c_d3 = st.columns([1,1,1])
+    with c_d2: 
+        display_piece(gua_data, 5)
+
 # ----------------------------------------------
 # 頁面配置
 # ----------------------------------------------
@@ -57,6 +98,9 @@ if 'sub_query' not in st.session_state: st.session_state.sub_query = "問運勢"
 if 'message' not in st.session_state: st.session_state.message = ""
 if 'current_gua' not in st.session_state: st.session_state.current_gua = []
 if 'full_life_gua' not in st.session_state: st.session_state.full_life_gua = {}
+if 'seed' not in st.session_state: st.session_state.seed = None
+if 'last_edit' not in st.session_state: st.session_state.last_edit = None   # (換棋前的盤面, 位置)
+if 'full_life_summary' not in st.session_state: st.session_state.full_life_summary = None
 
 with st.sidebar:
     st.header("天機奧秘，誠心求卜")
@@ -70,6 +114,8 @@ with st.sidebar:
     st.markdown("---")
     st.header("1. 基本資料")
     gender = st.selectbox("詢問性別", ["男", "女"])
+    client = st.text_input("客戶名稱/編號 (選填，占卜紀錄依此查詢)", value="")
+    seed_text = st.text_input("卦號 (重現先前的占卜時填入，留空為隨機)", value="")
     
     st.markdown("---")
     st.header("2. 選擇占卜模式")
@@ -81,8 +127,11 @@ with st.sidebar:
         if st.button("🚀 排布全盤流年", type="primary"):
             st.session_state.current_mode = "FULL"
             with st.spinner('正在洗牌、切牌、排布全盤流年...'):
-                time.sleep(1.5)
-                st.session_state.full_life_gua = generate_full_life_gua()
+                time.sleep(1.5 * SPINNER_DELAY)
+                st.session_state.full_life_gua = generate_full_life_gua(start_session_rng(seed_text))
+                st.session_state.full_life_summary = full_life_summary(st.session_state.full_life_gua)
+                st.session_state.last_edit = None
+                history.get_store().record("full", st.session_state.full_life_gua, client=client, mode="全盤流年", gender=gender, seed=st.session_state.seed)
                 st.session_state.final_result_status = "VALID"
                 st.session_state.message = "全盤流年排佈完成！"
             st.rerun()
@@ -102,14 +151,16 @@ with st.sidebar:
         if st.button("🔮 開始單卦占卜"):
             st.session_state.current_mode = "SINGLE"
             st.session_state.sub_query = current_sub_query_selection
-            new_gua = generate_random_gua()
-            if is_all_same_color(new_gua):
+            # 一次抽樣即決定結果 (第一次成卦 / 重抽後成卦 / 兩次不成卦)，機率與實際抽兩次相同
+            outcome, new_gua = sampler.divine(start_session_rng(seed_text))
+            st.session_state.last_edit = None
+            presented = True   # 「請刷新頁面重試」時不顯示這次抽到的盤面，也不記錄
+            if outcome != "accepted":
                 st.session_state.reroll_count += 1
                 if st.session_state.reroll_count == 1:
                     with st.spinner('不成卦，系統自動重抽中...'): 
-                        time.sleep(1)
-                        new_gua = generate_random_gua()
-                    if is_all_same_color(new_gua):
+                        time.sleep(1 * SPINNER_DELAY)
+                    if outcome == "rejected":
                         st.session_state.current_gua = new_gua
                         st.session_state.message = "❌ 兩次不成卦，暗示「不會做也不會成」。"
                         st.session_state.final_result_status = "REJECTED"
@@ -120,17 +171,57 @@ with st.sidebar:
                 else:
                      st.session_state.message = "請刷新頁面重試。"
                      st.session_state.final_result_status = "REJECTED" 
+                     presented = False
             else:
                 st.session_state.current_gua = new_gua
                 st.session_state.reroll_count = 0
                 st.session_state.message = "卦象生成成功。"
                 st.session_state.final_result_status = "VALID"
+            # 占卜紀錄由背景執行緒批次寫入，不影響回應時間
+            if presented:
+                history.get_store().record("single", new_gua, client=client, mode=current_sub_query_selection, gender=gender,
+                                           seed=st.session_state.seed, status=st.session_state.final_result_status)
             st.rerun()
 
+    st.markdown("---")
+
+    # 模式 C: 手動排盤 (輸入實體抽到的棋)，問題類別沿用上方的選擇
+    with st.container():
+        st.subheader("🅲 手動排盤 (實體抽棋)")
+        manual_defaults = {1: 7, 2: 6, 3: 13, 4: 1, 5: 9}
+        manual_codes = [st.selectbox(f"位{pos} {POSITION_MAP[pos]['名稱']}", range(14), index=manual_defaults[pos],
+                                     format_func=board_edit.piece_label, key=f"manual_{pos}") for pos in POSITIONS]
+        if st.button("✍️ 以手動盤面解卦"):
+            over = board_edit.deck_violations(manual_codes)
+            if over: st.error(f"超過一副棋的張數：{'、'.join(over)}")
+            else:
+                manual_gua = Gua(manual_codes)
+                st.session_state.current_mode = "SINGLE"
+                st.session_state.sub_query = current_sub_query_selection
+                st.session_state.current_gua = manual_gua
+                st.session_state.seed = None
+                st.session_state.last_edit = None
+                st.session_state.reroll_count = 0
+                if is_all_same_color(manual_gua):
+                    st.session_state.message = "❌ 全紅或全黑，不成卦。"
+                    st.session_state.final_result_status = "REJECTED"
+                else:
+                    st.session_state.message = "手動盤面解析完成。"
+                    st.session_state.final_result_status = "VALID"
+                history.get_store().record("single", manual_gua, client=client, mode=current_sub_query_selection, gender=gender,
+                                           status=st.session_state.final_result_status)
+                st.rerun()
+
+# 盤面在 session_state 只存編碼 (單卦 5 bytes、全盤流年 32 bytes 牌序 + 卦號)；啟用 instrument 時顯示本 session 的記憶體
+if instrument.ENABLED:
+    memory = instrument.session_memory(st.session_state.to_dict())
+    st.sidebar.caption(f"🧠 session_state 約 {sum(memory.values()):,} bytes (" + "、".join(f"{k} {v:,}" for k, v in list(memory.items())[:4]) + ")")
+
 # ----------------------------------------------
 # 主頁面顯示邏輯
 # ----------------------------------------------
-if st.session_state.final_result_status == "INIT": st.info("👈 請在左側側邊欄選擇模式開始。"); st.stop()
+if st.session_state.final_result_status == "INIT": st.info("👈 請在左側側邊欄選擇模式開始。"); startup.prewarm(); st.stop()
+if st.session_state.seed is not None: st.caption(f"🔢 卦號：{st.session_state.seed} (填入側邊欄即可重現此卦)")
 if st.session_state.final_result_status == "REJECTED": st.error(st.session_state.message); st.stop() 
 
 if st.session_state.current_mode == "SINGLE" and st.session_state.sub_query == "離婚議題" and gender == "男":
@@ -169,35 +260,28 @@ if st.session_state.current_mode == "FULL":
     # 2. 十年大運
     st.markdown("### 2️⃣ 十年大運走勢")
     
-    for stage in LIFE_STAGES:
+    if st.session_state.full_life_summary is None: st.session_state.full_life_summary = full_life_summary(full_data)
+    summary = st.session_state.full_life_summary
+    for i, stage in enumerate(LIFE_STAGES):
         gua = full_data.get(stage, [])
         if not gua: continue
+        stage_box = st.expander(f"📌 {stage} 運勢分析 (能量: {summary[i]} 分)", expanded=False, key=f"stage_open_{i}", on_change="rerun")
+        # 收合的階段不做分析也不畫盤面；展開時的分析走跨 session 快取，session 本身只保存牌序
+        if not stage_box.open: continue
+        with instrument.scope("full_stage"):
+            analysis, decade_advice, exemption, trinity = (
+                cached_call(calculate_score_by_mode, gua, "general"), get_decade_advice(stage, gua),
+                cached_call(check_exemption, gua), cached_call(analyze_trinity_detailed, gua),
+            )
         
-        analysis = calculate_score_by_mode(gua, "general")
-        decade_advice = get_decade_advice(stage, gua)
-        
-        with st.expander(f"📌 {stage} 運勢分析 (能量: {analysis['net_score']} 分)", expanded=False):
+        with stage_box:
             
             col_chart, col_text = st.columns([1, 1.5])
             
             # 左側：十字盤面 (修復排版錯誤：正確分行)
             with col_chart:
                 st.markdown("<div style='transform: scale(0.9); transform-origin: top left;'>", unsafe_allow_html=True)
-                c_u1, c_u2, c_u3 = st.columns([1,1,1])
-                with c_u2: 
-                    display_piece(gua, 4)
-                    
-                c_m1, c_m2, c_m3 = st.columns([1,1,1])
-                with c_m1: 
-                    display_piece(gua, 2)
-                with c_m2: 
-                    display_piece(gua, 1)
-                with c_m3: 
-                    display_piece(gua, 3)
-                    
-                c_d1, c_d2, c_d3 = st.columns([1,1,1])
-                with c_d2: 
-                    display_piece(gua, 5)
+                display_board(gua)
                 st.markdown("</div>", unsafe_allow_html=True)
             
             # 右側：運勢批註
@@ -209,11 +293,9 @@ if st.session_state.current_mode == "FULL":
                 else:
                     st.error(f"🛡️ **運勢低迷 ({analysis['net_score']})**：{analysis['interpretation']}")
                 
-                exemption = check_exemption(gua)
                 if exemption: st.warning(f"⚡ **特殊格局：** {exemption[0]}")
                 
                 # 三才缺失
-                trinity = analyze_trinity_detailed(gua)
                 if trinity['missing_heaven']: st.write(f"❌ 缺天：{trinity['missing_heaven']['reason']}")
                 if trinity['missing_human']: st.write(f"❌ 缺人：{trinity['missing_human']['reason']}")
                 if trinity['missing_earth']: st.write(f"❌ 缺地：{trinity['missing_earth']['reason']}")
@@ -230,40 +312,56 @@ elif st.session_state.current_mode == "SINGLE":
     current_gua = st.session_state.current_gua
     sub_query = st.session_state.sub_query
     
-    # 執行所有分析
-    analysis_results = calculate_net_gain_from_gua(current_gua) 
-    health_analysis = analyze_health_and_luck(current_gua)
-    trinity_detailed = analyze_trinity_detailed(current_gua)
-    holistic_report = analyze_holistic_health(current_gua)
-    coord_report = analyze_coordinate_map(current_gua, gender)
-    body_diagnosis = analyze_body_hologram(current_gua)
-    
+    # 執行所有分析 (跨 session 快取；已建盤面表時未命中也只需查表)
     mode_map = {"問運勢":"general","事業查詢":"career","前世格局":"karma","健康分析":"health","投資/財運":"investment","感情/關係":"love","離婚議題":"divorce"}
-    score_report = calculate_score_by_mode(current_gua, mode=mode_map.get(sub_query,"general"))
-    piece_analysis = get_advanced_piece_analysis(current_gua)
+    # 剛換過一支棋：只重算與該位置有關的關係、格局與分數，新的 context 直接交給整份解析
+    edit_delta, reading_input = None, current_gua
+    if st.session_state.last_edit is not None:
+        prev_gua, edit_pos = st.session_state.last_edit
+        if sum(a != b for a, b in zip(prev_gua.codes, current_gua.codes)) == 1 and prev_gua.kind(edit_pos) != current_gua.kind(edit_pos):
+            edited, edit_delta = board_edit.edit(prev_gua, edit_pos, current_gua.kind(edit_pos))
+            reading_input = edited.ctx
+    import gua_table
+    with instrument.scope("single_reading"):
+        reading = analyze_all(reading_input, gender, mode_map.get(sub_query,"general"), table=gua_table.get_table())
+    analysis_results = reading["calculate_net_gain_from_gua"]
+    health_analysis = reading["analyze_health_and_luck"]
+    trinity_detailed = reading["analyze_trinity_detailed"]
+    holistic_report = reading["analyze_holistic_health"]
+    coord_report = reading["analyze_coordinate_map"]
+    body_diagnosis = reading["analyze_body_hologram"]
+    score_report = reading["calculate_score_by_mode"]
+    piece_analysis = reading["get_advanced_piece_analysis"]
 
     st.header(f"✅ 單卦解析：{sub_query}")
     
     # 視覺化盤面 (修復排版錯誤：正確分行)
-    col_u1, col_u2, col_u3 = st.columns([1, 1, 1])
-    with col_u2: 
-        display_piece(current_gua, 4)
-        
-    col_m1, col_m2, col_m3 = st.columns([1, 1, 1])
-    with col_m1: 
-        display_piece(current_gua, 2)
-    with col_m2: 
-        display_piece(current_gua, 1)
-    with col_m3: 
-        display_piece(current_gua, 3)
-        
-    col_d1, col_d2, col_d3 = st.columns([1, 1, 1])
-    with col_d2: 
-        display_piece(current_gua, 5)
+    display_board(current_gua)
+
+    # 換一支棋試試 (例如「如果位4換成紅仕」)：可換的棋扣掉盤面上已用掉的張數
+    with st.expander("🔁 換一支棋試試", expanded=edit_delta is not None):
+        c_pos, c_kind = st.columns(2)
+        swap_pos = c_pos.selectbox("位置", POSITIONS, format_func=lambda pos: f"位{pos} {POSITION_MAP[pos]['名稱']}", key="swap_pos")
+        swap_options = [k for k in board_edit.valid_kinds(current_gua, swap_pos) if k != current_gua.kind(swap_pos)]
+        swap_kind = c_kind.selectbox("換成", swap_options, format_func=board_edit.piece_label, key=f"swap_kind_{swap_pos}")
+        if st.button("套用", key="swap_apply"):
+            st.session_state.last_edit = (current_gua, swap_pos)
+            st.session_state.seed = None   # 卦號只能重現換棋前的盤面
+            st.session_state.current_gua = board_edit.replace(current_gua, swap_pos, swap_kind)
+            st.rerun()
+        if edit_delta is not None:
+            st.markdown(f"**位{edit_delta['pos']}：{edit_delta['old']} → {edit_delta['new']}**")
+            cols = st.columns(4)
+            for i, (mode, (old_net, new_net)) in enumerate(edit_delta["scores"].items()):
+                cols[i % 4].metric(edited.scores[mode]["label_Net"], f"{new_net} 分", delta=f"{new_net - old_net:+g}")
+            if edit_delta["added"]: st.success("新增格局：" + "、".join(edit_delta["added"]))
+            if edit_delta["removed"]: st.warning("消失格局：" + "、".join(edit_delta["removed"]))
+            if not edit_delta["added"] and not edit_delta["removed"]: st.info("格局不變。")
+            if edit_delta["rechecked"] is not None: st.caption(f"只重新判斷了 {len(edit_delta['rechecked'])} 條與變動有關的格局規則。")
 
     st.markdown("---")
     
-    tab1, tab2, tab3, tab4 = st.tabs(["📊 能量分數", "✨ 格局與建議", "🧬 深度解讀", "📍 座標定位"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["📊 能量分數", "✨ 格局與建議", "🧬 深度解讀", "📍 座標定位", "🌡️ 換棋敏感度"])
     
     # Tab 1: 能量分數
     with tab1:
@@ -292,7 +390,7 @@ elif st.session_state.current_mode == "SINGLE":
         st.info(f"**狀態解析：** {piece_analysis['self_desc']}")
         for warn in piece_analysis["special_warnings"]: st.warning(warn)
         st.markdown("---")
-        exemption = check_exemption(current_gua)
+        exemption = reading["check_exemption"]
         if exemption: st.success(f"特殊格局：{exemption[0]}")
         else: st.info("無特殊格局 (五行流通)")
         
@@ -304,12 +402,12 @@ elif st.session_state.current_mode == "SINGLE":
             else: st.warning("⚠️ **一四配/全色：** 情緒起伏大。")
         elif sub_query == "事業查詢":
             st.markdown("#### 💡 事業諮詢 SOP")
-            st.write(get_marketing_strategy(current_gua))
+            st.write(reading["get_marketing_strategy"])
             st.markdown(f"**棋子特質：** {piece_analysis['career_desc']}")
-            if check_career_pattern(current_gua): st.success("🏆 **事業格 (車馬包)**")
+            if reading["check_career_pattern"]: st.success("🏆 **事業格 (車馬包)**")
         elif sub_query == "投資/財運":
             st.markdown("#### 💡 投資 SOP")
-            if check_consumption_at_1_or_5(current_gua): st.error("⚠️ 下格不穩，錢留不住。")
+            if reading["check_consumption_at_1_or_5"]: st.error("⚠️ 下格不穩，錢留不住。")
             else: st.success("下格穩固。")
         elif sub_query == "感情/關係":
             st.markdown("#### 💡 感情諮詢 SOP")
@@ -345,7 +443,7 @@ elif st.session_state.current_mode == "SINGLE":
                     for msg in holistic_report["interaction"]: st.error(msg)
 
         elif sub_query == "前世格局":
-            karma = get_past_life_reading(current_gua)
+            karma = reading["get_past_life_reading"]
             st.subheader("📜 前世今生解讀")
             st.markdown(f"**前世身分：** {karma['role']}")
             for rel in karma['relations']: st.write(f"- {rel}")
@@ -376,3 +474,36 @@ elif st.session_state.current_mode == "SINGLE":
         col_h1, col_h2 = st.columns(2)
         with col_h1: st.markdown("**👈 左格**"); st.write(coord_report["love_relationship"] if gender == "男" else coord_report["peer_relationship"])
         with col_h2: st.markdown("**👉 右格**"); st.write(coord_report["peer_relationship"] if gender == "男" else coord_report["love_relationship"])
+
+    # Tab 5: 換棋敏感度 (每個位置換成牌組剩下的每一種棋，分數與格局如何變化)；展開時才計算，同全盤流年的各階段
+    with tab5:
+        sweep_mode = mode_map.get(sub_query, "general")
+        if sweep_mode == "health": st.caption("健康模式不計算淨值，以下改用「問運勢」的分數。"); sweep_mode = "general"
+        net_label = score_report["label_Net"] if sweep_mode != "general" else "運勢損益"
+        sweep_box = st.expander(f"🌡️ 換一支棋，{net_label}會怎麼變 (列出所有可能的換法)", expanded=False, key="whatif_open", on_change="rerun")
+        if sweep_box.open:
+            import whatif
+            with instrument.scope("whatif_sweep"):
+                sweep = whatif.sweep(current_gua)
+            with sweep_box:
+                st.caption(f"共 {len(sweep.rows)} 種換法；顏色為與目前盤面 ({sweep.base['scores'][sweep_mode]:+g} 分) 的差距，滑鼠移上去可看格局變化。")
+                records = whatif.heatmap_records(sweep, sweep_mode)
+                st.vega_lite_chart({
+                    "data": {"values": records},
+                    "encoding": {
+                        "x": {"field": "換成", "type": "nominal", "sort": [board_edit.piece_label(k) for k in range(14)]},
+                        "y": {"field": "位置", "type": "nominal"},
+                    },
+                    "layer": [
+                        {"mark": "rect", "encoding": {
+                            "color": {"field": "變化", "type": "quantitative", "scale": {"scheme": "redyellowgreen", "domainMid": 0}},
+                            "tooltip": [{"field": f} for f in ("位置", "換成", "net_score", "變化", "新增格局", "消失格局")]}},
+                        {"mark": {"type": "text", "fontSize": 11}, "encoding": {"text": {"field": "變化", "type": "quantitative", "format": "+g"}}},
+                    ],
+                }, width="stretch")
+                gained = [row for row in sweep.rows if row["added"] or row["removed"]]
+                if gained:
+                    st.markdown(f"**格局會改變的換法 ({len(gained)})**")
+                    for row in gained:
+                        changes = [f"➕ {name}" for name in row["added"]] + [f"➖ {name}" for name in row["removed"]]
+                        st.write(f"- 位{row['pos']} → {row['label']}：{'　'.join(changes)}")
@@ -0,0 +1,126 @@
+# ==============================================================================
+# batch.py - NumPy 批次計分 (離線校正/模擬用)
+# ==============================================================================
+# 盤面以 (N, 5) 的棋種代碼陣列表示 (欄 0~4 對應位置 1~5，代碼見 data.PIECE_KINDS)，
+# 一次算出所有盤面的 score_A / score_B / net_score，結果與 calculate_score_by_mode 完全一致；
+# 特殊格局則以 patterns.py 編譯好的同一組規則向量化判斷。
+
+import numpy as np
+
+from data import PIECE_KINDS, VALUE_MAP
+from gua import Gua, KIND_COLOR, KIND_TYPE
+from rules import CAPTURE_TABLE, SCORE_MODES, check_good_friend
+import patterns
+
+NO_FRIEND_CREDIT_MODES = ["health", "love", "transaction"]
+
+# 棋種類型代碼 (KIND_TYPE)：0 將帥、1 士仕、2 象相、3 車俥、4 馬傌、5 包炮、6 兵卒
+TYPE_GENERAL, TYPE_ADVISOR, TYPE_ELEPHANT, TYPE_CHARIOT, TYPE_HORSE, TYPE_CANNON, TYPE_SOLDIER = range(7)
+
+KIND_VALUES = np.array([VALUE_MAP[name] for name, _ in PIECE_KINDS], dtype=np.float64)
+KIND_COLORS = np.array(KIND_COLOR, dtype=np.int8)
+KIND_TYPES = np.array(KIND_TYPE, dtype=np.int8)
+
+# CAPTURE[吃方棋種, 被吃棋種, 吃方位置-1, 被吃位置-1]
+CAPTURE = np.frombuffer(CAPTURE_TABLE, dtype=np.uint8).reshape(14, 14, 5, 5).astype(bool)
+# FRIEND[棋種, 棋種]：check_good_friend 只看名稱與顏色，與位置無關
+FRIEND = np.array([[check_good_friend((0,) + a, (0,) + b) for b in PIECE_KINDS] for a in PIECE_KINDS])
+
+def encode_boards(guas):
+    """把多個盤面 (Gua 或棋子串列) 轉成 (N, 5) 的棋種代碼陣列"""
+    rows = [g.codes if isinstance(g, Gua) else Gua.from_pieces(g).codes for g in guas]
+    return np.frombuffer(b"".join(rows), dtype=np.uint8).reshape(-1, 5).astype(np.intp)
+
+def board_ids(codes):
+    codes = np.asarray(codes, dtype=np.int64)
+    return codes @ (14 ** np.arange(5, dtype=np.int64))
+
+def center_relations(codes):
+    """中心(位1)與四個鄰位的關係：(中心吃鄰位, 鄰位吃中心, 好朋友)，皆為 (N, 4) 布林陣列"""
+    codes = np.asarray(codes, dtype=np.intp)
+    center, neighbors = codes[:, :1], codes[:, 1:]
+    nb_index = np.arange(1, 5)
+    eats_out = CAPTURE[center, neighbors, 0, nb_index]
+    eats_in = CAPTURE[neighbors, center, nb_index, 0]
+    friends = FRIEND[center, neighbors]
+
+    # 特殊格局覆寫 (同 check_exemption)：四同色一異色
+    colors = KIND_COLORS[codes]
+    black_count = colors.sum(axis=1)
+    has_unique = (black_count == 1) | (black_count == 4)
+    unique_color = (black_count == 1).astype(np.int8)
+    unique_pos = np.argmax(colors == unique_color[:, None], axis=1)
+    # 眾星拱月：中心不可被吃
+    eats_in &= ~(has_unique & (unique_pos == 0))[:, None]
+    # 一枝獨秀：該位只有馬、炮吃得到 (中心與獨秀位必為異色)
+    solo = has_unique & (unique_pos > 0)
+    center_jumps = np.isin(KIND_TYPES[codes[:, 0]], [TYPE_HORSE, TYPE_CANNON])
+    solo_col = solo[:, None] & (nb_index == unique_pos[:, None])
+    eats_out = np.where(solo_col, center_jumps[:, None], eats_out)
+    return eats_out, eats_in, friends
+
+def exemption_codes(codes):
+    """check_exemption 的結果 (N,)：patterns.EXEMPTION_CODES (0 無、1 眾星拱月、2 一枝獨秀)"""
+    colors = KIND_COLORS[np.asarray(codes, dtype=np.intp)]
+    black_count = colors.sum(axis=1)
+    has_unique = (black_count == 1) | (black_count == 4)
+    unique_pos = np.argmax(colors == (black_count == 1)[:, None], axis=1)
+    return np.where(has_unique, np.where(unique_pos == 0, 1, 2), 0)
+
+def score_boards(codes, mode="general", relations=None):
+    """回傳 {"score_A", "score_B", "net_score"}，每項為長度 N 的 float 陣列"""
+    codes = np.asarray(codes, dtype=np.intp)
+    eats_out, eats_in, friends = relations if relations is not None else center_relations(codes)
+    center, neighbors = codes[:, :1], codes[:, 1:]
+    val_c, val_n = KIND_VALUES[center], KIND_VALUES[neighbors]
+    type_c, type_n = KIND_TYPES[center], KIND_TYPES[neighbors]
+
+    # 象吃車只算半價 (兵吃將照原價)
+    gain = np.where(eats_out, np.where((type_c == TYPE_ELEPHANT) & (type_n == TYPE_CHARIOT), val_n * 0.5, val_n), 0.0)
+    cost = np.where(eats_in, np.where((type_n == TYPE_ELEPHANT) & (type_c == TYPE_CHARIOT), val_c * 0.5, val_c), 0.0)
+    if mode not in NO_FRIEND_CREDIT_MODES:
+        gain = np.where(~eats_out & friends, val_n * 0.5, gain)
+        cost = np.where(~eats_in & friends, val_c * 0.5, cost)
+
+    if mode == "love":
+        score_a, score_b = cost.sum(axis=1), gain.sum(axis=1)
+    elif mode == "transaction":
+        score_a, score_b = np.where(friends, 20.0, gain).sum(axis=1), cost.sum(axis=1)
+    else:
+        score_a, score_b = gain.sum(axis=1), cost.sum(axis=1)
+    # health 模式不計算淨值
+    net = np.zeros(len(codes)) if mode == "health" else score_a - score_b
+    return {"score_A": score_a, "score_B": score_b, "net_score": net}
+
+def score_all_modes(codes):
+    codes = np.asarray(codes, dtype=np.intp)
+    relations = center_relations(codes)
+    return {mode: score_boards(codes, mode, relations) for mode in SCORE_MODES}
+
+# ==============================================================================
+# 特殊格局 (向量化)
+# ==============================================================================
+def pattern_facts(codes):
+    """(N, 5) 棋種代碼 -> 欄位皆為長度 N 陣列的 patterns.BoardFacts"""
+    codes = np.asarray(codes, dtype=np.intp)
+    types, colors = KIND_TYPES[codes].astype(np.intp), KIND_COLORS[codes]
+    red_bits = (colors == 0) * (1 << np.arange(5))
+    red = red_bits.sum(axis=1)
+    counts = tuple((types == t).sum(axis=1) for t in range(7))
+    red_counts = tuple(((types == t) & (colors == 0)).sum(axis=1) for t in range(7))
+
+    eats_out, eats_in, friends = center_relations(codes)
+    neighbor_bits = 1 << np.arange(1, 5)
+    # 消耗：同字同色，即棋種代碼相同
+    consumes = codes[:, 1:] == codes[:, :1]
+    friend_pairs = sum(FRIEND[codes[:, i - 1], codes[:, j - 1]] * (1 << n) for n, (i, j) in enumerate(patterns.PAIRS))
+    exempt = exemption_codes(codes)
+    return patterns.BoardFacts(
+        tuple(types[:, i] for i in range(5)), red, counts, red_counts,
+        (friends * neighbor_bits).sum(axis=1), (consumes * neighbor_bits).sum(axis=1), (eats_in * neighbor_bits).sum(axis=1),
+        friend_pairs, exempt,
+    )
+
+def special_pattern_hits(codes):
+    """{格局 key: 長度 N 陣列}；非 0 表示該盤面符合 (中心關係類為位置遮罩，破壞格為類型遮罩)"""
+    return patterns.evaluate_hits(pattern_facts(codes))
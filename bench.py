@@ -0,0 +1,154 @@
+# ==============================================================================
+# bench.py - rules.py 熱點效能基準
+# ==============================================================================
+# 以固定種子產生三組盤面 (均勻抽樣 / 特殊格局 / 格局最多的最壞情況)，
+# 量測各分析函數的 ops/sec、單次延遲百分位與記憶體配置，並與基準檔比較。
+#
+# python bench.py                    # 執行並與 bench_baseline.json 比較
+# python bench.py --save             # 執行並把結果存成新的基準
+# python bench.py --quick --json     # 小樣本，輸出 JSON
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+from data import LIFE_STAGES
+from rules import (
+    generate_random_gua, generate_full_life_gua, can_eat, check_special_patterns, check_exemption,
+    calculate_score_by_mode, analyze_trinity_detailed, analyze_total_fate, analyze_color_flow,
+    get_decade_advice, get_context, analyze_all, clear_caches, SCORE_MODES
+)
+import gua_table
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+PAIRS = [(e, t) for e in range(1, 6) for t in range(1, 6) if e != t]
+
+# ==============================================================================
+# 固定盤面樣本
+# ==============================================================================
+def _draw(rng):
+    return generate_random_gua(rng)
+
+def build_corpora(size, seed=20240101):
+    rng = random.Random(seed)
+    uniform = [_draw(rng) for _ in range(size)]
+    exemption = []
+    while len(exemption) < size:
+        gua = _draw(rng)
+        if check_exemption(gua): exemption.append(gua)
+    # 最壞情況：從較大的樣本中挑出格局數量最多的盤面
+    pool = [_draw(rng) for _ in range(size * 20)]
+    worst = sorted(pool, key=lambda g: len(check_special_patterns(g)), reverse=True)[:size]
+    clear_caches()
+    return {"uniform": uniform, "exemption": exemption, "worst": worst}
+
+# ==============================================================================
+# 量測項目：每項為 (名稱, 樣本名稱, 單次操作)
+# ==============================================================================
+def _full_life_reading(seed):
+    full_data = generate_full_life_gua(random.Random(seed))
+    analyze_total_fate(full_data); analyze_color_flow(full_data["raw_flow"])
+    for stage in LIFE_STAGES:
+        ctx = get_context(full_data[stage])
+        calculate_score_by_mode(ctx, "general"); get_decade_advice(stage, ctx)
+        check_exemption(ctx); analyze_trinity_detailed(ctx)
+
+def bench_cases():
+    cases = [("can_eat", corpus, lambda g, i: can_eat(*PAIRS[i % len(PAIRS)], g)) for corpus in ["uniform", "exemption"]]
+    cases += [("check_special_patterns", corpus, lambda g, i: check_special_patterns(g)) for corpus in ["uniform", "exemption", "worst"]]
+    cases += [(f"calculate_score_by_mode[{mode}]", "uniform", lambda g, i, mode=mode: calculate_score_by_mode(g, mode)) for mode in SCORE_MODES]
+    cases.append(("single_bundle", "uniform", lambda g, i: analyze_all(g, "男", "general", table=gua_table.get_table())))
+    cases.append(("full_life", "uniform", lambda g, i: _full_life_reading(i)))
+    return cases
+
+def _percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def run_case(op, boards, repeat, warm=False):
+    """回傳 ops/sec、延遲百分位 (微秒) 與單次操作的記憶體峰值 (KiB)"""
+    latencies = []
+    perf_counter_ns = time.perf_counter_ns
+    for _ in range(repeat):
+        for i, gua in enumerate(boards):
+            if not warm: clear_caches()
+            start = perf_counter_ns()
+            op(gua, i)
+            latencies.append(perf_counter_ns() - start)
+    latencies.sort()
+    # 配置量另跑一輪，避免 tracemalloc 影響計時
+    tracemalloc.start()
+    peak = 0
+    for i, gua in enumerate(boards):
+        if not warm: clear_caches()
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        op(gua, i)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    total_s = sum(latencies) / 1e9
+    return {
+        "ops_per_sec": len(latencies) / total_s if total_s else float("inf"),
+        "p50_us": _percentile(latencies, 0.50) / 1e3,
+        "p90_us": _percentile(latencies, 0.90) / 1e3,
+        "p99_us": _percentile(latencies, 0.99) / 1e3,
+        "alloc_peak_kib": peak / 1024,
+    }
+
+def run_all(size, repeat, warm=False, only=None):
+    corpora = build_corpora(size)
+    results = {}
+    for name, corpus, op in bench_cases():
+        key = f"{name}@{corpus}"
+        if only and not any(o in key for o in only): continue
+        results[key] = run_case(op, corpora[corpus], repeat, warm)
+    return results
+
+# ==============================================================================
+# 基準比較
+# ==============================================================================
+def compare(results, baseline, threshold):
+    """ops/sec 比基準慢超過 threshold (比例) 即視為退步"""
+    regressions = []
+    for key, res in results.items():
+        base = baseline.get(key)
+        if not base: continue
+        change = res["ops_per_sec"] / base["ops_per_sec"] - 1
+        res["vs_baseline"] = change
+        if change < -threshold: regressions.append(key)
+    return regressions
+
+def print_table(results):
+    print(f"{'case':<46}{'ops/sec':>12}{'p50 us':>10}{'p90 us':>10}{'p99 us':>10}{'peak KiB':>10}{'vs base':>9}")
+    for key, r in results.items():
+        change = f"{r['vs_baseline']:+.1%}" if "vs_baseline" in r else "-"
+        print(f"{key:<46}{r['ops_per_sec']:>12.0f}{r['p50_us']:>10.1f}{r['p90_us']:>10.1f}{r['p99_us']:>10.1f}{r['alloc_peak_kib']:>10.1f}{change:>9}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="rules.py 熱點效能基準")
+    parser.add_argument("--size", type=int, default=300, help="每組樣本的盤面數")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--quick", action="store_true", help="小樣本快速執行 (size=50, repeat=1)")
+    parser.add_argument("--warm", action="store_true", help="保留每盤快取 (預設每次操作前清除，量測新盤面成本)")
+    parser.add_argument("--only", nargs="*", help="只執行名稱包含這些字串的項目")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save", action="store_true", help="把這次結果寫入基準檔")
+    parser.add_argument("--threshold", type=float, default=0.10, help="判定退步的 ops/sec 下降比例")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    if args.quick: args.size, args.repeat = 50, 1
+
+    results = run_all(args.size, args.repeat, args.warm, args.only)
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline, encoding="utf-8") as f: regressions = compare(results, json.load(f), args.threshold)
+    if args.save:
+        with open(args.baseline, "w", encoding="utf-8") as f: json.dump(results, f, indent=2)
+    if args.json: print(json.dumps({"results": results, "regressions": regressions}, indent=2))
+    else:
+        print_table(results)
+        if regressions: print(f"\n效能退步 (> {args.threshold:.0%})：" + ", ".join(regressions))
+    sys.exit(1 if regressions else 0)
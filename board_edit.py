@@ -0,0 +1,98 @@
+# ==============================================================================
+# board_edit.py - 手動排盤與單一位置換棋的增量重算
+# ==============================================================================
+# 諮詢時常把實體抽到的棋輸入系統，或示範「如果位4換成紅仕會怎樣」。
+# 換一支棋只影響與該位置有關的部分：
+#   GuaContext.with_piece()  好朋友/消耗/吃子矩陣只重算該位置的列與欄
+#   patterns.reevaluate()    只重新判斷讀到變動事實的格局規則
+#   各模式分數               該位置與中心無互動 (換棋前後皆然) 時沿用原本的計分，並回報每個模式的差額
+# 分析結果以盤面編碼存在行程內的 LRU，session 只需保存盤面本身。
+
+import os
+from collections import namedtuple
+
+from cache import LRUCache
+from data import DECK_COUNTS, PIECE_KINDS
+from gua import Gua
+from patterns import board_facts, evaluate_by_rule, reevaluate
+from rules import SCORE_MODES, cached_call, calculate_score_by_mode, check_special_patterns, get_context
+
+# ctx: GuaContext；facts: patterns.BoardFacts；by_rule: 各格局規則的輸出；scores: {模式: calculate_score_by_mode 結果}
+BoardAnalysis = namedtuple("BoardAnalysis", "ctx facts by_rule scores")
+
+_ANALYSES = LRUCache(int(os.environ.get("XIANGBU_EDIT_CACHE_SIZE", "4096")))
+
+def piece_label(kind):
+    name, color = PIECE_KINDS[kind]
+    return color + name
+
+# ==============================================================================
+# 牌組張數
+# ==============================================================================
+def deck_violations(codes):
+    """超過一副棋張數的棋種 (例如兩支紅帥)；空串列表示可以排出這個盤面"""
+    codes = list(codes)
+    return [piece_label(k) for k in sorted(set(codes)) if codes.count(k) > DECK_COUNTS[k]]
+
+def valid_kinds(gua, pos):
+    """位置 pos 可以換成的棋種 (扣掉其他四個位置已用掉的張數，含原本的棋)"""
+    others = [k for i, k in enumerate(gua.codes) if i != pos - 1]
+    return [k for k in range(len(PIECE_KINDS)) if others.count(k) < DECK_COUNTS[k]]
+
+def replace(gua, pos, kind):
+    codes = bytearray(gua.codes); codes[pos - 1] = kind
+    return Gua(codes)
+
+# ==============================================================================
+# 分析與增量重算
+# ==============================================================================
+def analyze_board(gua):
+    """完整分析一個盤面 (依盤面快取)"""
+    def compute():
+        ctx = get_context(gua)
+        facts = board_facts(ctx)
+        return BoardAnalysis(ctx, facts, evaluate_by_rule(facts),
+                             {mode: cached_call(calculate_score_by_mode, ctx, mode) for mode in SCORE_MODES})
+    return _ANALYSES.get_or_compute(gua.codes, compute)
+
+def _center_relations(ctx, i): return (ctx.eats[0][i], ctx.eats[i][0], ctx.friends[0][i])
+
+def _untouched(old_ctx, new_ctx, pos):
+    # 換的鄰位前後都與中心無互動，且其他鄰位與中心的關係不變 (特殊格局改變時可能不同)：
+    # 除了健康模式 (逐一列出鄰位) 之外，計分不變
+    if pos == 1: return False
+    i = pos - 1
+    if any(_center_relations(old_ctx, i)) or any(_center_relations(new_ctx, i)): return False
+    return all(_center_relations(old_ctx, j) == _center_relations(new_ctx, j) for j in range(1, 5) if j != i)
+
+def edit(gua, pos, kind):
+    """盤面 gua 的位置 pos 換成棋種 kind：回傳 (新盤面的 BoardAnalysis, 變化摘要)"""
+    before = analyze_board(gua)
+    new_gua = replace(gua, pos, kind)
+    after = _ANALYSES.get(new_gua.codes)
+    rechecked = None
+    if after is None:
+        ctx = before.ctx.with_piece(pos, kind)
+        facts = board_facts(ctx)
+        by_rule, rechecked = reevaluate(before.facts, before.by_rule, facts)
+        # 新盤面的格局也放進共用快取，之後 cached_call(check_special_patterns, ...) 不必再算
+        cached_call(check_special_patterns, ctx, compute=lambda: [p for out in by_rule for p in out])
+        untouched = _untouched(before.ctx, ctx, pos)
+        scores = {}
+        for mode in SCORE_MODES:
+            reuse = untouched and mode != "health"
+            compute = (lambda mode=mode: before.scores[mode]) if reuse else (lambda mode=mode: calculate_score_by_mode(ctx, mode))
+            scores[mode] = cached_call(calculate_score_by_mode, ctx, mode, compute=compute)
+        after = BoardAnalysis(ctx, facts, by_rule, scores)
+        _ANALYSES.put(new_gua.codes, after)
+
+    old_names = [p["name"] for out in before.by_rule for p in out]
+    new_names = [p["name"] for out in after.by_rule for p in out]
+    delta = {
+        "pos": pos, "old": piece_label(gua.kind(pos)), "new": piece_label(kind),
+        "added": [name for name in new_names if name not in old_names],
+        "removed": [name for name in old_names if name not in new_names],
+        "scores": {mode: (before.scores[mode]["net_score"], after.scores[mode]["net_score"]) for mode in SCORE_MODES},
+        "rechecked": rechecked,   # None 表示新盤面之前已分析過，直接取用
+    }
+    return after, delta
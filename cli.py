@@ -0,0 +1,213 @@
+# ==============================================================================
+# cli.py - 批次解卦命令列工具 (不經過 Streamlit)
+# ==============================================================================
+# 逐筆讀入盤面、逐筆輸出結果，記憶體用量與筆數無關。
+#
+# 輸入 (JSON Lines，每行一筆)：
+#   {"id": "A01", "board": ["黑馬", "紅兵", "包", "卒", "包"]}    位置 1~5 的棋子 (可省略顏色)
+#   {"id": "A02", "board": 123456}                                棋盤 ID (見 rules.encode_gua)
+#   {"id": "A03", "board": [[1, "馬", "黑"], [2, "兵", "紅"], ...]}
+#   {"id": "A04", "deck": ["黑馬", "紅兵", ...]}                  全盤流年：至少 30 支，依序每 5 支一個階段
+# 輸入 (CSV)：欄位 id 與 board 或 deck，棋子以空白分隔；或 p1~p5 五個欄位；或 board 填棋盤 ID。
+#
+# python cli.py --input clients.jsonl --output readings.jsonl --workers 4
+# python cli.py --input clients.csv --analyses check_special_patterns calculate_score_by_mode --modes general love
+# python cli.py --count 10000 --seed 7 --full-life --format csv
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import random
+import sys
+from multiprocessing import Pool
+
+from data import DECK_COUNTS, KIND_INDEX, LIFE_STAGES, PIECE_KINDS
+from gua import Gua
+from rules import (
+    BOARD_ID_SPACE, BOARD_ANALYZERS, GENDER_ANALYZERS, calculate_score_by_mode, calculate_net_gain_from_gua,
+    analyze_total_fate, get_decade_advice, cached_call, SCORE_MODES
+)
+import sampler
+
+ANALYZERS = {fn.__name__: fn for fn in BOARD_ANALYZERS + [calculate_net_gain_from_gua]}
+GENDER_ANALYZER_NAMES = {fn.__name__: fn for fn in GENDER_ANALYZERS}
+ANALYSIS_NAMES = ["calculate_score_by_mode"] + list(ANALYZERS) + list(GENDER_ANALYZER_NAMES)
+DEFAULT_ANALYSES = ["calculate_score_by_mode", "check_special_patterns", "check_exemption", "analyze_trinity_detailed"]
+# 只有棋名時依棋名判斷顏色 (紅黑兩方的棋名不重複)
+NAME_INDEX = {name: i for i, (name, _) in enumerate(PIECE_KINDS)}
+
+# ==============================================================================
+# 輸入解析
+# ==============================================================================
+def parse_piece(label):
+    """'黑馬' / '馬' -> 棋種代碼"""
+    label = label.strip()
+    if len(label) == 2 and (label[1], label[0]) in KIND_INDEX: return KIND_INDEX[(label[1], label[0])]
+    if label in NAME_INDEX: return NAME_INDEX[label]
+    raise ValueError(f"無法辨識的棋子: {label!r}")
+
+def _split_pieces(value):
+    if isinstance(value, str): return value.replace(",", " ").split()
+    return value
+
+def _check_counts(codes):
+    for k in set(codes):
+        if codes.count(k) > DECK_COUNTS[k]: raise ValueError(f"{''.join(reversed(PIECE_KINDS[k]))} 超過一副棋的張數")
+
+def parse_board(value):
+    if isinstance(value, int) or (isinstance(value, str) and value.strip().isdigit()):
+        board_id = int(value)
+        if not 0 <= board_id < BOARD_ID_SPACE: raise ValueError(f"棋盤 ID 超出範圍: {board_id}")
+        gua = Gua.from_board_id(board_id)
+    else:
+        pieces = _split_pieces(value)
+        if len(pieces) != 5: raise ValueError(f"盤面需要 5 支棋，收到 {len(pieces)} 支")
+        gua = Gua(parse_piece(p) for p in pieces) if all(isinstance(p, str) for p in pieces) else Gua.from_pieces(pieces)
+    _check_counts(list(gua.codes))
+    return gua
+
+def parse_deck(value):
+    pieces = _split_pieces(value)
+    if len(pieces) < 5 * len(LIFE_STAGES): raise ValueError(f"全盤流年需要至少 {5 * len(LIFE_STAGES)} 支棋")
+    codes = [parse_piece(p) for p in pieces]
+    _check_counts(codes)
+    return [Gua(codes[i * 5:i * 5 + 5]) for i in range(len(LIFE_STAGES))]
+
+def read_jsonl(stream):
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line: continue
+        try: record = json.loads(line)
+        except ValueError as e:
+            yield {"id": f"line {line_no}", "error": f"JSON 格式錯誤: {e}"}; continue
+        if isinstance(record, dict): yield record
+        else: yield {"id": f"line {line_no}", "error": f"每行需為 JSON 物件，收到 {type(record).__name__}"}
+
+def read_csv(stream):
+    for row in csv.DictReader(stream):
+        if not row.get("board") and all(row.get(f"p{i}") for i in range(1, 6)):
+            row["board"] = [row[f"p{i}"] for i in range(1, 6)]
+        yield row
+
+def generate_records(count, seed, full_life=False, valid_only=False):
+    rng = random.Random(seed)
+    draw = sampler.draw_valid_gua if valid_only else sampler.draw_gua
+    for i in range(count):
+        if full_life: yield {"id": i, "deck": [color + name for name, color in sampler.deck_pieces(sampler.draw_deck(rng))]}
+        else: yield {"id": i, "board": draw(rng).board_id}
+
+# ==============================================================================
+# 分析 (在工作行程中執行)
+# ==============================================================================
+def _describe(gua): return " ".join(color + name for _, name, color, _ in gua)
+
+def analyze_board(gua, analyses, modes, gender):
+    result = {"board_id": gua.board_id, "board": _describe(gua)}
+    for name in analyses:
+        if name == "calculate_score_by_mode":
+            result[name] = {mode: cached_call(calculate_score_by_mode, gua, mode) for mode in modes}
+        elif name in GENDER_ANALYZER_NAMES:
+            result[name] = cached_call(GENDER_ANALYZER_NAMES[name], gua, gender)
+        else:
+            result[name] = cached_call(ANALYZERS[name], gua)
+    return result
+
+def process_record(record, analyses, modes, gender):
+    """一筆輸入 -> 一筆輸出；錯誤不中斷批次，改以 error 欄位回報"""
+    if not isinstance(record, dict): return {"id": None, "error": f"無效的輸入紀錄: {record!r}"}
+    out = {"id": record.get("id")}
+    if record.get("error"):
+        out["error"] = record["error"]; return out
+    try:
+        if record.get("deck"):
+            stages = parse_deck(record["deck"])
+            out["total_fate"] = analyze_total_fate(dict(zip(LIFE_STAGES, stages)))
+            out["stages"] = {stage: dict(analyze_board(gua, analyses, modes, gender), advice=get_decade_advice(stage, gua))
+                             for stage, gua in zip(LIFE_STAGES, stages)}
+        elif record.get("board") not in (None, ""):
+            out.update(analyze_board(parse_board(record["board"]), analyses, modes, gender))
+        else:
+            out["error"] = "缺少 board 或 deck 欄位"
+    except (KeyError, ValueError, TypeError, IndexError) as e:
+        out["error"] = str(e)
+    return out
+
+def _process(args): return process_record(*args)
+
+def run(records, analyses, modes, gender, workers=1, chunksize=64):
+    """依輸入順序產生結果；多行程時每次只送出有限批量，避免整個輸入被讀進記憶體"""
+    tasks = ((record, analyses, modes, gender) for record in records)
+    if workers <= 1:
+        yield from map(_process, tasks)
+        return
+    window = workers * chunksize * 4
+    with Pool(workers) as pool:
+        while True:
+            batch = list(itertools.islice(tasks, window))
+            if not batch: break
+            yield from pool.imap(_process, batch, chunksize)
+
+# ==============================================================================
+# 輸出
+# ==============================================================================
+def write_jsonl(results, stream):
+    for result in results: stream.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+def write_csv(results, stream, analyses):
+    """巢狀結果 (格局清單、各模式分數、全盤流年各階段) 以 JSON 字串放在欄位中"""
+    fields = ["id", "board_id", "board"] + list(analyses) + ["total_fate", "stages", "error"]
+    writer = csv.DictWriter(stream, fieldnames=fields, extrasaction="ignore")
+    writer.writeheader()
+    for result in results:
+        writer.writerow({k: v if isinstance(v, (str, int, float, type(None))) else json.dumps(v, ensure_ascii=False) for k, v in result.items()})
+
+def _detect_format(path, default="jsonl"):
+    return "csv" if path and path.lower().endswith(".csv") else default
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批次解卦：逐筆讀入盤面 (JSON Lines / CSV)，逐筆輸出分析結果")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="輸入檔路徑 (- 為標準輸入)")
+    source.add_argument("--count", type=int, help="改為隨機產生指定筆數")
+    parser.add_argument("--seed", type=int, default=0, help="搭配 --count 使用的亂數種子")
+    parser.add_argument("--full-life", action="store_true", help="搭配 --count：每筆為一副全盤流年")
+    parser.add_argument("--valid-only", action="store_true", help="搭配 --count：只產生成卦 (非全同色) 的盤面，不需重抽")
+    parser.add_argument("--input-format", choices=["jsonl", "csv"], help="預設依副檔名判斷")
+    parser.add_argument("--output", default="-", help="輸出檔路徑 (預設標準輸出)")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="輸出格式，預設依副檔名判斷")
+    parser.add_argument("--analyses", nargs="+", default=DEFAULT_ANALYSES, choices=ANALYSIS_NAMES, metavar="NAME",
+                        help="要執行的分析 (可選：" + ", ".join(ANALYSIS_NAMES) + ")")
+    parser.add_argument("--modes", nargs="+", default=["general"], choices=SCORE_MODES, help="calculate_score_by_mode 的模式")
+    parser.add_argument("--gender", default="男", choices=["男", "女"])
+    parser.add_argument("--workers", type=int, default=1, help=f"工作行程數 (本機 CPU：{os.cpu_count()})")
+    parser.add_argument("--chunksize", type=int, default=64)
+    args = parser.parse_args()
+
+    in_stream = None
+    if args.count is not None:
+        records = generate_records(args.count, args.seed, args.full_life, args.valid_only)
+    else:
+        in_stream = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8", newline="")
+        reader = read_csv if (args.input_format or _detect_format(args.input)) == "csv" else read_jsonl
+        records = reader(in_stream)
+    out_stream = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8", newline="")
+
+    errors = total = 0
+    def counted(results):
+        global errors, total
+        for result in results:
+            total += 1
+            if "error" in result: errors += 1
+            yield result
+
+    results = counted(run(records, args.analyses, args.modes, args.gender, args.workers, args.chunksize))
+    try:
+        if (args.format or _detect_format(args.output)) == "csv": write_csv(results, out_stream, args.analyses)
+        else: write_jsonl(results, out_stream)
+    finally:
+        if in_stream not in (None, sys.stdin): in_stream.close()
+        if out_stream is not sys.stdout: out_stream.close()
+    print(f"完成 {total} 筆，錯誤 {errors} 筆", file=sys.stderr)
+    sys.exit(1 if errors else 0)
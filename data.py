@@ -15,6 +15,16 @@ PIECE_NAMES = {
     '黑': ['將', '士', '象', '馬', '包', '車', '卒'],
 }
 
+# 棋種編碼 (名稱, 顏色)：索引即棋種代碼 0~13，順序與 get_full_deck() 相同
+PIECE_KINDS = [
+    ('帥', '紅'), ('仕', '紅'), ('相', '紅'), ('俥', '紅'), ('傌', '紅'), ('炮', '紅'), ('兵', '紅'),
+    ('將', '黑'), ('士', '黑'), ('象', '黑'), ('車', '黑'), ('馬', '黑'), ('包', '黑'), ('卒', '黑'),
+]
+KIND_INDEX = {kind: i for i, kind in enumerate(PIECE_KINDS)}
+
+# 每個棋種在一副棋中的張數
+DECK_COUNTS = [1, 2, 2, 2, 2, 2, 5, 1, 2, 2, 2, 2, 2, 5]
+
 # 年齡階段定義
 LIFE_STAGES = [
     "11~20歲 (青少年)", 
@@ -0,0 +1,143 @@
+# ==============================================================================
+# group.py - 團體相容性矩陣
+# ==============================================================================
+# 工作坊每位成員各抽一個盤面，兩兩比較「我的中心放進對方的盤面」會怎樣：
+#   friends[i, j]   i 的中心與 j 的四個鄰位有幾個是好朋友 (check_good_friend)
+#   consumes[i, j]  ... 幾個是消耗 (check_consumption，同字同色)
+#   eats_out[i, j]  i 的中心站在 j 的位 1 時吃得到 j 的幾個鄰位 (can_eat，含 check_exemption 的覆寫)
+#   eats_in[i, j]   j 的鄰位有幾個吃得到 i 的中心
+#   scores[mode][i, j]  該組合盤面的 calculate_score_by_mode net_score (例如 love / transaction)
+# 矩陣不對稱：第 i 列只取決於 i 的中心棋種，因此只需對「出現過的中心棋種 (最多 14 種) x N 個盤面」
+# 做一次 batch.py 的向量化計算，再依中心棋種展開成 N x N。
+# 分群：以雙向平均分數 (scores[i, j] + scores[j, i]) / 2 為親和度做平均連結的階層式分群，
+# 直到剩下指定群數，或任兩群之間的平均親和度都不再高於全體配對的平均 (只留下「比一般配對更合」的群)。
+#
+# python group.py --input team.jsonl [--modes love transaction] [--cluster-mode transaction] [--clusters 4] [--out grid.json]
+# python group.py --random 200 --seed 7            (隨機盤面，示範/測速用)
+#   輸入格式同 cli.py：{"id": "A01", "board": ["黑馬", "紅兵", "包", "卒", "包"]}
+
+import argparse
+import json
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import batch
+from board_edit import piece_label
+from cli import parse_board, read_jsonl
+import sampler
+
+# friends / consumes / eats_out / eats_in: (N, N) 整數陣列；scores: {模式: (N, N) float 陣列}
+GroupMatrix = namedtuple("GroupMatrix", "friends consumes eats_out eats_in scores")
+
+def group_matrix(codes, modes=("love", "transaction")):
+    """(N, 5) 棋種代碼 -> GroupMatrix"""
+    codes = np.asarray(codes, dtype=np.intp)
+    n = len(codes)
+    centers, row_of = np.unique(codes[:, 0], return_inverse=True)
+    # 組合盤面：第 c 種中心棋種放進第 j 個盤面的位 1，共 len(centers) * N 個
+    pairs = np.repeat(codes[None, :, :], len(centers), axis=0)
+    pairs[:, :, 0] = centers[:, None]
+    pairs = pairs.reshape(-1, 5)
+
+    relations = batch.center_relations(pairs)
+    eats_out, eats_in, friends = relations
+    consumes = pairs[:, 1:] == pairs[:, :1]
+
+    def expand(values): return values.reshape(len(centers), n)[row_of]
+    return GroupMatrix(
+        expand(friends.sum(axis=1)), expand(consumes.sum(axis=1)), expand(eats_out.sum(axis=1)), expand(eats_in.sum(axis=1)),
+        {mode: expand(batch.score_boards(pairs, mode, relations)["net_score"]) for mode in modes},
+    )
+
+# ==============================================================================
+# 分群
+# ==============================================================================
+def mutual_affinity(scores):
+    """雙向平均分數，對角線 (自己與自己) 為 0"""
+    affinity = (scores + scores.T) / 2.0
+    np.fill_diagonal(affinity, 0.0)
+    return affinity
+
+def cluster(affinity, clusters=None):
+    """平均連結階層式分群：每次合併平均親和度最高的兩群。
+    clusters 為 None 時合併到任兩群的平均親和度都 <= 0 為止 (affinity 可先減去基準值)。回傳 [[成員索引, ...], ...] (大群在前)"""
+    n = len(affinity)
+    members = [[i] for i in range(n)]
+    link = affinity.astype(np.float64).copy()
+    np.fill_diagonal(link, -np.inf)
+    alive = np.ones(n, dtype=bool)
+    target = max(clusters or 1, 1)
+    while alive.sum() > target:
+        a, b = np.unravel_index(np.argmax(link), link.shape)
+        if clusters is None and link[a, b] <= 0: break
+        a, b = min(a, b), max(a, b)
+        size_a, size_b = len(members[a]), len(members[b])
+        # 合併後與其他群的平均親和度 = 兩群的加權平均 (Lance-Williams)
+        merged = (link[a] * size_a + link[b] * size_b) / (size_a + size_b)
+        link[a], link[:, a] = merged, merged
+        link[a, a] = -np.inf
+        link[b], link[:, b] = -np.inf, -np.inf
+        members[a] += members[b]; members[b] = []
+        alive[b] = False
+    return sorted((sorted(m) for m in members if m), key=lambda m: (-len(m), m[0]))
+
+def summarize(ids, codes, grid, cluster_mode, clusters=None):
+    """分群摘要：各群成員、群內平均親和度，以及每位成員最合得來的對象"""
+    affinity = mutual_affinity(grid.scores[cluster_mode])
+    n = len(ids)
+    baseline = affinity.sum() / (n * (n - 1)) if n > 1 else 0.0
+    groups = cluster(affinity - baseline, clusters)
+    masked = np.where(np.eye(len(ids), dtype=bool), -np.inf, affinity)
+    best = masked.argmax(axis=1) if len(ids) > 1 else np.zeros(len(ids), dtype=np.intp)
+    return {
+        "mode": cluster_mode, "baseline_affinity": float(baseline),
+        "clusters": [{
+            "members": [ids[i] for i in group],
+            "centers": sorted({piece_label(codes[i][0]) for i in group}),
+            "mean_affinity": float(affinity[np.ix_(group, group)].sum() / (len(group) * (len(group) - 1))) if len(group) > 1 else None,
+        } for group in groups],
+        "best_partner": {ids[i]: {"id": ids[j], "affinity": float(affinity[i, j])} for i, j in enumerate(best) if i != j},
+    }
+
+def to_report(ids, codes, grid, cluster_mode, clusters=None):
+    matrices = {key: getattr(grid, key).tolist() for key in ("friends", "consumes", "eats_out", "eats_in")}
+    matrices["scores"] = {mode: values.tolist() for mode, values in grid.scores.items()}
+    return {"ids": ids, "matrix": matrices, "summary": summarize(ids, codes, grid, cluster_mode, clusters)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="團體相容性矩陣：成員兩兩之間的好朋友/消耗/吃子關係與分數，並分群")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="JSON Lines，每行 {\"id\", \"board\"} (格式同 cli.py)")
+    source.add_argument("--random", type=int, help="改用 N 個隨機成卦盤面")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--modes", nargs="+", default=["love", "transaction"], choices=batch.SCORE_MODES)
+    parser.add_argument("--cluster-mode", default="transaction", choices=batch.SCORE_MODES, help="分群使用的分數模式")
+    parser.add_argument("--clusters", type=int, default=None, help="群數 (預設合併到群間平均親和度不再為正)")
+    parser.add_argument("--out", default="-", help="輸出 JSON 路徑 (預設印出)")
+    args = parser.parse_args()
+
+    if args.input:
+        ids, boards = [], []
+        with open(args.input, encoding="utf-8") as f:
+            for n, record in enumerate(read_jsonl(f), 1):
+                try: boards.append(parse_board(record["board"]).codes)
+                except KeyError: sys.exit(f"第 {n} 筆：{record.get('error', '缺少 board')}")
+                except ValueError as e: sys.exit(f"第 {n} 筆：{e}")
+                ids.append(str(record.get("id", n)))
+        codes = np.frombuffer(b"".join(boards), dtype=np.uint8).reshape(-1, 5).astype(np.intp)
+    else:
+        codes = sampler.sample_valid_boards(args.random, args.seed).astype(np.intp)
+        ids = [f"M{i + 1:03d}" for i in range(len(codes))]
+    if len(codes) == 0: sys.exit("沒有任何盤面")
+
+    modes = list(dict.fromkeys(args.modes + [args.cluster_mode]))
+    start = time.perf_counter()
+    grid = group_matrix(codes, modes)
+    print(f"{len(codes)} 人，{len(codes) ** 2} 組配對，矩陣計算 {(time.perf_counter() - start) * 1e3:.1f} ms", file=sys.stderr)
+    text = json.dumps(to_report(ids, codes, grid, args.cluster_mode, args.clusters), ensure_ascii=False)
+    if args.out == "-": print(text)
+    else:
+        with open(args.out, "w", encoding="utf-8") as f: f.write(text)
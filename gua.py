@@ -0,0 +1,115 @@
+# ==============================================================================
+# gua.py - 盤面型別 (整數編碼)
+# ==============================================================================
+from collections.abc import Mapping
+
+from data import DECK_COUNTS, LIFE_STAGES, PIECE_KINDS, KIND_INDEX, VALUE_MAP
+
+POSITIONS = [1, 2, 3, 4, 5]
+
+# 棋種代碼 0~6 為紅、7~13 為黑，同一字的紅黑代碼相差 7
+RED, BLACK = 0, 1
+KIND_COLOR = [k // 7 for k in range(len(PIECE_KINDS))]
+KIND_TYPE = [k % 7 for k in range(len(PIECE_KINDS))]
+
+# 每個 (位置, 棋種) 的棋子 tuple 事先建好，取用時不必重建
+_PIECES = [None] + [
+    [(pos, name, color, VALUE_MAP.get(name, 0)) for name, color in PIECE_KINDS] for pos in POSITIONS
+]
+
+class Gua:
+    """五支棋盤面：依位置 1~5 存放棋種代碼，相容 (pos, name, color, value) 串列的介面"""
+    __slots__ = ("codes",)
+
+    def __init__(self, codes):
+        codes = bytes(codes)
+        if len(codes) != 5 or max(codes) >= len(PIECE_KINDS): raise ValueError(f"無效的盤面編碼: {codes!r}")
+        self.codes = codes
+
+    @classmethod
+    def from_pieces(cls, pieces):
+        codes = bytearray(5)
+        positions = []
+        for pos, name, color, *_ in pieces:
+            if pos not in POSITIONS: raise ValueError(f"無效的盤面位置: {pos!r} (應為 1~5)")
+            codes[pos - 1] = KIND_INDEX[(name, color)]
+            positions.append(pos)
+        if sorted(positions) != POSITIONS: raise ValueError(f"盤面位置不完整: {positions}")
+        return cls(codes)
+
+    @classmethod
+    def from_board_id(cls, board_id):
+        codes = bytearray(5)
+        for i in range(5): board_id, codes[i] = divmod(board_id, 14)
+        return cls(codes)
+
+    @classmethod
+    def from_bytes(cls, data): return cls(data)
+
+    @property
+    def board_id(self):
+        c = self.codes
+        return c[0] + 14 * (c[1] + 14 * (c[2] + 14 * (c[3] + 14 * c[4])))
+
+    def to_bytes(self): return self.codes
+
+    def kind(self, pos): return self.codes[pos - 1]
+
+    def piece(self, pos): return _PIECES[pos][self.codes[pos - 1]]
+
+    # --- 串列相容介面 ---
+    def __len__(self): return 5
+
+    def __iter__(self):
+        for pos in POSITIONS: yield _PIECES[pos][self.codes[pos - 1]]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice): return list(self)[index]
+        if index < 0: index += 5
+        if not 0 <= index < 5: raise IndexError("Gua index out of range")
+        return _PIECES[index + 1][self.codes[index]]
+
+    def __eq__(self, other):
+        if isinstance(other, Gua): return self.codes == other.codes
+        if isinstance(other, (list, tuple)): return list(self) == list(other)
+        return NotImplemented
+
+    def __hash__(self): return hash(self.codes)
+
+    def __repr__(self): return f"Gua({list(self)!r})"
+
+# 整副牌 (32 支) 排序後的代碼，用來檢查是否為完整牌組的排列
+_SORTED_DECK = bytes(k for k, count in enumerate(DECK_COUNTS) for _ in range(count))
+FULL_LIFE_KEYS = ("raw_flow", *LIFE_STAGES, "餘棋")
+
+class FullLifeGua(Mapping):
+    """全盤流年：洗好的整副牌以 32 bytes 存放 (每支一個棋種代碼)，
+    相容 generate_full_life_gua 原本的 dict 介面 (raw_flow、各階段盤面、餘棋)，取用時才解碼"""
+    __slots__ = ("codes",)
+
+    def __init__(self, codes):
+        codes = bytes(codes)
+        if sorted(codes) != list(_SORTED_DECK): raise ValueError(f"不是完整牌組的排列: {codes!r}")
+        self.codes = codes
+
+    def to_bytes(self): return self.codes
+
+    def stage(self, index): return Gua(self.codes[index * 5:index * 5 + 5])
+
+    def __getitem__(self, key):
+        if key == "raw_flow": return [PIECE_KINDS[k] for k in self.codes]
+        if key == "餘棋": return [PIECE_KINDS[k] for k in self.codes[len(LIFE_STAGES) * 5:]]
+        try: return self.stage(LIFE_STAGES.index(key))
+        except ValueError: raise KeyError(key) from None
+
+    def __iter__(self): return iter(FULL_LIFE_KEYS)
+
+    def __len__(self): return len(FULL_LIFE_KEYS)
+
+    def __eq__(self, other):
+        if isinstance(other, FullLifeGua): return self.codes == other.codes
+        return Mapping.__eq__(self, other)
+
+    def __hash__(self): return hash(self.codes)
+
+    def __repr__(self): return f"FullLifeGua({self.codes.hex()})"
@@ -0,0 +1,197 @@
+# ==============================================================================
+# gua_table.py - 全盤面預先計算表
+# ==============================================================================
+# 五支棋的盤面是有限的 (14 種棋子 x 5 個位置，受 get_full_deck() 張數限制)，
+# 因此可以事先對每一種盤面跑一次 rules.py 的分析，存成以棋盤 ID 為索引的定長紀錄表。
+# 請求時只需查表，不必再重複執行 can_eat / 格局掃描。
+#
+# 建表：python gua_table.py build [--out gua_table.bin] [--workers 4]
+# 查表：lookup(current_gua) -> dict (表不存在時回傳 None)
+# 檔頭記錄建表時 RULES_SOURCES 的雜湊；規則改過 (雜湊不符) 的舊表不會被載入，改回即時分析並印出警告。
+
+import argparse
+import hashlib
+import itertools
+import json
+import mmap
+import os
+import struct
+import sys
+from multiprocessing import Pool
+
+from data import DECK_COUNTS, PIECE_KINDS
+from rules import BOARD_ID_SPACE, BOARD_ANALYZERS, GENDER_ANALYZERS, board_fingerprint, decode_gua, calculate_score_by_mode, SCORE_MODES
+
+TABLE_MAGIC = b"XQGT"
+TABLE_VERSION = 1
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_TABLE_PATH = os.environ.get("XIANGBU_TABLE", os.path.join(HERE, "gua_table.bin"))
+# 決定分析結果的原始碼：任何一個改動都會讓已建好的表失效
+RULES_SOURCES = ("rules.py", "patterns.py", "data.py", "gua.py")
+
+def rules_hash():
+    """RULES_SOURCES 內容的 SHA-256 (換行統一為 LF，不受 checkout 的換行設定影響)"""
+    digest = hashlib.sha256()
+    for name in RULES_SOURCES:
+        with open(os.path.join(HERE, name), "rb") as f: digest.update(name.encode() + b"\0" + f.read().replace(b"\r\n", b"\n"))
+    return digest.hexdigest()
+
+# 目錄欄位：每個盤面只存「分析結果在目錄中的索引」(0 保留給不存在的盤面)
+# 欄位與 analyze_all 相同；名稱中的 ":男" / ":女" 代表與性別相關的結果，查表時合併成 {"男": ..., "女": ...}
+CATALOG_COLUMNS = [(fn.__name__, fn) for fn in BOARD_ANALYZERS] + [
+    (f"{fn.__name__}:{gender}", lambda g, fn=fn, gender=gender: fn(g, gender))
+    for fn in GENDER_ANALYZERS for gender in ["男", "女"]
+]
+
+# JSON 無 tuple，需還原的欄位
+_DECODERS = {"check_exemption": lambda v: tuple(v) if v else None}
+
+# ==============================================================================
+# 建表
+# ==============================================================================
+def iter_board_ids(first_kind=None):
+    """列出所有可能抽出的盤面 ID (可限定位置 1 的棋種，用於分段建表)"""
+    first_kinds = range(len(PIECE_KINDS)) if first_kind is None else [first_kind]
+    for first in first_kinds:
+        for rest in itertools.product(range(len(PIECE_KINDS)), repeat=4):
+            kinds = (first,) + rest
+            if any(kinds.count(k) > DECK_COUNTS[k] for k in set(kinds)): continue
+            yield sum(k * 14 ** i for i, k in enumerate(kinds))
+
+def _half_units(score):
+    # 分數皆為 0.5 的倍數，存成 0~255 的整數
+    half = int(score * 2)
+    if half != score * 2 or not 0 <= half <= 255: raise ValueError(f"分數超出紀錄範圍: {score}")
+    return half
+
+def _build_chunk(first_kind):
+    """分析位置 1 為指定棋種的所有盤面，回傳 (區域目錄, 紀錄列)"""
+    catalogs = {name: {} for name, _ in CATALOG_COLUMNS}
+    rows = []
+    for board_id in iter_board_ids(first_kind):
+        gua = decode_gua(board_id)
+        indexes = []
+        for name, fn in CATALOG_COLUMNS:
+            value = json.dumps(fn(gua), ensure_ascii=False)
+            indexes.append(catalogs[name].setdefault(value, len(catalogs[name])))
+        scores = []
+        for mode in SCORE_MODES:
+            report = calculate_score_by_mode(gua, mode)
+            scores.extend([_half_units(report["score_A"]), _half_units(report["score_B"])])
+        rows.append((board_id, indexes, scores))
+    return {name: list(c) for name, c in catalogs.items()}, rows
+
+def build_table(path=DEFAULT_TABLE_PATH, workers=1):
+    if workers > 1:
+        with Pool(workers) as pool: chunks = pool.map(_build_chunk, range(len(PIECE_KINDS)))
+    else:
+        chunks = [_build_chunk(k) for k in range(len(PIECE_KINDS))]
+
+    # 合併各段的區域目錄
+    catalogs = {name: {} for name, _ in CATALOG_COLUMNS}
+    remaps = []
+    for local_catalogs, _ in chunks:
+        remap = {}
+        for name, values in local_catalogs.items():
+            remap[name] = [catalogs[name].setdefault(v, len(catalogs[name]) + 1) for v in values]
+        remaps.append(remap)
+
+    widths = "".join("B" if len(catalogs[name]) < 256 else "H" for name, _ in CATALOG_COLUMNS)
+    record = struct.Struct("<" + widths + "B" * (2 * len(SCORE_MODES)))
+    records = bytearray(record.size * BOARD_ID_SPACE)
+    for (_, rows), remap in zip(chunks, remaps):
+        for board_id, indexes, scores in rows:
+            fields = [remap[name][i] for (name, _), i in zip(CATALOG_COLUMNS, indexes)]
+            record.pack_into(records, board_id * record.size, *fields, *scores)
+
+    header = json.dumps({
+        "record_format": record.format,
+        "columns": [name for name, _ in CATALOG_COLUMNS],
+        "catalogs": {name: list(c) for name, c in catalogs.items()},
+        "modes": SCORE_MODES,
+        "rules_hash": rules_hash(),
+    }, ensure_ascii=False).encode("utf-8")
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(TABLE_MAGIC + struct.pack("<HI", TABLE_VERSION, len(header)))
+        f.write(header)
+        f.write(records)
+    os.replace(tmp_path, path)
+    return sum(len(rows) for _, rows in chunks)
+
+# ==============================================================================
+# 查表
+# ==============================================================================
+class StaleTableError(ValueError):
+    """盤面表是以不同版本的規則建立的"""
+
+class GuaTable:
+    def __init__(self, path=DEFAULT_TABLE_PATH, check_rules=True):
+        with open(path, "rb") as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._buf[:4] != TABLE_MAGIC: raise ValueError(f"{path} 不是盤面表檔案")
+        version, header_len = struct.unpack_from("<HI", self._buf, 4)
+        if version != TABLE_VERSION: raise ValueError(f"盤面表版本不符 ({version})，請重新建表")
+        header = json.loads(self._buf[10:10 + header_len].decode("utf-8"))
+        self._record = struct.Struct(header["record_format"])
+        self._offset = 10 + header_len
+        self.columns = header["columns"]
+        self.catalogs = header["catalogs"]
+        self.modes = header["modes"]
+        self.rules_hash = header.get("rules_hash")
+        if check_rules and self.rules_hash != rules_hash():
+            self._buf.close()
+            raise StaleTableError(f"{path} 是以舊版規則建立的，請重新執行 python gua_table.py build")
+
+    def lookup_id(self, board_id):
+        row = self._record.unpack_from(self._buf, self._offset + board_id * self._record.size)
+        if not row[0]: return None
+        reading = {"board_id": board_id}
+        for name, index in zip(self.columns, row):
+            value = json.loads(self.catalogs[name][index - 1])
+            key, _, gender = name.partition(":")
+            value = _DECODERS.get(key, lambda v: v)(value)
+            if gender: reading.setdefault(key, {})[gender] = value
+            else: reading[key] = value
+        halves = row[len(self.columns):]
+        scores = {}
+        for i, mode in enumerate(self.modes):
+            score_a, score_b = halves[2 * i] / 2, halves[2 * i + 1] / 2
+            # 與 calculate_score_by_mode 相同：health 模式不計算淨值
+            net = 0.0 if mode == "health" else score_a - score_b
+            scores[mode] = {"score_A": score_a, "score_B": score_b, "net_score": net}
+        reading["calculate_score_by_mode"] = scores
+        return reading
+
+    def lookup(self, current_gua):
+        board_id = board_fingerprint(current_gua)
+        return None if board_id is None else self.lookup_id(board_id)
+
+_default_table = None
+_default_rejected = False   # 表存在但不可用 (規則已變更)，不再重試
+
+def get_table():
+    """載入預設路徑的盤面表 (未建表、或規則已變更時回傳 None，改用即時分析)"""
+    global _default_table, _default_rejected
+    if _default_table is None and not _default_rejected and os.path.exists(DEFAULT_TABLE_PATH):
+        try: _default_table = GuaTable(DEFAULT_TABLE_PATH)
+        except ValueError as e:
+            _default_rejected = True
+            print(f"⚠️ 不使用盤面表：{e}", file=sys.stderr)
+    return _default_table
+
+def lookup(current_gua):
+    table = get_table()
+    return table.lookup(current_gua) if table else None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="建立五支棋全盤面預先計算表")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="列舉所有盤面並寫入紀錄表")
+    build.add_argument("--out", default=DEFAULT_TABLE_PATH)
+    build.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    if args.command == "build":
+        count = build_table(args.out, args.workers)
+        print(f"已寫入 {count} 種盤面 -> {args.out}")
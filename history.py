@@ -0,0 +1,325 @@
+# ==============================================================================
+# history.py - 占卜紀錄 (SQLite，WAL 模式)
+# ==============================================================================
+# 每次占卜存成一筆：盤面以棋種代碼 bytes 儲存 (單卦 5 bytes、全盤流年整副 32 bytes)，
+# 加上種子、問題類別、性別、狀態與時間。成卦紀錄的格局另存一張索引表，可依客戶 + 格局快速查詢。
+#
+# 寫入只把資料放進佇列，由背景執行緒批次寫入 (一個交易寫多筆)，不會增加占卜的延遲；
+# 開啟資料庫與建表也在背景執行緒，資料庫無法開啟 (唯讀目錄、被鎖住) 時只印出警告並捨棄紀錄，占卜照常進行。
+# 格局與累計統計 (aggregates.py) 也在背景執行緒、同一個交易中更新。
+# 資料庫路徑：環境變數 XIANGBU_HISTORY_DB (預設為程式目錄下的 history.db)。查詢以 id 做 keyset 分頁 (before_id)，不使用 OFFSET。
+#
+# python history.py query --client 王小明 --pattern 消耗格 [--limit 20] [--before 1234]
+# python history.py stats [--rebuild]
+
+import argparse
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+from collections import Counter
+
+from data import KIND_INDEX, LIFE_STAGES
+from gua import FullLifeGua, Gua
+from patterns import pattern_label
+from rules import cached_call, check_special_patterns
+import aggregates
+
+DEFAULT_HISTORY_PATH = os.environ.get(
+    "XIANGBU_HISTORY_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "history.db")
+)
+BATCH_SIZE = 256
+FLUSH_INTERVAL = 0.5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (
+    id         INTEGER PRIMARY KEY,
+    client     TEXT    NOT NULL DEFAULT '',
+    created_at REAL    NOT NULL,
+    kind       TEXT    NOT NULL,            -- single / full
+    mode       TEXT,                        -- 問題類別
+    gender     TEXT,
+    seed       INTEGER,
+    status     TEXT,
+    boards     BLOB    NOT NULL             -- 棋種代碼：single 為 5 bytes，full 為整副 32 bytes
+);
+CREATE INDEX IF NOT EXISTS idx_readings_client_id ON readings (client, id);
+CREATE INDEX IF NOT EXISTS idx_readings_created ON readings (created_at);
+
+CREATE TABLE IF NOT EXISTS reading_patterns (
+    client     TEXT    NOT NULL,
+    pattern    TEXT    NOT NULL,            -- 格局名稱 (去掉圖示與位置，例如 消耗格)
+    reading_id INTEGER NOT NULL,
+    stage      INTEGER NOT NULL,            -- 單卦為 0，全盤流年為階段序號
+    PRIMARY KEY (client, pattern, reading_id, stage)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_patterns_pattern ON reading_patterns (pattern, reading_id);
+"""
+
+def encode_boards(kind, boards):
+    """single: Gua；full: generate_full_life_gua() 的結果 (存 raw_flow 整副牌)"""
+    if kind == "single": return bytes(boards.codes if isinstance(boards, Gua) else Gua.from_pieces(boards).codes)
+    if isinstance(boards, FullLifeGua): return boards.to_bytes()
+    return bytes(KIND_INDEX[p] for p in boards["raw_flow"])
+
+def decode_boards(kind, blob):
+    if kind == "single": return Gua(blob)
+    return {stage: Gua(blob[i * 5:i * 5 + 5]) for i, stage in enumerate(LIFE_STAGES)}
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+class HistoryStore:
+    """占卜紀錄庫：record() 立即返回且不會拋出例外，背景執行緒批次寫入；query() 可在任何執行緒呼叫"""
+
+    def __init__(self, path=DEFAULT_HISTORY_PATH, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._local = threading.local()
+        self._closed = False
+        self._ready = threading.Event()   # 背景執行緒已嘗試開啟資料庫與建表
+        self.error = None                 # 資料庫無法使用的原因
+        self.written = self.failed = 0
+        self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+        self._writer.start()
+
+    # --------------------------------------------------------------------------
+    # 寫入
+    # --------------------------------------------------------------------------
+    def record(self, kind, boards, client="", mode=None, gender=None, seed=None, status="VALID", created_at=None):
+        """排入一筆紀錄 (不等待寫入)；boards 見 encode_boards。紀錄失敗只印出警告，不影響占卜"""
+        if self._closed or self.error is not None:
+            self.failed += 1; return
+        try: self._queue.put((client or "", created_at or time.time(), kind, mode, gender, seed, status, encode_boards(kind, boards)))
+        except Exception as e:
+            self.failed += 1
+            print(f"⚠️ 占卜紀錄略過: {e}", file=sys.stderr)
+
+    def _open(self):
+        try:
+            conn = _connect(self.path)
+            conn.executescript(SCHEMA + aggregates.SCHEMA)
+            return conn
+        except sqlite3.Error as e:
+            self.error = f"{self.path}: {e}"
+            print(f"⚠️ 無法開啟占卜紀錄資料庫，之後的紀錄將被捨棄 ({self.error})", file=sys.stderr)
+            return None
+        finally:
+            self._ready.set()
+
+    def _write_loop(self):
+        conn = self._open()
+        if conn is None:
+            # 資料庫無法使用：清空佇列 (flush/close 不會卡住)
+            while True:
+                item = self._queue.get()
+                if item is not None: self.failed += 1
+                self._queue.task_done()
+                if item is None: return
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done(); break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            # 湊滿一批或等到 flush_interval 再寫，減少交易次數
+            while len(batch) < self.batch_size:
+                try: item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty: break
+                if item is None: stop = True; break
+                batch.append(item)
+            try:
+                self._write_batch(conn, batch)
+                self.written += len(batch)
+            except Exception:
+                # 整批失敗時逐筆重寫，只捨棄有問題的那幾筆 (寫入失敗不影響占卜本身)
+                for row in batch:
+                    try:
+                        self._write_batch(conn, [row])
+                        self.written += 1
+                    except Exception:
+                        self.failed += 1
+            for _ in range(len(batch) + stop): self._queue.task_done()
+            if stop: break
+        conn.close()
+
+    def _write_batch(self, conn, batch):
+        deltas = Counter()
+        with conn:
+            for row in batch:
+                stages = _stage_boards(row[2], row[7])
+                cur = conn.execute(
+                    "INSERT INTO readings (client, created_at, kind, mode, gender, seed, status, boards) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row)
+                conn.executemany(
+                    "INSERT OR IGNORE INTO reading_patterns (client, pattern, reading_id, stage) VALUES (?, ?, ?, ?)",
+                    [(row[0], pattern, cur.lastrowid, stage) for stage, pattern in _stage_patterns(stages, row[6])])
+                deltas.update(aggregates.reading_deltas(row[2], [gua for _, gua in stages], row[6]))
+            aggregates.apply(conn, deltas)
+
+    def flush(self):
+        """等待佇列中的紀錄全部寫入"""
+        self._queue.join()
+
+    def close(self):
+        if self._closed: return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+
+    # --------------------------------------------------------------------------
+    # 查詢
+    # --------------------------------------------------------------------------
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self._ready.wait()
+            if self.error is not None: raise RuntimeError(f"占卜紀錄資料庫無法使用: {self.error}")
+            conn = self._local.conn = _connect(self.path)
+            conn.row_factory = sqlite3.Row
+        return conn
+
+    def query(self, client=None, pattern=None, since=None, until=None, before_id=None, limit=50):
+        """依客戶 / 格局 / 時間區間查詢，新到舊排序。
+        回傳 (紀錄串列, 下一頁的 before_id)；沒有下一頁時為 None"""
+        where, params = [], []
+        if since is not None: where.append("r.created_at >= ?"); params.append(since)
+        if until is not None: where.append("r.created_at < ?"); params.append(until)
+        if pattern is not None:
+            # 先由格局索引 (client, pattern, reading_id) 取出這一頁的 id，再讀紀錄本身
+            where[:0] = ["p.pattern = ?"]; params[:0] = [pattern]
+            if client is not None: where.append("p.client = ?"); params.append(client)
+            if before_id is not None: where.append("p.reading_id < ?"); params.append(before_id)
+            join = " JOIN readings r ON r.id = p.reading_id" if since is not None or until is not None else ""
+            sql = (f"SELECT * FROM readings WHERE id IN (SELECT DISTINCT p.reading_id FROM reading_patterns p{join}"
+                   f" WHERE {' AND '.join(where)} ORDER BY p.reading_id DESC LIMIT ?) ORDER BY id DESC")
+        else:
+            if client is not None: where.append("r.client = ?"); params.append(client)
+            if before_id is not None: where.append("r.id < ?"); params.append(before_id)
+            sql = "SELECT * FROM readings r" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY r.id DESC LIMIT ?"
+        params.append(limit + 1)
+        rows = self._conn().execute(sql, params).fetchall()
+        results = [self._to_reading(row) for row in rows[:limit]]
+        return results, (results[-1]["id"] if len(rows) > limit else None)
+
+    def get(self, reading_id):
+        row = self._conn().execute("SELECT * FROM readings WHERE id = ?", (reading_id,)).fetchone()
+        return self._to_reading(row) if row else None
+
+    def patterns_of(self, reading_id):
+        rows = self._conn().execute("SELECT stage, pattern FROM reading_patterns WHERE reading_id = ? ORDER BY stage", (reading_id,))
+        return [(row["stage"], row["pattern"]) for row in rows]
+
+    # --------------------------------------------------------------------------
+    # 累計統計
+    # --------------------------------------------------------------------------
+    def aggregates(self):
+        """儀表板用的累計統計 (只讀計數器表，與紀錄筆數無關)"""
+        return aggregates.snapshot(self._conn())
+
+    def rebuild_aggregates(self, chunk=2000):
+        """規則變更後從頭重算計數器與格局索引，依 id 順序重新掃描全部紀錄。
+        掃描時不鎖資料庫 (格局先寫入暫存表，計數在記憶體累加)，背景寫入照常進行；
+        最後在一個短的寫入交易中補上掃描期間的新紀錄，再整批換掉舊的計數器與格局索引"""
+        self.flush()
+        self._ready.wait()
+        if self.error is not None: raise RuntimeError(f"占卜紀錄資料庫無法使用: {self.error}")
+        conn = _connect(self.path)
+        deltas = Counter()
+
+        def scan(after, limit=-1):
+            rows = conn.execute("SELECT id, client, kind, status, boards FROM readings WHERE id > ? ORDER BY id LIMIT ?", (after, limit)).fetchall()
+            for reading_id, client, kind, status, blob in rows:
+                stages = _stage_boards(kind, blob)
+                conn.executemany(
+                    "INSERT INTO temp.rebuild_patterns (client, pattern, reading_id, stage) VALUES (?, ?, ?, ?)",
+                    [(client, pattern, reading_id, stage) for stage, pattern in _stage_patterns(stages, status)])
+                deltas.update(aggregates.reading_deltas(kind, [gua for _, gua in stages], status))
+            return rows
+
+        try:
+            conn.execute("CREATE TEMP TABLE rebuild_patterns AS SELECT * FROM reading_patterns WHERE 0")
+            last_id, total = 0, 0
+            while True:
+                with conn: rows = scan(last_id, chunk)
+                if not rows: break
+                last_id, total = rows[-1][0], total + len(rows)
+            conn.execute("BEGIN IMMEDIATE")
+            total += len(scan(last_id))
+            conn.execute("DELETE FROM aggregate_counts")
+            aggregates.apply(conn, deltas)
+            conn.execute("DELETE FROM reading_patterns")
+            conn.execute("INSERT INTO reading_patterns SELECT * FROM temp.rebuild_patterns")
+            conn.commit()
+        except BaseException:
+            conn.rollback(); raise
+        finally:
+            conn.close()
+        return total
+
+    @staticmethod
+    def _to_reading(row):
+        reading = dict(row)
+        reading["boards"] = decode_boards(reading["kind"], reading["boards"])
+        return reading
+
+def _stage_boards(kind, blob):
+    """[(階段序號, Gua)]：單卦為 [(0, 盤面)]，全盤流年為 1~6 階段"""
+    if kind == "single": return [(0, Gua(blob))]
+    return [(i + 1, Gua(blob[i * 5:i * 5 + 5])) for i in range(len(LIFE_STAGES))]
+
+def _stage_patterns(stages, status="VALID"):
+    """不成卦的紀錄不建格局索引 (同 aggregates.reading_deltas，不計入統計)"""
+    if status not in (None, "VALID"): return set()
+    return {(stage, pattern_label(p["name"])) for stage, gua in stages for p in cached_call(check_special_patterns, gua)}
+
+_default_store = None
+_default_lock = threading.Lock()
+
+def get_store(path=DEFAULT_HISTORY_PATH):
+    """行程內共用的紀錄庫 (第一次呼叫時建立)"""
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = HistoryStore(path)
+            # 行程結束前把佇列中的紀錄寫完
+            atexit.register(_default_store.close)
+    return _default_store
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="查詢占卜紀錄")
+    sub = parser.add_subparsers(dest="command", required=True)
+    q = sub.add_parser("query")
+    q.add_argument("--db", default=DEFAULT_HISTORY_PATH)
+    q.add_argument("--client")
+    q.add_argument("--pattern", help="格局名稱，例如 消耗格")
+    q.add_argument("--limit", type=int, default=20)
+    q.add_argument("--before", type=int, help="上一頁最後一筆的 id")
+    stats = sub.add_parser("stats", help="印出累計統計 (JSON)")
+    stats.add_argument("--db", default=DEFAULT_HISTORY_PATH)
+    stats.add_argument("--rebuild", action="store_true", help="規則變更後從頭重算")
+    args = parser.parse_args()
+
+    store = HistoryStore(args.db)
+    if args.command == "stats":
+        if args.rebuild: print(f"重算 {store.rebuild_aggregates()} 筆紀錄", file=sys.stderr)
+        print(json.dumps(store.aggregates(), ensure_ascii=False, indent=2))
+        store.close(); sys.exit(0)
+    results, next_before = store.query(args.client, args.pattern, before_id=args.before, limit=args.limit)
+    for r in results:
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(r["created_at"]))
+        boards = r["boards"]
+        desc = " ".join(c + n for _, n, c, _ in boards) if r["kind"] == "single" else f"全盤流年 {len(boards)} 階段"
+        print(f"#{r['id']}  {when}  {r['client'] or '-'}  {r['mode'] or ''}  {r['gender'] or ''}  {r['status']}  種子 {r['seed']}  {desc}")
+    if next_before: print(f"-- 下一頁：--before {next_before}")
+    store.close()
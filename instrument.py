@@ -0,0 +1,170 @@
+# ==============================================================================
+# instrument.py - 規則引擎的呼叫次數與耗時統計 (選用)
+# ==============================================================================
+# XIANGBU_INSTRUMENT=1                   啟用 (未設定時不包裝任何函數，沒有額外成本)
+# XIANGBU_INSTRUMENT_DUMP=stats.jsonl    每隔一段時間把 snapshot() 追加寫入 JSON Lines 檔
+# XIANGBU_INSTRUMENT_INTERVAL=60         寫檔間隔秒數
+#
+# 耗時為含子呼叫的牆鐘時間；scope() 可統計一次頁面渲染內各函數被呼叫幾次。
+# 分析結果快取 (rules.cached_call) 與吃子矩陣快取的命中/未命中依函數名稱累計，列在 snapshot()["functions"][名稱]。
+# session_memory() 估算一個 session 的 session_state 佔用的記憶體 (不需啟用)。
+
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+
+ENABLED = os.environ.get("XIANGBU_INSTRUMENT", "") not in ("", "0")
+DUMP_PATH = os.environ.get("XIANGBU_INSTRUMENT_DUMP", "")
+DUMP_INTERVAL = float(os.environ.get("XIANGBU_INSTRUMENT_INTERVAL", "60"))
+
+_lock = threading.Lock()
+_local = threading.local()
+_stats = {}        # 函數名稱 -> [呼叫次數, 累計 ns, 單次最長 ns]
+_scopes = {}       # 範圍名稱 -> {"count", "calls", "last"}
+_cache_counts = {} # 函數名稱 -> [快取命中, 未命中]
+_cache_sources = []
+_dump_thread = None
+
+def _wrap(name, fn):
+    stats = _stats.setdefault(name, [0, 0, 0])
+    perf_counter_ns = time.perf_counter_ns
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = perf_counter_ns()
+        try: return fn(*args, **kwargs)
+        finally:
+            elapsed = perf_counter_ns() - start
+            with _lock:
+                stats[0] += 1; stats[1] += elapsed
+                if elapsed > stats[2]: stats[2] = elapsed
+            calls = getattr(_local, "calls", None)
+            if calls is not None: calls[name] += 1
+    return wrapper
+
+def install(namespace, cache_info=None):
+    """包裝模組中所有公開函數；cache_info 為回傳快取命中統計的函數"""
+    module = namespace["__name__"]
+    wrapped = {}
+    for name, value in list(namespace.items()):
+        if name.startswith("_") or not inspect.isfunction(value) or value.__module__ != module: continue
+        wrapped[value] = namespace[name] = _wrap(name, value)
+    # 模組內保存函數參照的清單 (如 BOARD_ANALYZERS) 也要換成包裝後的版本
+    for value in namespace.values():
+        if isinstance(value, list):
+            value[:] = [wrapped.get(v, v) if inspect.isfunction(v) else v for v in value]
+    if cache_info: _cache_sources.append(cache_info)
+    if DUMP_PATH: start_dump(DUMP_PATH, DUMP_INTERVAL)
+
+def count_cache(name, hit):
+    with _lock:
+        counts = _cache_counts.setdefault(name, [0, 0])
+        counts[0 if hit else 1] += 1
+
+def cached(name, cache, key, compute):
+    """cache.get_or_compute(key, compute)，並依函數名稱累計命中/未命中"""
+    missed = []
+    value = cache.get_or_compute(key, lambda: missed.append(True) or compute())
+    count_cache(name, not missed)
+    return value
+
+class _Scope:
+    def __init__(self, name): self.name = name
+
+    def __enter__(self):
+        self.outer = getattr(_local, "calls", None)
+        _local.calls = Counter()
+        return self
+
+    def __exit__(self, *exc):
+        calls, _local.calls = _local.calls, self.outer
+        if self.outer is not None: self.outer.update(calls)
+        with _lock:
+            entry = _scopes.setdefault(self.name, {"count": 0, "calls": Counter(), "last": {}})
+            entry["count"] += 1; entry["calls"].update(calls); entry["last"] = dict(calls)
+        return False
+
+def scope(name):
+    """統計範圍內 (同一執行緒) 的呼叫次數，例如一次頁面渲染"""
+    return _Scope(name) if ENABLED else nullcontext()
+
+def snapshot():
+    with _lock:
+        functions = {
+            name: {"calls": calls, "total_ms": total / 1e6, "mean_us": total / calls / 1e3 if calls else 0.0, "max_us": longest / 1e3}
+            for name, (calls, total, longest) in _stats.items() if calls
+        }
+        for name, (hits, misses) in _cache_counts.items():
+            if hits + misses:
+                functions.setdefault(name, {}).update(cache_hits=hits, cache_misses=misses, cache_hit_rate=hits / (hits + misses))
+        scopes = {
+            name: {"count": e["count"], "calls_per_scope": {k: v / e["count"] for k, v in e["calls"].items()}, "last": e["last"]}
+            for name, e in _scopes.items()
+        }
+    caches = {}
+    for source in _cache_sources: caches.update(source())
+    return {"ts": time.time(), "pid": os.getpid(), "functions": functions, "caches": caches, "scopes": scopes}
+
+def reset():
+    with _lock:
+        for stats in _stats.values(): stats[:] = [0, 0, 0]
+        _cache_counts.clear()
+        _scopes.clear()
+
+def start_dump(path, interval=DUMP_INTERVAL):
+    """背景執行緒定期把 snapshot() 追加寫入 JSON Lines 檔"""
+    global _dump_thread
+    if _dump_thread is not None: return
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            with open(path, "a", encoding="utf-8") as f: f.write(json.dumps(snapshot(), ensure_ascii=False) + "\n")
+
+    _dump_thread = threading.Thread(target=loop, name="instrument-dump", daemon=True)
+    _dump_thread.start()
+
+# ==============================================================================
+# Session 記憶體
+# ==============================================================================
+_shared = None
+
+def _shared_ids():
+    """所有 session 共用的常數 (棋種 tuple、各位置的棋子 tuple、階段名稱與其中的字串)，不算在個別 session 頭上"""
+    global _shared
+    if _shared is None:
+        from data import LIFE_STAGES, PIECE_KINDS
+        from gua import Gua
+        objects = list(PIECE_KINDS) + [piece for k in range(len(PIECE_KINDS)) for piece in Gua([k] * 5)]
+        _shared = {id(x) for obj in objects for x in (obj, *obj)} | {id(stage) for stage in LIFE_STAGES}
+    return _shared
+
+def deep_sizeof(obj, seen=None):
+    """物件連同其內容 (dict/list/tuple/set 的元素、__slots__ 與 __dict__ 屬性) 的位元組數；seen 內的物件不重複計算"""
+    seen = set(_shared_ids()) if seen is None else seen
+    total, stack = 0, [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (type, type(sys))) or callable(obj): continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict): stack.extend(obj.keys()); stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)): stack.extend(obj)
+        else:
+            for cls in type(obj).__mro__:
+                for slot in getattr(cls, "__slots__", ()):
+                    if hasattr(obj, slot): stack.append(getattr(obj, slot))
+            if hasattr(obj, "__dict__"): stack.append(vars(obj))
+    return total
+
+def session_memory(state):
+    """{session_state 鍵: 位元組數}，由大到小；共用的物件只算在第一個鍵"""
+    seen = set(_shared_ids())
+    sizes = {key: deep_sizeof(value, seen) for key, value in state.items()}
+    return dict(sorted(sizes.items(), key=lambda kv: -kv[1]))
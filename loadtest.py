@@ -0,0 +1,293 @@
+# ==============================================================================
+# loadtest.py - app.py 多人同時使用的壓力測試
+# ==============================================================================
+# 模擬 N 個同時在線的使用者，各自依亂數劇本操作：開啟頁面、切換性別、單卦占卜、
+# 排布全盤流年、展開流年階段。報告每種操作的重新執行 (rerun) 延遲 p50/p95/p99、
+# 整體吞吐量、每個 session 的 CPU 時間與記憶體。
+# (分頁 st.tabs 的切換只在瀏覽器端進行，不會觸發 rerun；伺服器端對應的操作是展開流年階段。)
+#
+# python loadtest.py --sessions 50 --actions 10                 另開 streamlit run app.py，以 websocket 連線 (與瀏覽器相同)
+# python loadtest.py --url ws://127.0.0.1:8501 [--server-pid 1234]   連到已啟動的伺服器
+# python loadtest.py --in-process --sessions 20                 同一行程內以 streamlit AppTest 模擬 (不需伺服器)
+#
+# AppTest 共用全域的 Runtime，無法同時執行，--in-process 的 rerun 會依序排隊；
+# 此模式量到的是單次 rerun 的成本與每個 session 的記憶體，同時在線的延遲請用伺服器模式量測。
+#
+# 共通選項：--think 0.5 (每次操作之間的思考秒數)、--seed 1 (劇本可重現)、
+# --spinner-delay 0 (XIANGBU_SPINNER_DELAY，洗牌動畫的停頓倍率)
+
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from data import LIFE_STAGES
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(HERE, "app.py")
+QUERIES = ["問運勢", "事業查詢", "前世格局", "健康分析", "投資/財運", "感情/關係", "離婚議題"]
+
+# ==============================================================================
+# 劇本
+# ==============================================================================
+def plan_session(rng, actions):
+    """[(操作, 參數)]：第一步一定是開啟頁面；展開階段只會出現在排布全盤流年之後"""
+    plan, has_full = [("load", None)], False
+    for _ in range(actions):
+        roll = rng.random()
+        if roll < 0.4: plan.append(("single", rng.choice(QUERIES)))
+        elif roll < 0.6: plan.append(("full", None)); has_full = True
+        elif roll < 0.8 and has_full: plan.append(("open_stage", rng.randrange(len(LIFE_STAGES))))
+        else: plan.append(("gender", rng.choice(["男", "女"])))
+    return plan
+
+def percentile(values, p):
+    if not values: return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+# ==============================================================================
+# 行程資源 (讀 /proc，不需額外套件)
+# ==============================================================================
+def process_cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f: fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+def process_rss_mb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"): return int(line.split()[1]) / 1024
+    return float("nan")
+
+# ==============================================================================
+# 同一行程內 (streamlit AppTest)
+# ==============================================================================
+class InProcessSession:
+    """每個 AppTest 是一個獨立的 session；AppTest 共用全域 Runtime，rerun 需依序執行"""
+    lock = threading.Lock()
+
+    def load(self):
+        from streamlit.testing.v1 import AppTest
+        self.at = AppTest.from_file(APP_PATH, default_timeout=120).run()
+
+    def _find(self, elements, prefix):
+        return next(e for e in elements if e.label.startswith(prefix))
+
+    def act(self, action, arg):
+        """回傳 rerun 本身的耗時 (ms，不含排隊)"""
+        with self.lock:
+            start = time.perf_counter()
+            self._act(action, arg)
+            return (time.perf_counter() - start) * 1e3
+
+    def _act(self, action, arg):
+        if action == "load": self.load()
+        elif action == "gender": self._find(self.at.selectbox, "詢問性別").set_value(arg).run()
+        elif action == "single":
+            self._find(self.at.selectbox, "選擇問題類別").set_value(arg)
+            self._find(self.at.button, "🔮").click().run()
+        elif action == "full": self._find(self.at.button, "🚀").click().run()
+        elif action == "open_stage":
+            self.at.session_state[f"stage_open_{arg}"] = True
+            self.at.run()
+        if self.at.exception: raise RuntimeError(self.at.exception[0].message)
+
+def run_in_process(plans, think):
+    pid = os.getpid()
+    # 先跑一個 session 讓模組與快取載入完畢，之後的記憶體差額才是 session 本身
+    InProcessSession().act("load", None)
+    rss_before, cpu_before = process_rss_mb(pid), time.process_time()
+    sessions = [InProcessSession() for _ in plans]
+
+    def run(i):
+        results = []
+        for action, arg in plans[i]:
+            try: ms, ok = sessions[i].act(action, arg), True
+            except Exception: ms, ok = 0.0, False
+            results.append((action, ms, ok))
+            if think: time.sleep(think)
+        return results
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(len(plans)) as pool: results = [r for rs in pool.map(run, range(len(plans))) for r in rs]
+    wall = time.perf_counter() - start
+    cpu, rss = time.process_time() - cpu_before, process_rss_mb(pid) - rss_before
+    import instrument
+    state_bytes = [sum(instrument.session_memory(s.at.session_state.to_dict()).values()) for s in sessions if hasattr(s, "at")]
+    return results, wall, cpu, rss, sum(state_bytes) / max(1, len(state_bytes))
+
+# ==============================================================================
+# 連到 streamlit 伺服器 (websocket，與瀏覽器送出相同的 BackMsg)
+# ==============================================================================
+class WebSocketSession:
+    def __init__(self, url):
+        self.url = url
+        self.widgets = {}   # 標籤 (有 key 的用 key) -> (widget id, 種類)
+        self.values = {}    # widget id -> WidgetState (保留使用者設定過的值，每次 rerun 一併送出)
+
+    async def _rerun(self, trigger=None):
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+        msg = BackMsg()
+        msg.rerun_script.query_string = ""
+        for state in self.values.values(): msg.rerun_script.widget_states.widgets.add().CopyFrom(state)
+        if trigger: msg.rerun_script.widget_states.widgets.add(id=trigger, trigger_value=True)
+        await self.ws.send(msg.SerializeToString())
+        # st.rerun() 會先結束一次 (FINISHED_EARLY_FOR_RERUN) 再重跑，等到真正結束為止
+        while True:
+            fwd = ForwardMsg()
+            fwd.ParseFromString(await self.ws.recv())
+            kind = fwd.WhichOneof("type")
+            if kind == "delta": self._collect(fwd.delta)
+            elif kind == "script_finished" and fwd.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                if fwd.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR: raise RuntimeError("app.py 編譯失敗")
+                return
+
+    def _collect(self, delta):
+        kind = delta.WhichOneof("type")
+        if kind == "new_element":
+            element = delta.new_element
+            widget = getattr(element, element.WhichOneof("type"))
+            if element.WhichOneof("type") == "exception": raise RuntimeError(widget.message)
+            if getattr(widget, "id", ""): self.widgets[widget.label] = (widget.id, element.WhichOneof("type"))
+        elif kind == "add_block" and delta.add_block.WhichOneof("type") == "expandable":
+            block = delta.add_block.expandable
+            if block.id: self.widgets[block.id.rsplit("-", 1)[-1]] = (block.id, "expander")
+
+    def _id(self, prefix):
+        return next(wid for label, (wid, _) in self.widgets.items() if label.startswith(prefix))
+
+    def _set(self, prefix, **value):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+        wid = self._id(prefix)
+        self.values[wid] = WidgetState(id=wid, **value)
+
+    async def act(self, action, arg):
+        if action == "load":
+            import websockets
+            self.ws = await websockets.connect(self.url, subprotocols=["streamlit"], max_size=None)
+            await self._rerun()
+        elif action == "gender": self._set("詢問性別", string_value=arg); await self._rerun()
+        elif action == "single":
+            self._set("選擇問題類別", string_value=arg)
+            await self._rerun(self._id("🔮"))
+        elif action == "full": await self._rerun(self._id("🚀"))
+        elif action == "open_stage": self._set(f"stage_open_{arg}", bool_value=True); await self._rerun()
+
+    async def close(self): await self.ws.close()
+
+async def _run_websocket(url, plans, think, pid):
+    sessions = [WebSocketSession(url) for _ in plans]
+    all_done = asyncio.Event()
+    finished = 0
+
+    async def run(i):
+        nonlocal finished
+        results = []
+        for action, arg in plans[i]:
+            start = time.perf_counter()
+            try: await sessions[i].act(action, arg); ok = True
+            except Exception: ok = False
+            results.append((action, (time.perf_counter() - start) * 1e3, ok))
+            if think: await asyncio.sleep(think)
+        finished += 1
+        if finished == len(plans): all_done.set()
+        return results
+
+    rss_before = process_rss_mb(pid) if pid else float("nan")
+    cpu_before = process_cpu_seconds(pid) if pid else float("nan")
+    start = time.perf_counter()
+    tasks = [asyncio.create_task(run(i)) for i in range(len(plans))]
+    await all_done.wait()
+    wall = time.perf_counter() - start
+    # 所有 session 仍在線時量伺服器記憶體，之後才斷線
+    cpu = process_cpu_seconds(pid) - cpu_before if pid else float("nan")
+    rss = process_rss_mb(pid) - rss_before if pid else float("nan")
+    results = [r for task in tasks for r in task.result()]
+    for session in sessions:
+        try: await session.close()
+        except Exception: pass
+    return results, wall, cpu, rss
+
+def run_websocket(url, plans, think, pid=None):
+    # 先連一個 session 讓伺服器載入模組，之後的資源差額才是 session 本身
+    async def warm():
+        session = WebSocketSession(url)
+        await session.act("load", None)
+        await session.close()
+    asyncio.run(warm())
+    return asyncio.run(_run_websocket(url, plans, think, pid))
+
+def start_server(env):
+    """在空閒的連接埠啟動 streamlit run app.py，回傳 (行程, websocket 網址)"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", APP_PATH, "--server.headless", "true", "--server.address", "127.0.0.1",
+         "--server.port", str(port), "--browser.gatherUsageStats", "false"],
+        cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1) as r:
+                if r.status == 200: return proc, f"ws://127.0.0.1:{port}/_stcore/stream"
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("streamlit 伺服器啟動逾時")
+
+# ==============================================================================
+# 報告
+# ==============================================================================
+def report(results, wall, cpu, rss, state_bytes=None, sessions=1):
+    print(f"{'操作':<12}{'次數':>6}{'失敗':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'最長 ms':>10}")
+    for action in ["load", "gender", "single", "full", "open_stage", "全部"]:
+        rows = [r for r in results if action == "全部" or r[0] == action]
+        if not rows: continue
+        latencies = [ms for _, ms, ok in rows if ok]
+        print(f"{action:<12}{len(rows):>6}{sum(not ok for *_, ok in rows):>6}"
+              f"{percentile(latencies, 50):>10.0f}{percentile(latencies, 95):>10.0f}{percentile(latencies, 99):>10.0f}"
+              f"{max(latencies, default=float('nan')):>10.0f}")
+    print(f"\n{sessions} 個 session，{len(results)} 次操作，歷時 {wall:.1f} 秒，吞吐量 {len(results) / wall:.1f} 次/秒")
+    print(f"CPU：共 {cpu:.1f} 秒，每個 session {cpu / sessions:.2f} 秒，每次操作 {cpu / len(results) * 1e3:.0f} ms")
+    print(f"記憶體：增加 {rss:.1f} MB，每個 session {rss / sessions:.2f} MB")
+    if state_bytes is not None: print(f"session_state：平均每個 session {state_bytes:,.0f} bytes")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="app.py 多人同時使用的壓力測試")
+    parser.add_argument("--sessions", type=int, default=10, help="同時在線的使用者數")
+    parser.add_argument("--actions", type=int, default=8, help="每個使用者開啟頁面後的操作次數")
+    parser.add_argument("--think", type=float, default=0.0, help="每次操作之間的思考秒數")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--spinner-delay", type=float, help="XIANGBU_SPINNER_DELAY (洗牌動畫的停頓倍率)")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--in-process", action="store_true", help="同一行程內以 AppTest 模擬 (rerun 依序執行)")
+    target.add_argument("--url", help="已啟動的伺服器，例如 ws://127.0.0.1:8501 (自動補上 /_stcore/stream)")
+    parser.add_argument("--server-pid", type=int, help="--url 模式下用來量測 CPU 與記憶體的伺服器行程")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    plans = [plan_session(random.Random(rng.getrandbits(32)), args.actions) for _ in range(args.sessions)]
+    with tempfile.TemporaryDirectory() as tmp:
+        # 占卜紀錄寫到暫存目錄，不污染正式的 history.db
+        os.environ["XIANGBU_HISTORY_DB"] = os.path.join(tmp, "history.db")
+        if args.spinner_delay is not None: os.environ["XIANGBU_SPINNER_DELAY"] = str(args.spinner_delay)
+        if args.url:
+            url = args.url if args.url.endswith("/_stcore/stream") else args.url.rstrip("/") + "/_stcore/stream"
+            outcome = run_websocket(url, plans, args.think, args.server_pid)
+        elif args.in_process:
+            outcome = run_in_process(plans, args.think)
+        else:
+            proc, url = start_server(dict(os.environ))
+            try: outcome = run_websocket(url, plans, args.think, proc.pid)
+            finally: proc.terminate(); proc.wait()
+    report(*outcome, sessions=args.sessions)
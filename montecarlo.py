@@ -0,0 +1,156 @@
+# ==============================================================================
+# montecarlo.py - 全盤流年的蒙地卡羅模擬
+# ==============================================================================
+# 全盤流年 (generate_full_life_gua) 把 32 支棋洗牌後依序排成六個 LIFE_STAGES (每階段 5 支)，剩 2 支為餘棋。
+# 「連續三個十年 net_score 上升的機率」、「平均有幾個階段缺天」這類整段人生的統計沒有實用的封閉解，
+# 因此以 sampler.sample_decks 大量產生牌組，逐階段做與下列函式相同的分析 (batch.py 向量化)：
+#   calculate_score_by_mode   各模式 net_score
+#   analyze_trinity_detailed  缺天 / 缺人 / 缺地
+#   check_exemption           眾星拱月 / 一枝獨秀
+#   analyze_total_fate        總格 (第一階段中心為將帥 -> 領袖格)
+# 牌組分成固定大小的區塊，每塊由 SeedSequence(seed, spawn_key=(區塊編號,)) 產生亂數，
+# 在行程池中模擬後合併成可累加的統計 (次數與直方圖；分數都是 0.5 的倍數，直方圖即精確分布，分位數由直方圖求得)。
+# 記憶體只與區塊大小有關；同一組 seed / 牌組數 / 區塊大小的結果與 workers 數量無關。
+#
+# python montecarlo.py --decks 1000000 [--seed 42] [--modes general love] [--workers 4] [--chunk 50000] [--out mc.json]
+
+import argparse
+import json
+import os
+import sys
+from collections import Counter
+from multiprocessing import Pool
+
+import numpy as np
+
+import batch
+from data import LIFE_STAGES
+from patterns import EXEMPTION_CODES
+import sampler
+
+STAGES = len(LIFE_STAGES)
+MISSING = ["缺天", "缺人", "缺地"]
+EXEMPTION_NAMES = {code: name for name, code in EXEMPTION_CODES.items() if name}
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+# ==============================================================================
+# 可合併的統計
+# ==============================================================================
+def _new_tally(modes):
+    return {"decks": 0,
+            "net_score": {mode: [Counter() for _ in range(STAGES)] for mode in modes},   # 各階段淨分的直方圖
+            "life_net": {mode: Counter() for mode in modes},                              # 六個階段淨分總和
+            "rising": {mode: 0 for mode in modes},                                        # 連續三個階段淨分上升的牌組數
+            "missing": {key: Counter() for key in MISSING},                               # 缺天/缺人/缺地的階段數
+            "exemption": [Counter() for _ in range(STAGES)],
+            "total_fate": Counter()}
+
+def _merge(into, tally):
+    into["decks"] += tally["decks"]
+    for mode, stages in tally["net_score"].items():
+        for total, counter in zip(into["net_score"][mode], stages): total.update(counter)
+        into["life_net"][mode].update(tally["life_net"][mode])
+        into["rising"][mode] += tally["rising"][mode]
+    for key in MISSING: into["missing"][key].update(tally["missing"][key])
+    for total, counter in zip(into["exemption"], tally["exemption"]): total.update(counter)
+    into["total_fate"].update(tally["total_fate"])
+
+def _histogram(values):
+    keys, counts = np.unique(values, return_counts=True)
+    return Counter(dict(zip(keys.tolist(), counts.tolist())))
+
+def quantile(counter, q):
+    """直方圖 (值 -> 次數) 的 q 分位數：累計次數首次達到 q * 總數的值"""
+    target, seen = q * sum(counter.values()), 0
+    for value in sorted(counter):
+        seen += counter[value]
+        if seen >= target: return value
+    return None
+
+def mean(counter):
+    total = sum(counter.values())
+    return sum(value * count for value, count in counter.items()) / total if total else None
+
+# ==============================================================================
+# 模擬
+# ==============================================================================
+def analyze_decks(decks, modes):
+    """(N, 32) 牌組 -> 統計 (逐階段的分析與 rules.py 相同)"""
+    decks = np.asarray(decks, dtype=np.intp)
+    boards = decks[:, :STAGES * 5].reshape(-1, 5)   # 第 n 副牌的第 s 階段在第 n * STAGES + s 列
+    relations = batch.center_relations(boards)
+    eats_in, friends = relations[1], relations[2]
+    tally = _new_tally(modes)
+    tally["decks"] = len(decks)
+
+    for mode in modes:
+        net = batch.score_boards(boards, mode, relations)["net_score"].reshape(-1, STAGES)
+        for s in range(STAGES): tally["net_score"][mode][s] = _histogram(net[:, s])
+        tally["life_net"][mode] = _histogram(net.sum(axis=1))
+        up = net[:, 1:] > net[:, :-1]
+        tally["rising"][mode] = int((up[:, 1:] & up[:, :-1]).any(axis=1).sum())
+
+    # analyze_trinity_detailed：位4/位5 與中心消耗 (同棋種) 或會吃中心為缺天/缺地，中心沒有好朋友為缺人
+    center = boards[:, 0]
+    missing = {"缺天": (boards[:, 3] == center) | eats_in[:, 2],
+               "缺人": ~friends.any(axis=1),
+               "缺地": (boards[:, 4] == center) | eats_in[:, 3]}
+    for key, flags in missing.items(): tally["missing"][key] = _histogram(flags.reshape(-1, STAGES).sum(axis=1))
+
+    exempt = batch.exemption_codes(boards).reshape(-1, STAGES)
+    for s in range(STAGES):
+        tally["exemption"][s] = Counter({EXEMPTION_NAMES[code]: count for code, count in _histogram(exempt[:, s]).items() if code})
+    leaders = int((batch.KIND_TYPES[decks[:, 0]] == batch.TYPE_GENERAL).sum())
+    tally["total_fate"] = Counter({"👑 領袖格": leaders, "🧱 實幹格": len(decks) - leaders})
+    return tally
+
+def _simulate_chunk(job):
+    seed, index, size, modes = job
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(index,)))
+    return analyze_decks(sampler.sample_decks(size, rng), modes)
+
+def simulate(decks, seed, modes=("general",), workers=1, chunk=50000):
+    """模擬 decks 副全盤流年，回傳合併後的統計 (記憶體只與 chunk 有關)"""
+    jobs = ((seed, i, min(chunk, decks - start), list(modes)) for i, start in enumerate(range(0, decks, chunk)))
+    tally = _new_tally(modes)
+    if workers <= 1:
+        for job in jobs: _merge(tally, _simulate_chunk(job))
+    else:
+        with Pool(workers) as pool:
+            for part in pool.imap(_simulate_chunk, jobs): _merge(tally, part)
+    return tally
+
+def to_report(tally, seed):
+    """轉成 JSON 可輸出的摘要 (機率、平均、分位數)"""
+    total = tally["decks"]
+    summary = lambda counter: dict({"mean": mean(counter), "p_positive": sum(c for v, c in counter.items() if v > 0) / total},
+                                   **{f"p{round(q * 100):02d}": quantile(counter, q) for q in QUANTILES})
+    return {
+        "seed": seed, "decks": total,
+        "net_score": {mode: {
+            "stages": {stage: summary(counter) for stage, counter in zip(LIFE_STAGES, stages)},
+            "life_total": summary(tally["life_net"][mode]),
+            "p_rising_3_stages": tally["rising"][mode] / total,
+        } for mode, stages in tally["net_score"].items()},
+        "missing": {key: {"expected_stages": mean(counter), "distribution": {str(k): v / total for k, v in sorted(counter.items())}}
+                    for key, counter in tally["missing"].items()},
+        "exemption": {stage: {name: count / total for name, count in sorted(counter.items())}
+                      for stage, counter in zip(LIFE_STAGES, tally["exemption"])},
+        "total_fate": {name: count / total for name, count in tally["total_fate"].items()},
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="全盤流年蒙地卡羅模擬：各階段淨分分布、連續上升機率、缺天/缺人/缺地與特殊格局")
+    parser.add_argument("--decks", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=None, help="亂數種子 (預設隨機，實際使用的種子會寫在輸出中)")
+    parser.add_argument("--modes", nargs="+", default=["general"], choices=batch.SCORE_MODES)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk", type=int, default=50000, help="每個區塊的牌組數 (決定記憶體用量；改變會改變抽樣結果)")
+    parser.add_argument("--out", default="-", help="輸出 JSON 路徑 (預設印出)")
+    args = parser.parse_args()
+    if args.decks <= 0 or args.chunk <= 0: sys.exit("--decks 與 --chunk 必須為正整數")
+    seed = args.seed if args.seed is not None else np.random.SeedSequence().entropy
+    text = json.dumps(to_report(simulate(args.decks, seed, args.modes, args.workers, args.chunk), seed), ensure_ascii=False, indent=2)
+    if args.out == "-": print(text)
+    else:
+        with open(args.out, "w", encoding="utf-8") as f: f.write(text)
@@ -0,0 +1,134 @@
+# ==============================================================================
+# odds.py - 格局出現機率 (精確列舉)
+# ==============================================================================
+# 對 get_full_deck() 的 32 支棋做「有序抽 5 支」的完整列舉：相同棋種序列的盤面只算一次，
+# 再乘上抽出該序列的方法數 (牌組張數的遞降乘積)，得到精確的次數與機率。
+# 格局以 pattern_label 歸併 (不分位置)；共現機率包含格局 x 格局、格局 x 特殊格局 (check_exemption)、
+# 格局 x 各模式淨分區間 (每 NET_BUCKET 分一格)，與其他項目一樣以總抽法數正規化。
+#
+# python odds.py [--workers 4] [--out odds.json]
+
+import argparse
+import itertools
+import json
+import math
+import os
+from collections import Counter
+from fractions import Fraction
+from multiprocessing import Pool
+
+import numpy as np
+
+from batch import SCORE_MODES, score_all_modes
+from data import DECK_COUNTS
+from gua_table import iter_board_ids
+from patterns import pattern_label
+from rules import decode_gua, check_special_patterns, check_exemption, is_all_same_color
+import sampler
+
+TOTAL_DRAWS = 32 * 31 * 30 * 29 * 28
+NET_BUCKET = 10
+
+def draw_weight(codes):
+    """依序抽出這 5 個棋種的方法數"""
+    weight, drawn = 1, [0] * len(DECK_COUNTS)
+    for k in codes:
+        weight *= DECK_COUNTS[k] - drawn[k]
+        drawn[k] += 1
+    return weight
+
+def exemption_key(exemption):
+    if not exemption: return "無"
+    name, pos, _ = exemption
+    return name if name == "眾星拱月" else f"{name} (位{pos})"
+
+def net_bucket(net):
+    """淨分區間標籤：-12 -> '-20~-10' (含下界不含上界)"""
+    low = math.floor(net / NET_BUCKET) * NET_BUCKET
+    return f"{low}~{low + NET_BUCKET}"
+
+def _new_tally():
+    return {"draws": 0, "patterns": Counter(), "pattern_pairs": Counter(), "exemption": Counter(),
+            "pattern_exemption": Counter(), "net_score": {mode: Counter() for mode in SCORE_MODES},
+            "pattern_net": {mode: Counter() for mode in SCORE_MODES}}
+
+def _add(tally, weight, labels, exemption, nets):
+    tally["draws"] += weight
+    for label in labels:
+        tally["patterns"][label] += weight
+        tally["pattern_exemption"][(label, exemption)] += weight
+        for mode in SCORE_MODES: tally["pattern_net"][mode][(label, net_bucket(nets[mode]))] += weight
+    for pair in itertools.combinations(labels, 2): tally["pattern_pairs"][pair] += weight
+    tally["exemption"][exemption] += weight
+    for mode in SCORE_MODES: tally["net_score"][mode][nets[mode]] += weight
+
+def _merge(into, tally):
+    into["draws"] += tally["draws"]
+    for key in ["patterns", "pattern_pairs", "exemption", "pattern_exemption"]: into[key].update(tally[key])
+    for mode in SCORE_MODES:
+        into["net_score"][mode].update(tally["net_score"][mode])
+        into["pattern_net"][mode].update(tally["pattern_net"][mode])
+
+def _tally_chunk(first_kind):
+    """統計位置 1 為指定棋種的所有盤面：all 為全部抽法，valid 為非全同色的盤面"""
+    ids = np.fromiter(iter_board_ids(first_kind), dtype=np.int64)
+    codes = np.stack([(ids // 14 ** i) % 14 for i in range(5)], axis=1)
+    scores = score_all_modes(codes)
+    tallies = {"all": _new_tally(), "valid": _new_tally()}
+    for i, board_id in enumerate(ids.tolist()):
+        gua = decode_gua(board_id)
+        labels = sorted({pattern_label(p["name"]) for p in check_special_patterns(gua)})
+        nets = {mode: float(scores[mode]["net_score"][i]) for mode in SCORE_MODES}
+        row = (draw_weight(gua.codes), labels, exemption_key(check_exemption(gua)), nets)
+        _add(tallies["all"], *row)
+        if not is_all_same_color(gua): _add(tallies["valid"], *row)
+    return tallies
+
+def exact_odds(workers=1):
+    """回傳所有抽法的精確次數；accepted 為套用 app.py 重抽規則後實際呈現的卦"""
+    if workers > 1:
+        with Pool(workers) as pool: chunks = pool.map(_tally_chunk, range(len(DECK_COUNTS)))
+    else:
+        chunks = [_tally_chunk(k) for k in range(len(DECK_COUNTS))]
+    tallies = {"all": _new_tally(), "valid": _new_tally()}
+    for chunk in chunks:
+        for key in tallies: _merge(tallies[key], chunk[key])
+    assert tallies["all"]["draws"] == TOTAL_DRAWS
+
+    # 重抽規則 (新的一次占卜)：第一次全同色則重抽一次，兩次都全同色為不成卦。
+    # 重抽與第一次獨立，所以成卦時呈現的盤面分布 = 非全同色盤面的條件分布 (即 sampler.draw_valid_gua)。
+    p_mono = Fraction(TOTAL_DRAWS - tallies["valid"]["draws"], TOTAL_DRAWS)
+    assert p_mono == sampler.MONOCHROME_PROBABILITY
+    return {
+        "total_draws": TOTAL_DRAWS,
+        "all": tallies["all"],
+        "accepted": tallies["valid"],
+        "reroll": dict({"monochrome": float(p_mono)}, **{k: float(v) for k, v in sampler.reroll_outcomes().items()}),
+    }
+
+def to_report(odds):
+    """轉成 JSON 可輸出的機率表 (次數 / 該分布的總抽法數)"""
+    def probs(counter, total): return {str(k): v / total for k, v in sorted(counter.items(), key=lambda kv: -kv[1])}
+    report = {"total_draws": odds["total_draws"], "reroll": odds["reroll"]}
+    for key in ["all", "accepted"]:
+        tally = odds[key]; total = tally["draws"]
+        report[key] = {
+            "draws": total,
+            "patterns": probs(tally["patterns"], total),
+            "pattern_pairs": {f"{a} + {b}": v / total for (a, b), v in tally["pattern_pairs"].most_common()},
+            "pattern_exemption": {f"{a} + {b}": v / total for (a, b), v in tally["pattern_exemption"].most_common()},
+            "pattern_net_score": {mode: {f"{a} @ {b}": v / total for (a, b), v in c.most_common()} for mode, c in tally["pattern_net"].items()},
+            "exemption": probs(tally["exemption"], total),
+            "net_score": {mode: {str(k): v / total for k, v in sorted(c.items())} for mode, c in tally["net_score"].items()},
+        }
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="列舉所有抽法，計算格局、特殊格局與淨分的精確機率")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--out", default="-", help="輸出 JSON 路徑 (預設印出)")
+    args = parser.parse_args()
+    text = json.dumps(to_report(exact_odds(args.workers)), ensure_ascii=False, indent=2)
+    if args.out == "-": print(text)
+    else:
+        with open(args.out, "w", encoding="utf-8") as f: f.write(text)
@@ -0,0 +1,306 @@
+# ==============================================================================
+# patterns.py - 特殊格局規則 (宣告式) 與編譯器
+# ==============================================================================
+# 格局以資料描述：棋種集合、位置上的顏色條件、中心與鄰位的關係。
+# compile_rules() 把每條規則編成 (test, emit, fields)：
+#   test(facts) 只用位元與比較運算，對單一盤面回傳 int/bool，對 NumPy 陣列的 facts 則逐盤面向量化；
+#   emit(facts, hit) 產生與原本 check_special_patterns 相同的 {"name", "desc"}；
+#   fields 為 test/emit 讀到的 BoardFacts 欄位，換一支棋後只有讀到變動欄位的規則需要重新判斷 (reevaluate)。
+# 盤面先一次整理成 BoardFacts (位元遮罩與計數)，之後每條規則都只是幾個位元運算，新增格局不會多一次掃描。
+#
+# 位置遮罩：第 pos 位為 1 << (pos - 1)。棋種類型代碼同 gua.KIND_TYPE (0 將 1 士 2 象 3 車 4 馬 5 包 6 卒)。
+
+from collections import namedtuple
+
+from data import KIND_INDEX, PIECE_KINDS
+from gua import Gua, POSITIONS, KIND_COLOR, KIND_TYPE
+
+# 類型代碼 <-> 類型名稱 (以黑方棋名為代表，同 rules.PIECE_TYPE_MAP 的值)
+TYPE_NAMES = [name for name, _ in PIECE_KINDS[7:]]
+TYPE_CODE = {name: t for t, name in enumerate(TYPE_NAMES)}
+NEIGHBORS = [2, 3, 4, 5]
+# 困擾格檢查的位置對，順序同原本的雙層迴圈
+PAIRS = [(i, j) for i in POSITIONS for j in POSITIONS if i < j]
+EXEMPTION_CODES = {None: 0, "眾星拱月": 1, "一枝獨秀": 2}
+
+def pos_mask(positions):
+    mask = 0
+    for pos in positions: mask |= 1 << (pos - 1)
+    return mask
+
+# ==============================================================================
+# 格局規則 (依輸出順序排列)
+# ==============================================================================
+SPECIAL_PATTERN_RULES = [
+    # 1. 好朋友格：中心與鄰位為好朋友；士仕與車俥互為好朋友時改稱親密格
+    {"key": "good_friend", "match": "center_relation", "relation": "friend",
+     "name": "🤝 好朋友格 (位{pos})", "desc": "互利互惠{detail}。",
+     "detail_by_center": {"士": " (最佳/心靈契合)", "象": " (次之/穩重)", "車": " (各持己見)", "卒": " (踏實)", "馬": " (曖昧/桃花)", "包": " (曖昧/桃花)"},
+     "override": {"type_pairs": [("士", "車"), ("車", "士")], "name": "💞 親密格 (位{pos})", "desc": "互相欣賞，非關感情的特殊好感。"}},
+    # 2. 消耗格：同字同色
+    {"key": "consumption", "match": "center_relation", "relation": "consume",
+     "name": "📉 消耗格 (位{pos})", "desc": "{detail}",
+     "detail_by_center": {"士": "自以為是、憂慮 (傷肺/大腸)。", "象": "情緒火氣大 (傷心)。", "車": "太衝、太激進、管太多 (傷肝)。",
+                          "馬": "意念紛飛、心太軟 (傷肝)。", "包": "恐懼、取巧 (傷腎)。", "卒": "想太多、行動力弱 (傷脾胃)。", "將": "固執、唯我獨尊。"}},
+    # 3. 破壞格：同字三支，一黑二紅或一紅二黑
+    {"key": "destruction", "match": "type_color_split", "count": 3,
+     "name": "⚡ 破壞格 ({type})", "desc": "人際、決策受到干擾，留意小人壞話。"},
+    # 4. 通吃格：中心被 >=3 方吃，且無好朋友
+    {"key": "all_kill", "match": "center_pressure", "min_eaten": 3,
+     "name": "☠️ 通吃格", "desc": "孤立無援，需留餘地，全盤皆輸風險大。"},
+    # 5. 富貴格：將士象 (不分顏色) 齊全
+    {"key": "wealth", "match": "type_set", "types": ["將", "士", "象"],
+     "name": "💰 富貴格", "desc": "有人幫做事，行動力弱。{trend}。",
+     "trend": {"pos": 4, "types": ["將", "士", "象"], "yes": "往上愈好", "no": "後段加強"}},
+    # 6. 事業格：車馬包齊全
+    {"key": "career", "match": "type_set", "types": ["車", "馬", "包"],
+     "name": "🏆 事業格", "desc": "氣勢強、敢衝，不利感情。{trend}。",
+     "trend": {"pos": 4, "types": ["車", "馬", "包"], "yes": "往上愈好", "no": "後段加強"}},
+    # 7. 困擾格：兩對 (不重疊的) 好朋友
+    {"key": "dilemma", "match": "friend_pairs", "min_pairs": 2,
+     "name": "😵 困擾格", "desc": "兩對好朋友，人際與決定上的困擾 (桃花或選擇多)。"},
+    # 8. 三人同心格
+    {"key": "unity", "match": "type_count", "type": "卒", "min_count": 3,
+     "name": "🤝 三人同心格", "desc": "三支兵卒，志同道合，氣勢如車。"},
+    # 9. 勝利格：V 型 (2,3,5) 同色；中心與其中任一為好朋友則為自己勝利
+    {"key": "victory", "match": "same_color", "groups": [[2, 3, 5]],
+     "name": "✌️ 勝利格 ({variant})", "desc": "V型同色。",
+     "variant": {"center_friend_any": [2, 3, 5], "yes": "自己勝利", "no": "他人勝利"}},
+    # 10. 雨傘格：2,3,4 同色，依位 4 顏色分紅傘黑傘
+    {"key": "umbrella", "match": "same_color", "groups": [[2, 3, 4]],
+     "name": "☔ 雨傘格 ({variant})", "desc": "有天助保護，但視野受限(悶)。",
+     "variant": {"red_at": 4, "yes": "紅傘 (外界看好)", "no": "黑傘 (外界不看好)"}},
+    # 11. 十字天助格：直線 (1,4,5) 或橫線 (1,2,3) 同色
+    {"key": "cross", "match": "same_color", "groups": [[1, 4, 5], [1, 2, 3]],
+     "name": "✝️ 十字天助格", "desc": "有天助，逢凶化吉。"},
+    # 補充：依 check_exemption 判斷的特殊格局
+    {"key": "exemption", "match": "exemption",
+     "variants": {"眾星拱月": {"name": "🌟 眾星拱月", "desc": "外人看好，內心有壓力。"},
+                  "一枝獨秀": {"name": "🌲 一枝獨秀", "desc": "情緒起伏大，易犯小人(若非馬炮)。"}}},
+]
+
+# ==============================================================================
+# 盤面事實 (一次整理)
+# ==============================================================================
+# types: 位置 1~5 的類型代碼；red: 紅棋位置遮罩；counts / red_counts: 各類型 (紅) 支數；
+# friend_c / consume_c / eaten_c: 與中心為好朋友 / 消耗 / 會吃中心的鄰位遮罩；
+# friend_pairs: PAIRS 中為好朋友的位置對遮罩；exempt: EXEMPTION_CODES
+BoardFacts = namedtuple("BoardFacts", "types red counts red_counts friend_c consume_c eaten_c friend_pairs exempt")
+
+def _codes(ctx):
+    gua = ctx.gua
+    if isinstance(gua, Gua): return gua.codes
+    return [KIND_INDEX[(ctx.pieces[pos][1], ctx.pieces[pos][2])] for pos in POSITIONS]
+
+def board_facts(ctx):
+    """由 rules.GuaContext 整理出 BoardFacts (沿用 context 已算好的好朋友/消耗/吃子矩陣)"""
+    codes = _codes(ctx)
+    types = tuple(KIND_TYPE[k] for k in codes)
+    counts, red_counts = [0] * 7, [0] * 7
+    red = 0
+    for i, k in enumerate(codes):
+        counts[KIND_TYPE[k]] += 1
+        if KIND_COLOR[k] == 0:
+            red |= 1 << i
+            red_counts[KIND_TYPE[k]] += 1
+    friends, consumes, eats = ctx.friends, ctx.consumes, ctx.eats
+    friend_c = consume_c = eaten_c = 0
+    for pos in NEIGHBORS:
+        bit = 1 << (pos - 1)
+        if friends[0][pos - 1]: friend_c |= bit
+        if consumes[0][pos - 1]: consume_c |= bit
+        if eats[pos - 1][0]: eaten_c |= bit
+    friend_pairs = 0
+    for n, (i, j) in enumerate(PAIRS):
+        if friends[i - 1][j - 1]: friend_pairs |= 1 << n
+    exemption = ctx.exemption
+    return BoardFacts(types, red, tuple(counts), tuple(red_counts), friend_c, consume_c, eaten_c, friend_pairs,
+                      EXEMPTION_CODES[exemption[0] if exemption else None])
+
+def _greedy_pairs(mask):
+    """依 PAIRS 順序貪婪挑選不重疊的好朋友對數 (同原本困擾格的計數方式)"""
+    used, count = 0, 0
+    for n, (i, j) in enumerate(PAIRS):
+        pair = pos_mask([i, j])
+        if mask >> n & 1 and not used & pair:
+            used |= pair; count += 1
+    return count
+
+# 10 個位置對 -> 1024 種遮罩的貪婪對數
+GREEDY_PAIR_COUNT = [_greedy_pairs(mask) for mask in range(1 << len(PAIRS))]
+
+# ==============================================================================
+# 編譯器
+# ==============================================================================
+class CompiledRule:
+    __slots__ = ("key", "test", "emit", "fields")
+
+    def __init__(self, key, test, emit, fields):
+        self.key, self.test, self.emit, self.fields = key, test, emit, frozenset(fields)
+
+def _bits(mask, positions):
+    return [pos for pos in positions if mask >> (pos - 1) & 1]
+
+def _compile_center_relation(rule):
+    attr = {"friend": "friend_c", "consume": "consume_c"}[rule["relation"]]
+    detail = [rule["detail_by_center"].get(name, "") for name in TYPE_NAMES]
+    override = rule.get("override")
+    special = {(TYPE_CODE[a], TYPE_CODE[b]) for a, b in override["type_pairs"]} if override else set()
+
+    def test(f): return getattr(f, attr)
+
+    def emit(f, hit):
+        out = []
+        for pos in _bits(hit, NEIGHBORS):
+            if (f.types[0], f.types[pos - 1]) in special:
+                out.append({"name": override["name"].format(pos=pos), "desc": override["desc"]})
+            else:
+                out.append({"name": rule["name"].format(pos=pos), "desc": rule["desc"].format(detail=detail[f.types[0]])})
+        return out
+    return test, emit, (attr, "types")
+
+def _compile_type_color_split(rule):
+    count = rule["count"]
+
+    def test(f):
+        # 回傳符合條件的類型遮罩 (單一盤面只看支數剛好的類型)
+        if isinstance(f.red, int):
+            return sum(1 << t for t, c in enumerate(f.counts) if c == count and 0 < f.red_counts[t] < count)
+        hit = 0
+        for t in range(7):
+            red = f.red_counts[t]
+            hit = hit | ((f.counts[t] == count) & (red > 0) & (red < count)) * (1 << t)
+        return hit
+
+    def emit(f, hit):
+        # 類型依在盤面中第一次出現的位置排序 (同原本的 dict 插入順序)
+        order = sorted((t for t in range(7) if hit >> t & 1), key=f.types.index)
+        return [{"name": rule["name"].format(type=TYPE_NAMES[t]), "desc": rule["desc"]} for t in order]
+    return test, emit, ("counts", "red_counts", "types")
+
+def _popcount4(mask):
+    return (mask >> 1 & 1) + (mask >> 2 & 1) + (mask >> 3 & 1) + (mask >> 4 & 1)
+
+def _compile_center_pressure(rule):
+    min_eaten = rule["min_eaten"]
+
+    def test(f): return (_popcount4(f.eaten_c) >= min_eaten) & (f.friend_c == 0)
+    def emit(f, hit): return [{"name": rule["name"], "desc": rule["desc"]}]
+    return test, emit, ("eaten_c", "friend_c")
+
+def _compile_type_set(rule):
+    needed = [TYPE_CODE[name] for name in rule["types"]]
+    trend = rule["trend"]
+    trend_types = {TYPE_CODE[name] for name in trend["types"]}
+
+    def test(f):
+        hit = True
+        for t in needed: hit = hit & (f.counts[t] > 0)
+        return hit
+
+    def emit(f, hit):
+        text = trend["yes"] if f.types[trend["pos"] - 1] in trend_types else trend["no"]
+        return [{"name": rule["name"], "desc": rule["desc"].format(trend=text)}]
+    return test, emit, ("counts", "types")
+
+def _compile_friend_pairs(rule):
+    min_pairs = rule["min_pairs"]
+    # 達到門檻的遮罩先算成表，執行時只查表
+    table = [GREEDY_PAIR_COUNT[mask] >= min_pairs for mask in range(len(GREEDY_PAIR_COUNT))]
+
+    def test(f):
+        if isinstance(f.friend_pairs, int): return table[f.friend_pairs]
+        import numpy as np
+        return np.asarray(table)[f.friend_pairs]
+    def emit(f, hit): return [{"name": rule["name"], "desc": rule["desc"]}]
+    return test, emit, ("friend_pairs",)
+
+def _compile_type_count(rule):
+    t, min_count = TYPE_CODE[rule["type"]], rule["min_count"]
+
+    def test(f): return f.counts[t] >= min_count
+    def emit(f, hit): return [{"name": rule["name"], "desc": rule["desc"]}]
+    return test, emit, ("counts",)
+
+def _compile_same_color(rule):
+    masks = [pos_mask(group) for group in rule["groups"]]
+    variant = rule.get("variant")
+
+    def test(f):
+        hit = False
+        for m in masks:
+            red = f.red & m
+            hit = hit | (red == 0) | (red == m)
+        return hit
+
+    def emit(f, hit):
+        if not variant: return [{"name": rule["name"], "desc": rule["desc"]}]
+        if "center_friend_any" in variant: yes = bool(f.friend_c & pos_mask(variant["center_friend_any"]))
+        else: yes = bool(f.red >> (variant["red_at"] - 1) & 1)
+        return [{"name": rule["name"].format(variant=variant["yes"] if yes else variant["no"]), "desc": rule["desc"]}]
+    return test, emit, ("red", "friend_c") if variant and "center_friend_any" in variant else ("red",)
+
+def _compile_exemption(rule):
+    variants = {EXEMPTION_CODES[name]: v for name, v in rule["variants"].items()}
+
+    def test(f): return f.exempt
+    def emit(f, hit): return [dict(variants[hit])] if hit in variants else []
+    return test, emit, ("exempt",)
+
+COMPILERS = {
+    "center_relation": _compile_center_relation,
+    "type_color_split": _compile_type_color_split,
+    "center_pressure": _compile_center_pressure,
+    "type_set": _compile_type_set,
+    "friend_pairs": _compile_friend_pairs,
+    "type_count": _compile_type_count,
+    "same_color": _compile_same_color,
+    "exemption": _compile_exemption,
+}
+
+def compile_rules(rules):
+    compiled = []
+    for rule in rules:
+        if rule["match"] not in COMPILERS: raise ValueError(f"未知的格局比對方式: {rule['match']!r} ({rule.get('key')})")
+        compiled.append(CompiledRule(rule["key"], *COMPILERS[rule["match"]](rule)))
+    return compiled
+
+SPECIAL_PATTERNS = compile_rules(SPECIAL_PATTERN_RULES)
+
+def pattern_label(name):
+    """格局名稱去掉圖示與位置/變體：'📉 消耗格 (位2)' -> '消耗格' (紀錄與統計用)"""
+    return name.split(" ", 1)[-1].split(" (", 1)[0]
+
+def evaluate(facts, compiled=SPECIAL_PATTERNS):
+    """單一盤面：依規則順序回傳 [{"name", "desc"}, ...]"""
+    patterns = []
+    for rule in compiled:
+        hit = rule.test(facts)
+        if hit: patterns.extend(rule.emit(facts, hit))
+    return patterns
+
+def evaluate_by_rule(facts, compiled=SPECIAL_PATTERNS):
+    """單一盤面：每條規則各自的輸出 (tuple，順序同規則)；串接起來即 evaluate() 的結果"""
+    by_rule = []
+    for rule in compiled:
+        hit = rule.test(facts)
+        by_rule.append(rule.emit(facts, hit) if hit else [])
+    return tuple(by_rule)
+
+def reevaluate(old_facts, old_by_rule, new_facts, compiled=SPECIAL_PATTERNS):
+    """盤面小幅變動後 (例如換一支棋)：只重新判斷讀到變動事實的規則，其餘沿用 old_by_rule。
+    回傳 (各規則輸出, 重新判斷的規則 key)"""
+    changed = {field for field, old, new in zip(BoardFacts._fields, old_facts, new_facts) if old != new}
+    by_rule, rechecked = [], []
+    for rule, old in zip(compiled, old_by_rule):
+        if not rule.fields.isdisjoint(changed):
+            hit = rule.test(new_facts)
+            by_rule.append(rule.emit(new_facts, hit) if hit else [])
+            rechecked.append(rule.key)
+        else:
+            by_rule.append(old)
+    return tuple(by_rule), rechecked
+
+def evaluate_hits(facts, compiled=SPECIAL_PATTERNS):
+    """批次盤面 (facts 欄位為 NumPy 陣列)：回傳 {規則 key: 每盤面的 test 結果陣列}"""
+    return {rule.key: rule.test(facts) for rule in compiled}
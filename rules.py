@@ -1,5 +1,12 @@
-import random
-from data import VALUE_MAP, ATTRIBUTES, PIECE_NAMES, GEOMETRY_RELATION, FIVE_ELEMENTS_DETAILS, ENERGY_REMEDIES, PIECE_SYMBOLISM, SYMBOL_KEY_MAP, PAST_LIFE_ARCHETYPES, LIFE_STAGES
+import os
+import threading
+from functools import lru_cache
+from data import VALUE_MAP, ATTRIBUTES, PIECE_NAMES, GEOMETRY_RELATION, FIVE_ELEMENTS_DETAILS, ENERGY_REMEDIES, PIECE_SYMBOLISM, SYMBOL_KEY_MAP, PAST_LIFE_ARCHETYPES, LIFE_STAGES, PIECE_KINDS, KIND_INDEX
+from gua import Gua, FullLifeGua, POSITIONS, KIND_COLOR
+import instrument
+import sampler
+from cache import LRUCache
+from patterns import board_facts, evaluate as evaluate_patterns
 
 # ==============================================================================
 # 輔助：棋子類型映射
@@ -25,32 +32,37 @@ def get_full_deck():
     deck.extend([('卒', '黑')] * 5)
     return deck
 
-def generate_random_gua():
-    full_deck = get_full_deck()
-    selected_pieces = random.sample(full_deck, 5)
-    gua = []
-    positions = [1, 2, 3, 4, 5]
-    for i in range(5):
-        name, color = selected_pieces[i]
-        gua.append((positions[i], name, color, VALUE_MAP.get(name, 0)))
-    return gua
-
-def generate_full_life_gua():
-    full_deck = get_full_deck()
-    random.shuffle(full_deck)
-    full_gua = {}
-    full_gua["raw_flow"] = full_deck 
-    start_index = 0
-    for stage in LIFE_STAGES:
-        stage_pieces_raw = full_deck[start_index : start_index + 5]
-        start_index += 5
-        stage_gua = []
-        for i in range(5):
-            name, color = stage_pieces_raw[i]
-            stage_gua.append(((positions := [1, 2, 3, 4, 5])[i], name, color, VALUE_MAP.get(name, 0)))
-        full_gua[stage] = stage_gua
-    full_gua["餘棋"] = full_deck[30:]
-    return full_gua
+def generate_random_gua(rng=None):
+    """rng 為該 session 的 random.Random(seed)；省略時使用全域 random"""
+    return sampler.draw_gua(rng)
+
+def generate_full_life_gua(rng=None):
+    # 只存 32 bytes 的牌序；raw_flow、各階段盤面、餘棋在取用時才解碼 (見 gua.FullLifeGua)
+    return FullLifeGua(sampler.draw_deck(rng))
+
+# --- 盤面編碼 (棋盤 ID) ---
+# 位置 1~5 各放一個棋種代碼 (0~13)，以 14 進位組成整數，位置 1 為最低位
+BOARD_ID_SPACE = 14 ** 5
+
+def encode_gua(current_gua):
+    if isinstance(current_gua, GuaContext): current_gua = current_gua.gua
+    if isinstance(current_gua, Gua): return current_gua.board_id
+    board_id = 0
+    for pos, name, color, _ in current_gua:
+        board_id += KIND_INDEX[(name, color)] * 14 ** (pos - 1)
+    return board_id
+
+def decode_gua(board_id): return Gua.from_board_id(board_id)
+
+def piece_at(current_gua, pos):
+    """取得指定位置的棋子 (Gua 直接索引，一般串列則線性搜尋；找不到時拋出 StopIteration)"""
+    if isinstance(current_gua, Gua):
+        if 1 <= pos <= 5: return current_gua.piece(pos)
+        raise StopIteration
+    if isinstance(current_gua, GuaContext):
+        if pos in current_gua.pieces: return current_gua.pieces[pos]
+        raise StopIteration
+    return next(p for p in current_gua if p[0] == pos)
 
 # --- 基礎判斷邏輯 ---
 def is_same_type(name1, name2): return PIECE_TYPE_MAP.get(name1) == PIECE_TYPE_MAP.get(name2)
@@ -75,11 +87,20 @@ def check_consumption(p1, p2):
     return is_same_type(p1[1], p2[1]) and p1[2] == p2[2]
 
 def is_all_same_color(current_gua):
+    if isinstance(current_gua, Gua): return len({KIND_COLOR[k] for k in current_gua.codes}) == 1
     if not current_gua: return True
     first_color = current_gua[0][2]
     return all(p[2] == first_color for p in current_gua)
 
 def check_exemption(current_gua):
+    if isinstance(current_gua, GuaContext): return current_gua.exemption
+    if isinstance(current_gua, Gua):
+        colors = [KIND_COLOR[k] for k in current_gua.codes]
+        black_count = sum(colors)
+        if black_count not in (1, 4): return None
+        unique_piece = current_gua.piece(colors.index(1 if black_count == 1 else 0) + 1)
+        if unique_piece[0] == 1: return ("眾星拱月", 1, unique_piece[1])
+        else: return ("一枝獨秀", unique_piece[0], unique_piece[1])
     color_counts = {'紅': 0, '黑': 0}
     for p in current_gua: color_counts[p[2]] += 1
     unique_color = None
@@ -91,28 +112,21 @@ def check_exemption(current_gua):
         else: return ("一枝獨秀", unique_piece[0], unique_piece[1])
     return None
 
-def can_eat(eater_pos, target_pos, current_gua):
-    try:
-        eater = next(p for p in current_gua if p[0] == eater_pos)
-        target = next(p for p in current_gua if p[0] == target_pos)
-    except StopIteration: return False
-    eater_name, eater_color = eater[1], eater[2]
-    target_name, target_color = target[1], target[2]
-    if eater_color == target_color: return False 
-    try: geometry = GEOMETRY_RELATION[eater_pos][target_pos]
-    except KeyError: return False
+def _exemption_override(exemption, eater_name, target_name, target_pos):
+    """特殊格局對吃子的強制結果 (None 表示不受影響)"""
+    if exemption[0] == "眾星拱月" and target_pos == 1: return False
+    if exemption[0] == "一枝獨秀" and target_pos == exemption[1]:
+        if eater_name in ['馬', '傌', '包', '炮']: 
+            if eater_name in ['馬', '傌'] and target_pos == 1 and target_name in ['車', '俥']: return False
+            return True
+        return False
+    return None
 
-    exemption = check_exemption(current_gua)
-    if exemption:
-        if exemption[0] == "眾星拱月" and target_pos == 1: return False
-        if exemption[0] == "一枝獨秀" and target_pos == exemption[1]:
-            if eater_name in ['馬', '傌', '包', '炮']: 
-                if eater_name in ['馬', '傌'] and target_pos == 1 and target_name in ['車', '俥']: return False
-                return True
-            return False
+def _capture_rule(eater_name, target_name, geometry):
+    """依走法與階級判斷能否吃子 (不含顏色與特殊格局)"""
     is_valid = False
     if eater_name in ['馬', '傌']: is_valid = (geometry == "斜位")
-    elif eater_name in ['包', '炮']: is_valid = (geometry == "縱隔山") and any(p[0]==1 for p in current_gua)
+    elif eater_name in ['包', '炮']: is_valid = (geometry == "縱隔山")
     elif eater_name in ['兵', '卒']: is_valid = (geometry == "十字") 
     elif geometry == "十字": is_valid = True
     if not is_valid: return False
@@ -124,132 +138,194 @@ def can_eat(eater_pos, target_pos, current_gua):
     if eater_name in ['車', '俥'] and target_name in rank_group: return False
     return True
 
+def _scan_can_eat(eater_pos, target_pos, current_gua):
+    try:
+        eater = piece_at(current_gua, eater_pos)
+        target = piece_at(current_gua, target_pos)
+    except StopIteration: return False
+    eater_name, eater_color = eater[1], eater[2]
+    target_name, target_color = target[1], target[2]
+    if eater_color == target_color: return False 
+    try: geometry = GEOMETRY_RELATION[eater_pos][target_pos]
+    except KeyError: return False
+
+    exemption = check_exemption(current_gua)
+    if exemption:
+        override = _exemption_override(exemption, eater_name, target_name, target_pos)
+        if override is not None: return override
+    # 炮需隔著中心(1)才能翻山
+    if eater_name in ['包', '炮'] and not any(p[0]==1 for p in current_gua): return False
+    return _capture_rule(eater_name, target_name, geometry)
+
+# --- 吃子關係預先編譯 ---
+# CAPTURE_TABLE[(吃方棋種, 被吃棋種, 吃方位置, 被吃位置)]：不含特殊格局時能否吃子
+def _capture_index(eater_kind, target_kind, eater_pos, target_pos):
+    return ((eater_kind * 14 + target_kind) * 5 + eater_pos - 1) * 5 + target_pos - 1
+
+def _build_capture_table():
+    table = bytearray(14 * 14 * 25)
+    for ek, (eater_name, eater_color) in enumerate(PIECE_KINDS):
+        for tk, (target_name, target_color) in enumerate(PIECE_KINDS):
+            if eater_color == target_color: continue
+            for ep in POSITIONS:
+                for tp in POSITIONS:
+                    geometry = GEOMETRY_RELATION[ep].get(tp)
+                    if geometry and _capture_rule(eater_name, target_name, geometry):
+                        table[_capture_index(ek, tk, ep, tp)] = 1
+    return bytes(table)
+
+CAPTURE_TABLE = _build_capture_table()
+
+def _capture_cell(codes, exemption, ep, tp):
+    ek, tk = codes[ep - 1], codes[tp - 1]
+    if KIND_COLOR[ek] == KIND_COLOR[tk]: return False
+    override = _exemption_override(exemption, PIECE_KINDS[ek][0], PIECE_KINDS[tk][0], tp) if exemption else None
+    return bool(CAPTURE_TABLE[_capture_index(ek, tk, ep, tp)]) if override is None else override
+
+@lru_cache(maxsize=16384)
+def _gua_capture_matrix(codes):
+    # 特殊格局每盤只判斷一次，再覆寫被影響的那一欄
+    exemption = check_exemption(Gua(codes))
+    matrix = tuple(tuple(_capture_cell(codes, exemption, ep, tp) for tp in POSITIONS) for ep in POSITIONS)
+    _capture_miss.flag = True   # 只有未命中時才會執行到這裡 (同一執行緒)
+    return matrix
+
+_capture_miss = threading.local()
+
+def _capture_lookup(codes, name):
+    """查吃子矩陣快取；啟用 instrument 時依呼叫的函數名稱累計命中/未命中"""
+    if not instrument.ENABLED: return _gua_capture_matrix(codes)
+    _capture_miss.flag = False
+    matrix = _gua_capture_matrix(codes)
+    instrument.count_cache(name, not _capture_miss.flag)
+    return matrix
+
+def capture_matrix(current_gua):
+    """5x5 吃子矩陣：matrix[e-1][t-1] 表示位置 e 能否吃位置 t"""
+    if isinstance(current_gua, GuaContext): return current_gua.eats
+    if not isinstance(current_gua, Gua):
+        try: current_gua = Gua.from_pieces(current_gua)
+        except (KeyError, ValueError, IndexError):
+            # 不完整或非標準的盤面：逐格判斷
+            return tuple(tuple(_scan_can_eat(ep, tp, current_gua) for tp in POSITIONS) for ep in POSITIONS)
+    return _capture_lookup(current_gua.codes, "capture_matrix")
+
+def can_eat(eater_pos, target_pos, current_gua):
+    if isinstance(current_gua, (Gua, GuaContext)):
+        if not (1 <= eater_pos <= 5 and 1 <= target_pos <= 5): return False
+        matrix = current_gua.eats if isinstance(current_gua, GuaContext) else _capture_lookup(current_gua.codes, "can_eat")
+        return matrix[eater_pos - 1][target_pos - 1]
+    return _scan_can_eat(eater_pos, target_pos, current_gua)
+
+# ==============================================================================
+# 共用分析資料 (一次占卜只計算一次)
+# ==============================================================================
+class GuaContext:
+    """盤面的共用事實：位置對照、好朋友/消耗/吃子矩陣、顏色統計與特殊格局。
+    可直接傳給各分析函數，也可像原本的盤面一樣迭代。"""
+    __slots__ = ("gua", "pieces", "center", "friends", "consumes", "eats", "color_counts", "exemption")
+
+    def __init__(self, current_gua):
+        self.gua = current_gua
+        self.pieces = {p[0]: p for p in current_gua}
+        self.center = self.pieces.get(1)
+        row = [self.pieces.get(pos) for pos in POSITIONS]
+        # 矩陣皆以 [位置-1][位置-1] 索引，缺棋的位置一律為 False
+        self.friends = tuple(tuple(a is not None and b is not None and check_good_friend(a, b) for b in row) for a in row)
+        self.consumes = tuple(tuple(a is not None and b is not None and a is not b and check_consumption(a, b) for b in row) for a in row)
+        self.eats = capture_matrix(current_gua)
+        self.color_counts = {'紅': sum(p[2] == '紅' for p in current_gua), '黑': sum(p[2] == '黑' for p in current_gua)}
+        self.exemption = check_exemption(current_gua)
+
+    def __iter__(self): return iter(self.gua)
+    def __len__(self): return len(self.gua)
+    def __getitem__(self, index): return self.gua[index]
+
+    def with_piece(self, pos, kind):
+        """把位置 pos 換成棋種 kind 的新 context：只重算該位置所在的列與欄，
+        其餘關係沿用本盤 (特殊格局改變時，被覆寫的吃子欄位整個重算)。僅適用於 Gua 盤面"""
+        codes = bytearray(self.gua.codes); codes[pos - 1] = kind
+        gua = Gua(codes)
+        codes = gua.codes
+        new = GuaContext.__new__(GuaContext)
+        new.gua = gua
+        new.pieces = dict(self.pieces); new.pieces[pos] = gua.piece(pos)
+        new.center = new.pieces[1]
+        new.exemption = check_exemption(gua)
+        i = pos - 1
+        new.friends = _patch_matrix(self.friends, i, lambda a, b: _FRIEND_KINDS[codes[a]][codes[b]])
+        new.consumes = _patch_matrix(self.consumes, i, lambda a, b: a != b and _CONSUME_KINDS[codes[a]][codes[b]])
+        if new.exemption == self.exemption:
+            new.eats = _patch_matrix(self.eats, i, lambda a, b: _capture_cell(codes, new.exemption, a + 1, b + 1))
+        else:
+            new.eats = _gua_capture_matrix(codes)
+        new.color_counts = dict(self.color_counts)
+        new.color_counts[self.pieces[pos][2]] -= 1; new.color_counts[new.pieces[pos][2]] += 1
+        return new
+
+# 好朋友/消耗只看兩支棋的棋種 (與位置無關)：[棋種][棋種] 預先算好，換棋時直接查表
+_FRIEND_KINDS = [[check_good_friend((0, *a), (0, *b)) for b in PIECE_KINDS] for a in PIECE_KINDS]
+_CONSUME_KINDS = [[check_consumption((0, *a), (0, *b)) for b in PIECE_KINDS] for a in PIECE_KINDS]
+
+def _patch_matrix(matrix, i, cell):
+    """只重算第 i 列與第 i 欄 (以 0 起算)，其餘沿用"""
+    rows = [list(row) for row in matrix]
+    for j in range(5):
+        rows[i][j] = cell(i, j)
+        rows[j][i] = cell(j, i)
+    return tuple(map(tuple, rows))
+
+@lru_cache(maxsize=16384)
+def _gua_context(codes): return GuaContext(Gua(codes))
+
+def get_context(current_gua):
+    """取得盤面的 GuaContext (Gua 依盤面快取；已是 GuaContext 則原樣傳回)"""
+    if isinstance(current_gua, GuaContext): return current_gua
+    if isinstance(current_gua, Gua): return _gua_context(current_gua.codes)
+    return GuaContext(current_gua)
+
+def board_fingerprint(current_gua):
+    """盤面的標準指紋 (棋盤 ID)，與資料表示方式無關；不完整或非標準的盤面回傳 None"""
+    if isinstance(current_gua, GuaContext): current_gua = current_gua.gua
+    if isinstance(current_gua, Gua): return current_gua.board_id
+    try: return Gua.from_pieces(current_gua).board_id
+    except (KeyError, ValueError, IndexError): return None
+
+# 跨 session 共用的分析結果快取：鍵為 (盤面指紋, 函數名稱, 影響結果的參數)
+READING_CACHE = LRUCache(int(os.environ.get("XIANGBU_CACHE_SIZE", "32768")))
+
+def cached_call(fn, current_gua, *args, compute=None):
+    """以盤面指紋與參數快取 fn(盤面, *args) 的結果 (回傳值為共用物件，請勿修改)"""
+    compute = compute or (lambda: fn(get_context(current_gua), *args))
+    fingerprint = board_fingerprint(current_gua)
+    if fingerprint is None: return compute()
+    key = (fingerprint, fn.__name__) + args
+    if instrument.ENABLED: return instrument.cached(fn.__name__, READING_CACHE, key, compute)
+    return READING_CACHE.get_or_compute(key, compute)
+
+def clear_caches():
+    """清除每盤快取 (吃子矩陣、GuaContext 與分析結果)，量測冷啟動效能時使用"""
+    _gua_capture_matrix.cache_clear(); _gua_context.cache_clear(); READING_CACHE.clear()
+
+def cache_info():
+    return {"capture_matrix": _gua_capture_matrix.cache_info()._asdict(), "context": _gua_context.cache_info()._asdict(),
+            "reading": READING_CACHE.stats()}
+
 # ==============================================================================
 # 【核心升級】特殊格局掃描引擎 (Rules 1-11)
 # ==============================================================================
 def check_special_patterns(current_gua):
-    patterns = []
-    p_map = {p[0]: p for p in current_gua}
-    colors = {pos: p[2] for pos, p in p_map.items()}
-    names = {pos: p[1] for pos, p in p_map.items()}
-    all_names = [p[1] for p in current_gua]
-    center = p_map[1]
-
-    # 1. 好朋友格 (Good Friends)
-    # 掃描與中心(1)的好朋友關係
-    for pos in [2,3,4,5]:
-        if check_good_friend(center, p_map[pos]):
-            friend_type = ""
-            n = center[1]
-            if n in ['士','仕']: friend_type = " (最佳/心靈契合)"
-            elif n in ['象','相']: friend_type = " (次之/穩重)"
-            elif n in ['車','俥']: friend_type = " (各持己見)"
-            elif n in ['兵','卒']: friend_type = " (踏實)"
-            elif n in ['馬','傌','包','炮']: friend_type = " (曖昧/桃花)"
-            
-            # 特殊親密格檢查
-            n_other = p_map[pos][1]
-            if (n in ['士','仕'] and n_other in ['車','俥']) or (n in ['車','俥'] and n_other in ['士','仕']):
-                patterns.append({"name": f"💞 親密格 (位{pos})", "desc": "互相欣賞，非關感情的特殊好感。"})
-            else:
-                patterns.append({"name": f"🤝 好朋友格 (位{pos})", "desc": f"互利互惠{friend_type}。"})
-
-    # 2. 消耗格 (Consumption) - 同字同色
-    for pos in [2,3,4,5]:
-        if check_consumption(center, p_map[pos]):
-            n = center[1]
-            desc = ""
-            if n in ['士','仕']: desc = "自以為是、憂慮 (傷肺/大腸)。"
-            elif n in ['象','相']: desc = "情緒火氣大 (傷心)。"
-            elif n in ['車','俥']: desc = "太衝、太激進、管太多 (傷肝)。"
-            elif n in ['馬','傌']: desc = "意念紛飛、心太軟 (傷肝)。"
-            elif n in ['包','炮']: desc = "恐懼、取巧 (傷腎)。"
-            elif n in ['兵','卒']: desc = "想太多、行動力弱 (傷脾胃)。"
-            elif n in ['將','帥']: desc = "固執、唯我獨尊。"
-            patterns.append({"name": f"📉 消耗格 (位{pos})", "desc": desc})
-
-    # 3. 破壞格 (Destruction)
-    # 同字一黑二紅 或 一紅二黑
-    # 統計各棋種的顏色數量
-    type_counts = {}
-    for p in current_gua:
-        t = PIECE_TYPE_MAP.get(p[1])
-        if t not in type_counts: type_counts[t] = {'紅':0, '黑':0}
-        type_counts[t][p[2]] += 1
-    
-    for t, counts in type_counts.items():
-        total = counts['紅'] + counts['黑']
-        if total == 3:
-            if (counts['紅']==1 and counts['黑']==2) or (counts['紅']==2 and counts['黑']==1):
-                 patterns.append({"name": f"⚡ 破壞格 ({t})", "desc": "人際、決策受到干擾，留意小人壞話。"})
-
-    # 4. 通吃格 (All-kill)
-    # 兵象包象仕混雜，無保護被吃
-    # 簡化判斷：若中心被 >=3 方吃，且無好朋友
-    be_eaten_count = sum(1 for pos in [2,3,4,5] if can_eat(pos, 1, current_gua))
-    has_friend = any(check_good_friend(center, p_map[pos]) for pos in [2,3,4,5])
-    if be_eaten_count >= 3 and not has_friend:
-         patterns.append({"name": "☠️ 通吃格", "desc": "孤立無援，需留餘地，全盤皆輸風險大。"})
-
-    # 5. 富貴格 (Wealth) - 將士相
-    has_gen = any(n in ['將', '帥'] for n in all_names)
-    has_adv = any(n in ['士', '仕'] for n in all_names)
-    has_ele = any(n in ['象', '相'] for n in all_names)
-    if has_gen and has_adv and has_ele:
-        trend = "往上愈好" if p_map[4][1] in ['將','帥','士','仕','象','相'] else "後段加強"
-        patterns.append({"name": "💰 富貴格", "desc": f"有人幫做事，行動力弱。{trend}。"})
-
-    # 6. 事業格 (Career) - 車馬包
-    has_car = any(n in ['車', '俥'] for n in all_names)
-    has_hor = any(n in ['馬', '傌'] for n in all_names)
-    has_can = any(n in ['包', '炮'] for n in all_names)
-    if has_car and has_hor and has_can:
-        trend = "往上愈好" if p_map[4][1] in ['車','俥','馬','傌','包','炮'] else "後段加強"
-        patterns.append({"name": "🏆 事業格", "desc": f"氣勢強、敢衝，不利感情。{trend}。"})
-
-    # 7. 困擾格 (Dilemma) - 兩對好朋友
-    friend_pairs = 0
-    checked = []
-    for i in range(1, 6):
-        for j in range(i+1, 6):
-            if i in checked or j in checked: continue
-            if check_good_friend(p_map[i], p_map[j]):
-                friend_pairs += 1
-                checked.extend([i, j])
-    if friend_pairs >= 2:
-        patterns.append({"name": "😵 困擾格", "desc": "兩對好朋友，人際與決定上的困擾 (桃花或選擇多)。"})
-        
-    # 8. 三人同心格 (Unity)
-    if sum(1 for n in all_names if n in ['兵', '卒']) >= 3:
-        patterns.append({"name": "🤝 三人同心格", "desc": "三支兵卒，志同道合，氣勢如車。"})
-
-    # 9. 勝利格 (Victory) - V型 (2,3,5)
-    if colors[2] == colors[3] == colors[5]: # 假設同色即構成V
-        winner = "自己勝利" if any(check_good_friend(center, p_map[n]) for n in [2,3,5]) else "他人勝利"
-        patterns.append({"name": f"✌️ 勝利格 ({winner})", "desc": "V型同色。"})
-
-    # 10. 雨傘格 (Umbrella) - 2,3,4 同色
-    if colors[2] == colors[3] == colors[4]:
-        u_type = "紅傘 (外界看好)" if colors[4] == "紅" else "黑傘 (外界不看好)"
-        patterns.append({"name": f"☔ 雨傘格 ({u_type})", "desc": "有天助保護，但視野受限(悶)。"})
-
-    # 11. 十字天助格 (Cross)
-    if (colors[1] == colors[4] == colors[5]) or (colors[1] == colors[2] == colors[3]):
-         patterns.append({"name": "✝️ 十字天助格", "desc": "有天助，逢凶化吉。"})
-
-    # 補充：鬱卒/眾星/一枝獨秀 (依賴 check_exemption 判斷)
-    exemp = check_exemption(current_gua)
-    if exemp:
-        p_name, _, _ = exemp
-        if p_name == "眾星拱月": patterns.append({"name": f"🌟 {p_name}", "desc": "外人看好，內心有壓力。"})
-        if p_name == "一枝獨秀": patterns.append({"name": f"🌲 {p_name}", "desc": "情緒起伏大，易犯小人(若非馬炮)。"})
-
-    return patterns
+    # 規則定義與編譯見 patterns.py：盤面整理成位元事實後，每條格局只需幾個位元運算
+    return evaluate_patterns(board_facts(get_context(current_gua)))
 
 # --- 其他功能函數 (保持不變) ---
+# calculate_score_by_mode 支援的模式 (全專案共用這一份)
+SCORE_MODES = ["general", "career", "karma", "health", "investment", "love", "divorce", "transaction"]
+
 def calculate_score_by_mode(current_gua, mode="general"):
-    center = next(p for p in current_gua if p[0] == 1)
-    neighbors = [p for p in current_gua if p[0] != 1]
+    ctx = get_context(current_gua)
+    center = piece_at(ctx, 1)
+    neighbors = [p for p in ctx if p[0] != 1]
     report = {"score_A": 0.0, "score_B": 0.0, "net_score": 0.0, "label_A": "", "label_B": "", "label_Net": "", "details_A": [], "details_B": [], "interpretation": "", "health_status": []}
     config = {
         "general": ("助力 (+)", "壓力 (-)", "運勢損益"), "career": ("掌控權 (+)", "被剝奪感 (-)", "權力指數"),
@@ -258,24 +334,25 @@ def calculate_score_by_mode(current_gua, mode="general"):
         "divorce": ("自由度 (+)", "損耗度 (-)", "離異指數"), "transaction": ("成交機率", "阻力成本", "成交指數")
     }
     lbl_A, lbl_B, lbl_Net = config.get(mode, config["general"])
+    eats, friends = ctx.eats, ctx.friends
     report["label_A"], report["label_B"], report["label_Net"] = lbl_A, lbl_B, lbl_Net
 
     for nb in neighbors:
         pos_n, name_n, val_n = nb[0], nb[1], VALUE_MAP.get(nb[1], 0)
         pos_c, name_c, val_c = center[0], center[1], VALUE_MAP.get(center[1], 0)
         gain = 0
-        if can_eat(pos_c, pos_n, current_gua):
+        if eats[pos_c - 1][pos_n - 1]:
             if name_c in ['象','相'] and name_n in ['車','俥']: gain = val_n * 0.5
             elif name_c in ['兵','卒'] and name_n in ['將','帥']: gain = val_n * 1.0
             else: gain = val_n
-        elif check_good_friend(center, nb) and mode not in ['health', 'love', 'transaction']: gain = val_n * 0.5
+        elif friends[0][pos_n - 1] and mode not in ['health', 'love', 'transaction']: gain = val_n * 0.5
 
         cost = 0
-        if can_eat(pos_n, pos_c, current_gua):
+        if eats[pos_n - 1][pos_c - 1]:
             if name_n in ['象','相'] and name_c in ['車','俥']: cost = val_c * 0.5
             elif name_n in ['兵','卒'] and name_c in ['將','帥']: cost = val_c * 1.0
             else: cost = val_c
-        elif check_good_friend(center, nb) and mode not in ['health', 'love', 'transaction']: cost = val_c * 0.5
+        elif friends[0][pos_n - 1] and mode not in ['health', 'love', 'transaction']: cost = val_c * 0.5
 
         if mode == 'health':
             status = "無感"
@@ -288,7 +365,7 @@ def calculate_score_by_mode(current_gua, mode="general"):
             if cost > 0: report["score_A"] += cost; report["details_A"].append(f"被 {name_n} 吃: 對方主導 {cost}")
             if gain > 0: report["score_B"] += gain; report["details_B"].append(f"吃 {name_n}: 我方付出 {gain}")
         elif mode == 'transaction':
-            if check_good_friend(center, nb): report["score_A"] += 20; report["details_A"].append(f"{name_n}: 好朋友 (+20)")
+            if friends[0][pos_n - 1]: report["score_A"] += 20; report["details_A"].append(f"{name_n}: 好朋友 (+20)")
             elif gain > 0: report["score_A"] += gain; report["details_A"].append(f"吃 {name_n}: +{gain}")
             if cost > 0: report["score_B"] += cost; report["details_B"].append(f"被 {name_n} 吃: -{cost}")
         else:
@@ -317,8 +394,8 @@ def calculate_score_by_mode(current_gua, mode="general"):
     return report
 
 def analyze_health_and_luck(current_gua):
-    analysis = {'red_count': 0, 'black_count': 0, 'health_warnings': [], 'remedy': {}}
-    for p in current_gua: analysis['red_count'] += (p[2]=='紅'); analysis['black_count'] += (p[2]=='黑')
+    ctx = get_context(current_gua)
+    analysis = {'red_count': ctx.color_counts['紅'], 'black_count': ctx.color_counts['黑'], 'health_warnings': [], 'remedy': {}}
     rc, bc = analysis['red_count'], analysis['black_count']
     if (rc==2 and bc==3) or (rc==3 and bc==2): analysis['balance_msg'] = "✅ **二三配：** 情緒穩定。"
     elif (rc==1 and bc==4) or (rc==4 and bc==1): analysis['balance_msg'] = "⚠️ **一四配：** 情緒起伏大。"
@@ -330,14 +407,13 @@ def analyze_health_and_luck(current_gua):
     return analysis
 
 def get_marketing_strategy(current_gua):
-    center = next(p for p in current_gua if p[0] == 1)
-    neighbors = [p for p in current_gua if p[0] != 1]
-    has_friend = any(check_good_friend(center, n) for n in neighbors)
+    ctx = get_context(current_gua)
+    has_friend = any(ctx.friends[0][1:])
     if has_friend: return "❤️ **感性行銷**：頻率相同，多聊理念。"
     else: return "📊 **理性行銷**：頻率不同，需拿數據。"
 
 def get_past_life_reading(current_gua):
-    center = next(p for p in current_gua if p[0] == 1); name = center[1]
+    center = piece_at(current_gua, 1); name = center[1]
     role = PAST_LIFE_ARCHETYPES.get(name, "平民")
     relations = []
     for pos in [2, 3]: relations.append(f"左右: **平行/淺緣** (同事/鄰居)。")
@@ -349,36 +425,38 @@ def calculate_net_gain_from_gua(current_gua):
     return {"gain": res["score_A"], "cost": res["score_B"], "net_gain": res["net_score"], "interactions": []}
 
 def get_advanced_piece_analysis(current_gua):
-    center = next(p for p in current_gua if p[0] == 1)
+    center = piece_at(current_gua, 1)
     sym_key = SYMBOL_KEY_MAP.get(center[1], "兵卒")
     data = PIECE_SYMBOLISM.get(sym_key, {})
     return {"role_title": data.get("role",""), "self_desc": data.get("self",""), "love_desc": data.get("love",""), "career_desc": data.get("career",""), "health_desc": data.get("health",""), "special_warnings": []}
 
 def check_consumption_at_1_or_5(current_gua):
-    p1 = next(p for p in current_gua if p[0] == 1); p5 = next(p for p in current_gua if p[0] == 5)
+    p1 = piece_at(current_gua, 1); p5 = piece_at(current_gua, 5)
     return p1[1] == p5[1] and p1[2] == p5[2]
 
 def check_interference(current_gua):
     events = []
+    eats = capture_matrix(current_gua)
     for pos_a, name_a, color_a, val_a in current_gua:
         if name_a in ['馬', '傌', '包', '炮']:
-            if can_eat(pos_a, 1, current_gua):
+            if eats[pos_a - 1][0]:
                 type_ = "犯小人/卡陰" if name_a in ['馬', '傌'] else "投資虧損"
                 events.append(f"{color_a}{name_a} 剋入 ({type_})")
     return events
 
 def analyze_trinity_detailed(current_gua): 
-    p1 = next(p for p in current_gua if p[0] == 1); p4 = next(p for p in current_gua if p[0] == 4); p5 = next(p for p in current_gua if p[0] == 5)
+    ctx = get_context(current_gua)
     res = {"missing_heaven":None,"missing_human":None,"missing_earth":None}
-    if check_consumption(p4,p1) or can_eat(4,1,current_gua): res["missing_heaven"]={"reason":"長輩壓力","desc":"缺長輩緣","advice":"謙卑，曬太陽"}
-    if check_consumption(p5,p1) or can_eat(5,1,current_gua): res["missing_earth"]={"reason":"根基受損","desc":"財庫不穩","advice":"買房/定存"}
-    if not any(check_good_friend(p1, next(p for p in current_gua if p[0]==pos)) for pos in [2,3,4,5]):
+    eats, friends = ctx.eats, ctx.friends
+    if ctx.consumes[3][0] or eats[3][0]: res["missing_heaven"]={"reason":"長輩壓力","desc":"缺長輩緣","advice":"謙卑，曬太陽"}
+    if ctx.consumes[4][0] or eats[4][0]: res["missing_earth"]={"reason":"根基受損","desc":"財庫不穩","advice":"買房/定存"}
+    if not any(friends[0][pos - 1] for pos in [2,3,4,5]):
         res["missing_human"] = {"reason":"孤立無援","desc":"人和弱","advice":"修身養性"}
     return res
     
 def analyze_holistic_health(current_gua):
     report = {"core": {}, "balance": {"excess":[], "lack":[]}, "interaction": []}
-    center = next(p for p in current_gua if p[0] == 1)
+    center = piece_at(current_gua, 1)
     elm = ATTRIBUTES.get(center[1], {}).get("五行")
     if elm: 
         dt = FIVE_ELEMENTS_DETAILS.get(elm)
@@ -386,17 +464,17 @@ def analyze_holistic_health(current_gua):
     return report
 
 def analyze_coordinate_map(current_gua, gender):
-    p1 = next(p for p in current_gua if p[0] == 1); p4 = next(p for p in current_gua if p[0] == 4); p5 = next(p for p in current_gua if p[0] == 5)
-    p2 = next(p for p in current_gua if p[0] == 2); p3 = next(p for p in current_gua if p[0] == 3)
+    ctx = get_context(current_gua); friends = ctx.friends
+    p1 = piece_at(ctx, 1)
     report = {"center_status": "", "top_support": "", "bottom_foundation": "", "love_relationship": "", "peer_relationship": ""}
     p1_attr = ATTRIBUTES.get(p1[1], {})
     report["center_status"] = f"核心 **{p1[2]}{p1[1]}** ({p1_attr.get('特質')})。"
-    report["top_support"] = "貴人提拔" if check_good_friend(p1, p4) else "關係平淡"
-    report["bottom_foundation"] = "根基穩固" if check_good_friend(p1, p5) else "漂泊無根"
-    love_pos = 2 if gender == "男" else 3; p_love = p2 if gender == "男" else p3
-    report["love_relationship"] = "感情甜蜜" if check_good_friend(p1, p_love) else "緣分平平"
-    peer_pos = 3 if gender == "男" else 2; p_peer = p3 if gender == "男" else p2
-    report["peer_relationship"] = "得力夥伴" if check_good_friend(p1, p_peer) else "各自努力"
+    report["top_support"] = "貴人提拔" if friends[0][3] else "關係平淡"
+    report["bottom_foundation"] = "根基穩固" if friends[0][4] else "漂泊無根"
+    love_pos = 2 if gender == "男" else 3
+    report["love_relationship"] = "感情甜蜜" if friends[0][love_pos - 1] else "緣分平平"
+    peer_pos = 3 if gender == "男" else 2
+    report["peer_relationship"] = "得力夥伴" if friends[0][peer_pos - 1] else "各自努力"
     return report
 
 def analyze_body_hologram(current_gua):
@@ -416,7 +494,7 @@ def check_wealth_pattern(current_gua):
 def analyze_total_fate(full_gua_data):
     first_stage = LIFE_STAGES[0]; gua = full_gua_data.get(first_stage, [])
     if not gua: return {"type": "未知", "desc": "數據錯誤"}
-    center = next(p for p in gua if p[0] == 1); name = center[1]
+    center = piece_at(gua, 1); name = center[1]
     if name in ['將', '帥']: return {"type": "👑 領袖格", "desc": "天生領導風範。"}
     else: return {"type": "🧱 實幹格", "desc": "腳踏實地。"}
 
@@ -428,7 +506,7 @@ def analyze_color_flow(full_deck): return "✅ 氣場流動正常。"
 
 def check_divorce_pattern(current_gua, gender):
     if gender != "女": return {"is_risk": False, "warnings": [], "advice": ""}
-    p1 = next(p for p in current_gua if p[0] == 1); name = p1[1]
+    p1 = piece_at(current_gua, 1); name = p1[1]
     if name in ['將', '帥']: return {"is_risk": True, "warnings": ["核心強勢"], "advice": "需尋回自我。"}
     return {"is_risk": False, "warnings": [], "advice": "結構尚穩。"}
 
@@ -439,8 +517,52 @@ def check_peach_blossom_detailed(current_gua):
 
 def check_safety_issues(current_gua):
     warnings = []
+    eats = capture_matrix(current_gua)
     for p in current_gua:
-        if p[0] != 1 and can_eat(p[0], 1, current_gua):
+        if p[0] != 1 and eats[p[0] - 1][0]:
             if p[1] in ['車', '俥']: warnings.append("🚗 車關警示")
             if p[1] in ['士', '仕']: warnings.append("🏥 血光警示")
     return warnings
+
+
+# ==============================================================================
+# 單卦完整解析 (一次頁面只做一次分析)
+# ==============================================================================
+# 只依盤面的分析 與 需要性別的分析；結果以函數名稱為鍵，與 gua_table 的查表結果一致
+BOARD_ANALYZERS = [
+    check_special_patterns, check_exemption, analyze_trinity_detailed, analyze_health_and_luck,
+    analyze_holistic_health, analyze_body_hologram, get_advanced_piece_analysis, get_marketing_strategy,
+    get_past_life_reading, check_interference, check_safety_issues, check_career_pattern,
+    check_wealth_pattern, check_consumption_at_1_or_5, check_peach_blossom_detailed,
+]
+GENDER_ANALYZERS = [analyze_coordinate_map, check_divorce_pattern]
+
+def analyze_all(current_gua, gender="男", mode="general", table=None):
+    """所有分析共用同一個 GuaContext，回傳整份解讀。
+    結果分組存入 READING_CACHE：只依盤面的一組、依 (盤面, 性別) 的一組、依 (盤面, 模式) 的計分，
+    因此換性別只會重算與性別相關的項目。table 為 gua_table.GuaTable，未命中時優先查表。"""
+    ctx = get_context(current_gua)
+    fingerprint = board_fingerprint(ctx)
+    row = []
+
+    def analyze(fn, *args):
+        if table is not None and fingerprint is not None:
+            if not row: row.append(table.lookup(ctx))
+            if row[0] is not None and fn.__name__ in row[0]:
+                value = row[0][fn.__name__]
+                return value[args[0]] if args else value
+        return fn(ctx, *args)
+
+    def group(key, fns, *args):
+        compute = lambda: {fn.__name__: analyze(fn, *args) for fn in fns}
+        if fingerprint is None: return compute()
+        return READING_CACHE.get_or_compute((fingerprint,) + key, compute)
+
+    bundle = {"context": ctx}
+    bundle.update(group(("board",), BOARD_ANALYZERS + [calculate_net_gain_from_gua]))
+    bundle.update(group(("gender", gender), GENDER_ANALYZERS, gender))
+    bundle["calculate_score_by_mode"] = cached_call(calculate_score_by_mode, ctx, mode)
+    return bundle
+
+# 效能量測：XIANGBU_INSTRUMENT=1 時才包裝本模組的公開函數
+if instrument.ENABLED: instrument.install(globals(), cache_info)
@@ -0,0 +1,126 @@
+# ==============================================================================
+# sampler.py - 可重現的抽棋 (每個 session 各自的亂數產生器)
+# ==============================================================================
+# 牌組預先展開為不可變的棋種代碼序列 (順序同 rules.get_full_deck())，抽棋時不再重建。
+# 亂數由呼叫端傳入的 random.Random(seed) 提供：同一個種子必定抽出同一卦，
+# 不同 session 之間也不會共用全域 random 的狀態。
+#
+# 批次模式 (模擬用) 以 NumPy 一次產生 N 個盤面或 N 副洗好的牌組，回傳整數陣列。
+#
+# 成卦條件 (非全同色) 的盤面可直接抽出，不必「抽到全同色再重抽」：
+# 先依超幾何分布的條件機率決定紅棋支數 r (1~4)，再從紅、黑各抽 r、5-r 支並打亂位置。
+# 每個 r 之下所有組合等機率、排列也等機率，因此與「有序抽 5 支後排除全同色」的分布完全相同。
+
+import random
+from fractions import Fraction
+from math import comb
+
+from data import DECK_COUNTS, LIFE_STAGES, PIECE_KINDS
+from gua import Gua
+
+DECK_CODES = tuple(k for k, count in enumerate(DECK_COUNTS) for _ in range(count))
+DECK_SIZE = len(DECK_CODES)
+STAGE_COUNT = len(LIFE_STAGES)
+RED_CODES = tuple(k for k in DECK_CODES if k < 7)
+BLACK_CODES = tuple(k for k in DECK_CODES if k >= 7)
+
+# 5 支中紅棋支數 r 的組合數 (超幾何分布的分子)；成卦只允許 r = 1~4
+RED_COUNT_WAYS = [comb(len(RED_CODES), r) * comb(len(BLACK_CODES), 5 - r) for r in range(6)]
+VALID_RED_COUNTS = [1, 2, 3, 4]
+_VALID_CUM_WAYS = [sum(RED_COUNT_WAYS[1:r + 1]) for r in VALID_RED_COUNTS]
+
+# 單次抽到全紅或全黑 (不成卦) 的精確機率
+MONOCHROME_PROBABILITY = Fraction(RED_COUNT_WAYS[0] + RED_COUNT_WAYS[5], comb(DECK_SIZE, 5))
+
+_system_random = random.SystemRandom()
+
+def new_seed():
+    """新的一次占卜的種子 (存在 session_state，之後可用來重現)"""
+    return _system_random.getrandbits(48)
+
+def session_rng(seed): return random.Random(seed)
+
+def draw_gua(rng=None):
+    """從一副棋中抽 5 支；rng 省略時使用全域 random (與舊版行為相同)"""
+    return Gua((rng or random).sample(DECK_CODES, 5))
+
+def draw_deck(rng=None):
+    """洗好的整副牌組 (32 個棋種代碼)"""
+    deck = list(DECK_CODES)
+    (rng or random).shuffle(deck)
+    return deck
+
+def deck_pieces(codes): return [PIECE_KINDS[k] for k in codes]
+
+# ==============================================================================
+# 成卦條件抽樣 (不必重抽)
+# ==============================================================================
+def reroll_outcomes():
+    """app.py 重抽規則下一次占卜的精確結果機率：第一次就成卦 / 重抽後成卦 / 兩次都全同色 (不成卦)"""
+    p = MONOCHROME_PROBABILITY
+    return {"accepted_first_draw": 1 - p, "accepted_after_reroll": p * (1 - p), "rejected": p * p}
+
+def _valid_codes(rng):
+    r = rng.choices(VALID_RED_COUNTS, cum_weights=_VALID_CUM_WAYS)[0]
+    codes = rng.sample(RED_CODES, r) + rng.sample(BLACK_CODES, 5 - r)
+    rng.shuffle(codes)
+    return codes
+
+def draw_valid_gua(rng=None):
+    """直接從成卦 (非全同色) 盤面的條件分布抽一卦，機率與「抽到全同色就重抽」相同"""
+    return Gua(_valid_codes(rng or random))
+
+def draw_monochrome_gua(rng=None):
+    """全紅或全黑的盤面 (各半)，即不成卦時呈現的那一卦"""
+    rng = rng or random
+    return Gua(rng.sample(RED_CODES if rng.random() < 0.5 else BLACK_CODES, 5))
+
+def divine(rng=None):
+    """依重抽規則模擬一次單卦占卜，只需一次抽樣。
+    回傳 (結果, 盤面)，結果為 "accepted" (第一次成卦)、"rerolled" (重抽後成卦) 或 "rejected" (不成卦)"""
+    rng = rng or random
+    outcomes = reroll_outcomes()
+    u = rng.random()
+    if u < outcomes["accepted_first_draw"]: return "accepted", draw_valid_gua(rng)
+    if u < outcomes["accepted_first_draw"] + outcomes["accepted_after_reroll"]: return "rerolled", draw_valid_gua(rng)
+    return "rejected", draw_monochrome_gua(rng)
+
+# ==============================================================================
+# 批次取樣 (NumPy)
+# ==============================================================================
+def _deck_array():
+    import numpy as np   # 只有批次取樣需要 numpy，避免拖慢網頁啟動
+    deck = np.array(DECK_CODES, dtype=np.int8)
+    deck.flags.writeable = False
+    return np, deck
+
+def sample_decks(n, seed=None):
+    """N 副洗好的牌組，(N, 32) int8 陣列；seed 可為整數或 numpy.random.Generator"""
+    np, deck = _deck_array()
+    rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+    return rng.permuted(np.broadcast_to(deck, (n, DECK_SIZE)), axis=1)
+
+def sample_boards(n, seed=None):
+    """N 個 5 支盤面，(N, 5) int8 陣列 (欄 0~4 對應位置 1~5)，可直接交給 batch.score_boards"""
+    return sample_decks(n, seed)[:, :5].copy()
+
+def sample_valid_boards(n, seed=None):
+    """N 個成卦 (非全同色) 盤面，(N, 5) int8 陣列，不需要重抽"""
+    np, deck = _deck_array()
+    rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+    ways = np.array([RED_COUNT_WAYS[r] for r in VALID_RED_COUNTS], dtype=np.float64)
+    reds = rng.choice(VALID_RED_COUNTS, size=n, p=ways / ways.sum())
+    red_deck = np.array(RED_CODES, dtype=np.int8)
+    black_deck = np.array(BLACK_CODES, dtype=np.int8)
+    # 每列各洗一次紅、黑牌，取紅的前 r 支與黑的前 5-r 支，再打亂位置
+    candidates = np.concatenate([
+        rng.permuted(np.broadcast_to(red_deck, (n, len(red_deck))), axis=1)[:, :5],
+        rng.permuted(np.broadcast_to(black_deck, (n, len(black_deck))), axis=1)[:, :5],
+    ], axis=1)
+    col = np.arange(5)
+    keep = np.concatenate([col < reds[:, None], col < (5 - reds)[:, None]], axis=1)
+    return rng.permuted(candidates[keep].reshape(n, 5), axis=1)
+
+def split_stages(decks):
+    """(N, 32) 牌組 -> (N, 6, 5) 各階段盤面"""
+    return decks[:, :STAGE_COUNT * 5].reshape(len(decks), STAGE_COUNT, 5)
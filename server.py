@@ -0,0 +1,219 @@
+# ==============================================================================
+# server.py - 解卦 JSON API (asyncio，僅用標準函式庫)
+# ==============================================================================
+# HTTP/1.1 keep-alive；分析在行程池中執行，事件迴圈只負責收發。
+#
+#   GET  /health
+#   GET  /gua/random[?seed=123]              隨機起卦 (5 支)；回傳的 seed 可用來重現同一卦
+#   GET  /gua/full-life[?seed=123]           全盤流年 (6 個階段)
+#   GET  /reading?board=黑馬,紅兵,包,卒,包&gender=女&modes=general,love
+#   POST /reading   {"board": ..., "gender": "男", "modes": ["general"]}
+#   POST /batch     {"requests": [{"board": ...}, ...]}     一次多筆，結果依序回傳
+#
+# board 格式同 cli.py：棋子標籤串列、棋盤 ID 或 [位置, 棋名, 顏色] 串列。
+#
+# python server.py [--host 127.0.0.1] [--port 8080] [--workers 4] [--max-inflight 256]
+
+import argparse
+import asyncio
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from data import LIFE_STAGES
+from rules import (
+    generate_random_gua, generate_full_life_gua, calculate_score_by_mode, check_special_patterns,
+    analyze_trinity_detailed, analyze_coordinate_map, analyze_body_hologram, check_exemption, cached_call, SCORE_MODES
+)
+from cli import parse_board
+import sampler
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+MAX_BATCH = 1000
+KEEP_ALIVE_TIMEOUT = 15
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+# 請求內容 (盤面、性別、模式) 格式錯誤時 parse_board / reading 可能拋出的例外
+REQUEST_ERRORS = (KeyError, ValueError, TypeError, AttributeError, IndexError)
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+# ==============================================================================
+# 分析 (在工作行程中執行)
+# ==============================================================================
+def _board_json(gua): return {"board_id": gua.board_id, "pieces": [[pos, name, color] for pos, name, color, _ in gua]}
+
+def reading(request):
+    """單筆解卦：各模式分數、特殊格局、三才、座標定位 (依性別)、身體全息"""
+    gua = parse_board(request.get("board"))
+    gender = request.get("gender", "男")
+    if gender not in ("男", "女"): raise ValueError(f"gender 只能是 男 或 女: {gender!r}")
+    modes = request.get("modes") or ["general"]
+    if isinstance(modes, str): modes = modes.split(",")
+    unknown = [m for m in modes if m not in SCORE_MODES]
+    if unknown: raise ValueError(f"未知的模式: {unknown}")
+    return dict(
+        _board_json(gua),
+        calculate_score_by_mode={mode: cached_call(calculate_score_by_mode, gua, mode) for mode in modes},
+        check_special_patterns=cached_call(check_special_patterns, gua),
+        check_exemption=cached_call(check_exemption, gua),
+        analyze_trinity_detailed=cached_call(analyze_trinity_detailed, gua),
+        analyze_coordinate_map=cached_call(analyze_coordinate_map, gua, gender),
+        analyze_body_hologram=cached_call(analyze_body_hologram, gua),
+    )
+
+def batch_readings(requests):
+    """批次中單筆錯誤 (任何例外) 不影響其他筆，以 error 欄位回報"""
+    results = []
+    for request in requests:
+        try: results.append(reading(request))
+        except Exception as e: results.append({"error": str(e) or type(e).__name__})
+    return results
+
+def random_gua(seed):
+    return dict(_board_json(generate_random_gua(sampler.session_rng(seed))), seed=seed)
+
+def full_life(seed):
+    full_data = generate_full_life_gua(sampler.session_rng(seed))
+    return {"seed": seed, "stages": {stage: _board_json(full_data[stage]) for stage in LIFE_STAGES},
+            "remaining": [color + name for name, color in full_data["餘棋"]]}
+
+# ==============================================================================
+# HTTP
+# ==============================================================================
+class ReadingServer:
+    def __init__(self, workers=1, max_inflight=256, queue_timeout=5.0):
+        # workers=0 時直接在事件迴圈中計算 (單核心機器上可省去行程間傳輸)
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(workers) if workers > 0 else None
+        self.inflight = asyncio.Semaphore(max_inflight)
+        self.queue_timeout = queue_timeout
+
+    async def run_job(self, fn, *args):
+        try: await asyncio.wait_for(self.inflight.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError: raise HTTPError(503, "伺服器忙碌中，請稍後再試")
+        try:
+            if self.executor is None: return fn(*args)
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.inflight.release()
+
+    async def run_batch(self, requests):
+        # 拆成與工作行程數相同的份數平行計算，再依原順序合併
+        parts = max(1, min(self.workers, len(requests)))
+        size = -(-len(requests) // parts) if requests else 1
+        chunks = [requests[i:i + size] for i in range(0, len(requests), size)]
+        results = await asyncio.gather(*(self.run_job(batch_readings, chunk) for chunk in chunks))
+        return [r for chunk in results for r in chunk]
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        path = url.path.rstrip("/") or "/"
+        if path == "/health": return {"status": "ok"}
+        if path in ("/gua/random", "/gua/full-life"):
+            seed = parse_qs(url.query).get("seed", [""])[-1]
+            if seed and not seed.isdigit(): raise HTTPError(400, "seed 必須是非負整數")
+            seed = int(seed) if seed else sampler.new_seed()
+            return await self.run_job(random_gua if path == "/gua/random" else full_life, seed)
+        if path == "/reading":
+            if method == "GET":
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                if "board" not in query: raise HTTPError(400, "缺少 board 參數")
+                request = query
+            elif method == "POST": request = _json_body(body)
+            else: raise HTTPError(405, "只支援 GET 與 POST")
+            try: return await self.run_job(reading, request)
+            except REQUEST_ERRORS as e: raise HTTPError(400, str(e) or type(e).__name__)
+        if path == "/batch":
+            if method != "POST": raise HTTPError(405, "只支援 POST")
+            requests = _json_body(body).get("requests")
+            if not isinstance(requests, list): raise HTTPError(400, "requests 必須是串列")
+            if len(requests) > MAX_BATCH: raise HTTPError(413, f"單次最多 {MAX_BATCH} 筆")
+            return {"results": await self.run_batch(requests)}
+        raise HTTPError(404, f"找不到路徑: {path}")
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try: head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError): break
+                try:
+                    method, target, version, headers = _parse_head(head)
+                    length = _content_length(headers)
+                except HTTPError as e:
+                    # 請求行或 Content-Length 格式錯誤：無法確定內容長度，回應後關閉連線
+                    status, payload, keep_alive = e.status, {"error": str(e)}, False
+                else:
+                    keep_alive = (version == "HTTP/1.1" and headers.get("connection", "").lower() != "close") \
+                        or headers.get("connection", "").lower() == "keep-alive"
+                    if length > MAX_BODY_BYTES:
+                        status, payload, keep_alive = 413, {"error": "請求內容過大"}, False
+                    else:
+                        body = await reader.readexactly(length) if length else b""
+                        try: status, payload = 200, await self.dispatch(method, target, body)
+                        except HTTPError as e: status, payload = e.status, {"error": str(e)}
+                        except Exception as e: status, payload = 500, {"error": f"伺服器內部錯誤: {type(e).__name__}"}
+                writer.write(_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive: break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        if self.executor is not None: self.executor.shutdown()
+
+def _parse_head(head):
+    lines = head.decode("utf-8", "replace").split("\r\n")
+    try: method, target, version = lines[0].split(" ", 2)
+    except ValueError: raise HTTPError(400, "請求行格式錯誤")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            key, value = line.split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+    return method.upper(), target, version.strip(), headers
+
+def _content_length(headers):
+    value = headers.get("content-length", "0") or "0"
+    if not (value.isascii() and value.isdigit()): raise HTTPError(400, f"Content-Length 格式錯誤: {value!r}")
+    return int(value)
+
+def _json_body(body):
+    try: data = json.loads(body or b"{}")
+    except ValueError as e: raise HTTPError(400, f"JSON 格式錯誤: {e}")
+    if not isinstance(data, dict): raise HTTPError(400, "請求內容必須是 JSON 物件")
+    return data
+
+def _response(status, payload, keep_alive):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode("latin-1") + body
+
+async def serve(host, port, workers, max_inflight):
+    app = ReadingServer(workers, max_inflight)
+    server = await asyncio.start_server(app.handle, host, port, limit=MAX_HEADER_BYTES, backlog=1024)
+    print(f"listening on http://{host}:{port} (workers={workers}, max_inflight={max_inflight})")
+    try:
+        async with server: await server.serve_forever()
+    finally:
+        app.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="解卦 JSON API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="分析用的工作行程數 (0 = 在事件迴圈中直接計算)")
+    parser.add_argument("--max-inflight", type=int, default=256, help="同時處理中的分析工作上限，超過時排隊，逾時回 503")
+    args = parser.parse_args()
+    try: asyncio.run(serve(args.host, args.port, args.workers, args.max_inflight))
+    except KeyboardInterrupt: pass
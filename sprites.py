@@ -0,0 +1,59 @@
+# ==============================================================================
+# sprites.py - 棋子圖檔快取與十字盤面合成
+# ==============================================================================
+# static/ 的 14 張棋子圖在匯入時解碼一次 (依棋種代碼索引)，
+# render_board() 把整個十字盤面 (位置 4/2/1/3/5) 合成為一張 PNG，並依盤面指紋快取。
+# 一個盤面只需傳送一張圖，請求路徑上不再讀取磁碟。
+
+import io
+import os
+
+from PIL import Image
+
+from data import PIECE_KINDS, get_image_path
+from gua import Gua
+from rules import board_fingerprint
+from cache import LRUCache
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CELL = 70     # 每格寬高 (與原本單顆棋子的顯示寬度相同)
+GAP = 6
+# 十字盤面：位置 -> (列, 行)
+LAYOUT = {4: (0, 1), 2: (1, 0), 1: (1, 1), 3: (1, 2), 5: (2, 1)}
+
+def _load_sprite(name, color):
+    path = get_image_path(name, color)
+    if not path: return None
+    path = os.path.join(BASE_DIR, path)
+    if not os.path.exists(path): return None
+    with Image.open(path) as im:
+        sprite = im.convert("RGBA")
+    sprite.thumbnail((CELL, CELL), Image.LANCZOS)
+    return sprite
+
+# SPRITES[棋種代碼] = 已縮放的 RGBA 圖；缺圖時為 None
+SPRITES = [_load_sprite(name, color) for name, color in PIECE_KINDS]
+BOARD_CACHE = LRUCache(int(os.environ.get("XIANGBU_SPRITE_CACHE", "4096")))
+
+def _composite(gua):
+    size = CELL * 3 + GAP * 2
+    board = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    for pos, (row, col) in LAYOUT.items():
+        sprite = SPRITES[gua.kind(pos)]
+        x = col * (CELL + GAP) + (CELL - sprite.width) // 2
+        y = row * (CELL + GAP) + (CELL - sprite.height) // 2
+        board.alpha_composite(sprite, (x, y))
+    buf = io.BytesIO()
+    board.save(buf, format="PNG", compress_level=1)
+    return buf.getvalue()
+
+def render_board(current_gua):
+    """回傳十字盤面的 PNG bytes；盤面不完整或缺少棋子圖時回傳 None (由呼叫端逐顆顯示)"""
+    board_id = board_fingerprint(current_gua)
+    if board_id is None: return None
+    gua = Gua.from_board_id(board_id)
+    if any(SPRITES[k] is None for k in gua.codes): return None
+    return BOARD_CACHE.get_or_compute(board_id, lambda: _composite(gua))
+
+def cache_info():
+    return {"board_image": BOARD_CACHE.stats()}
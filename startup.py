@@ -0,0 +1,118 @@
+# ==============================================================================
+# startup.py - 冷啟動：延後載入的模組與啟動時間分析
+# ==============================================================================
+# app.py 第一次渲染 (側邊欄 + 提示) 只需要 streamlit、data、rules；
+# 用到 numpy 的 batch 與 whatif、用到 Pillow 的 sprites、盤面表 gua_table 都改在第一次使用時才 import。
+# 首頁渲染完成後 prewarm() 在背景執行緒預先載入這些模組，使用者按下占卜時通常已載入完畢
+# (XIANGBU_PREWARM=0 可關閉)。
+#
+# python startup.py [--runs 3] [--top 15] [--idle 1.0]
+#   在全新的子行程中以 -X importtime 啟動 app.py (streamlit AppTest)，報告各模組 import 耗時、
+#   首頁渲染時間與第一次單卦占卜的時間。--idle 為首頁出現後到按下占卜的間隔 (模擬使用者操作，0 = 立即)。
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+DEFERRED_MODULES = ("batch", "sprites", "gua_table", "whatif")
+PREWARM = os.environ.get("XIANGBU_PREWARM", "1") not in ("", "0")
+
+_prewarm_started = False
+_prewarm_lock = threading.Lock()
+
+def prewarm(modules=DEFERRED_MODULES):
+    """背景載入延後的模組 (每個行程只執行一次)；import 本身有模組鎖，與主執行緒同時 import 也安全"""
+    global _prewarm_started
+    if not PREWARM: return
+    with _prewarm_lock:
+        if _prewarm_started: return
+        _prewarm_started = True
+
+    def load():
+        for name in modules: __import__(name)
+
+    threading.Thread(target=load, name="startup-prewarm", daemon=True).start()
+
+# ==============================================================================
+# 啟動時間分析
+# ==============================================================================
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# 子行程中執行：計時 streamlit 載入、首頁渲染、第一次占卜，結果以 JSON 印在 stdout 最後一行
+_PROBE = r"""
+import json, sys, time
+t0 = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+t1 = time.perf_counter()
+at = AppTest.from_file(sys.argv[1], default_timeout=60).run()
+t2 = time.perf_counter()
+time.sleep(float(sys.argv[2]))
+t3 = time.perf_counter()
+at.button[1].click().run()
+t4 = time.perf_counter()
+errors = [str(e) for e in at.exception]
+print(json.dumps({"streamlit_ms": (t1 - t0) * 1e3, "first_render_ms": (t2 - t1) * 1e3,
+                  "first_reading_ms": (t4 - t3) * 1e3, "errors": errors}))
+"""
+
+def _repo_modules():
+    return {name[:-3] for name in os.listdir(HERE) if name.endswith(".py")}
+
+def parse_importtime(stderr):
+    """-X importtime 的輸出 -> {模組: (自身 µs, 累計 µs)}"""
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line: continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            times[name.strip()] = (int(self_us), int(cumulative_us))
+        except ValueError:
+            continue   # 標題列
+    return times
+
+def profile_once(idle=1.0, app_path=os.path.join(HERE, "app.py")):
+    """一次冷啟動：回傳各階段耗時與各模組 import 耗時"""
+    with tempfile.TemporaryDirectory() as tmp:
+        # 占卜紀錄寫到暫存目錄，不污染正式的 history.db
+        env = dict(os.environ, XIANGBU_HISTORY_DB=os.path.join(tmp, "history.db"))
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", _PROBE, app_path, str(idle)],
+                              cwd=HERE, env=env, capture_output=True, text=True, encoding="utf-8")
+    if proc.returncode != 0: raise RuntimeError(proc.stderr[-2000:])
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["imports"] = parse_importtime(proc.stderr)
+    return result
+
+def report(runs, top, idle):
+    results = [profile_once(idle) for _ in range(runs)]
+    median = lambda values: sorted(values)[len(values) // 2]
+    summary = {key: median([r[key] for r in results]) for key in ("streamlit_ms", "first_render_ms", "first_reading_ms")}
+    print(f"冷啟動 {runs} 次 (中位數)：載入 streamlit {summary['streamlit_ms']:.0f} ms，"
+          f"首頁渲染 {summary['first_render_ms']:.0f} ms，第一次單卦占卜 {summary['first_reading_ms']:.0f} ms，"
+          f"合計 {sum(summary.values()):.0f} ms")
+    for r in results:
+        for error in r["errors"]: print(f"  ⚠️ {error}")
+
+    imports = {}
+    for r in results:
+        for name, times in r["imports"].items(): imports.setdefault(name, []).append(times)
+    imports = {name: (median([t[0] for t in ts]), median([t[1] for t in ts])) for name, ts in imports.items()}
+
+    print("\n本專案模組 (自身 / 含子模組, ms)：")
+    for name in sorted(_repo_modules() & imports.keys(), key=lambda n: -imports[n][1]):
+        print(f"  {name:<12}{imports[name][0] / 1e3:8.1f}{imports[name][1] / 1e3:8.1f}")
+    packages = {name: times for name, times in imports.items() if "." not in name and name not in _repo_modules()}
+    print(f"\n第三方/標準函式庫 (含子模組最久的 {top} 個, ms)：")
+    for name in sorted(packages, key=lambda n: -packages[n][1])[:top]:
+        print(f"  {name:<24}{packages[name][1] / 1e3:8.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="app.py 冷啟動時間分析")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--idle", type=float, default=1.0, help="首頁出現後等待幾秒再占卜")
+    args = parser.parse_args()
+    report(args.runs, args.top, args.idle)
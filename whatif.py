@@ -0,0 +1,94 @@
+# ==============================================================================
+# whatif.py - 換棋敏感度：一次評估所有單一位置的換法
+# ==============================================================================
+# 對一個盤面，五個位置各自換成牌組還剩得到的每一種棋 (board_edit.valid_kinds，張數同 get_full_deck())，
+# 列出每種換法在各計分模式的 net_score 變化，以及 check_special_patterns 新增/消失的格局。
+# 所有候選盤面 (最多 5 x 13 個) 疊成一個 (N, 5) 陣列：
+#   batch.score_all_modes()      一次算出所有模式的分數
+#   batch.pattern_facts()        一次整理格局事實，各規則的 test 向量化判斷
+# 只有判斷為符合的 (盤面, 規則) 才逐一呼叫 emit 產生格局名稱。結果依盤面編碼存在行程內的 LRU。
+#
+# python whatif.py 帥兵卒仕象    (位1~5 的棋名，紅黑依 data.PIECE_KINDS 的名稱區分)
+
+import os
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+import batch
+import board_edit
+from cache import LRUCache
+from data import PIECE_KINDS
+from gua import Gua, POSITIONS
+from patterns import SPECIAL_PATTERNS, BoardFacts
+
+# base: 原盤面 {"scores": {模式: net}, "patterns": [名稱]}；
+# rows: 每種換法 {"pos", "kind", "label", "scores", "deltas", "added", "removed"}，依位置、棋種代碼排序
+Sweep = namedtuple("Sweep", "base rows")
+
+_SWEEPS = LRUCache(int(os.environ.get("XIANGBU_SWEEP_CACHE_SIZE", "256")))
+
+def candidates(gua):
+    """所有合法的單一位置換法 [(pos, kind), ...] (不含原本的棋)"""
+    return [(pos, kind) for pos in POSITIONS for kind in board_edit.valid_kinds(gua, pos) if kind != gua.kind(pos)]
+
+def _row_facts(facts, i):
+    """批次 BoardFacts 的第 i 個盤面 -> 單一盤面的 BoardFacts (欄位皆為 int)"""
+    return BoardFacts(*(tuple(int(a[i]) for a in field) if isinstance(field, tuple) else int(field[i]) for field in facts))
+
+def _pattern_names(codes):
+    """每個盤面的格局名稱串列 (順序同 check_special_patterns)"""
+    facts = batch.pattern_facts(codes)
+    hits = [np.asarray(rule.test(facts)) for rule in SPECIAL_PATTERNS]
+    names = [[] for _ in range(len(codes))]
+    for i in np.flatnonzero(np.any(hits, axis=0)):
+        row = _row_facts(facts, i)
+        for rule, hit in zip(SPECIAL_PATTERNS, hits):
+            if hit[i]: names[i].extend(p["name"] for p in rule.emit(row, int(hit[i])))
+    return names
+
+def sweep(gua):
+    """盤面 gua 的所有單一位置換法與各模式分數、格局的變化 (Sweep)"""
+    return _SWEEPS.get_or_compute(gua.codes, lambda: _compute(gua))
+
+def _compute(gua):
+    moves = candidates(gua)
+    codes = np.repeat(np.frombuffer(gua.codes, dtype=np.uint8).astype(np.intp)[None, :], len(moves) + 1, axis=0)
+    for n, (pos, kind) in enumerate(moves, start=1): codes[n, pos - 1] = kind
+    scores = {mode: result["net_score"].tolist() for mode, result in batch.score_all_modes(codes).items()}
+    names = _pattern_names(codes)
+
+    base = {"scores": {mode: net[0] for mode, net in scores.items()}, "patterns": names[0]}
+    rows = []
+    for n, (pos, kind) in enumerate(moves, start=1):
+        row_scores = {mode: net[n] for mode, net in scores.items()}
+        rows.append({
+            "pos": pos, "kind": kind, "label": board_edit.piece_label(kind), "scores": row_scores,
+            "deltas": {mode: row_scores[mode] - base["scores"][mode] for mode in scores},
+            "added": [name for name in names[n] if name not in names[0]],
+            "removed": [name for name in names[0] if name not in names[n]],
+        })
+    return Sweep(base, rows)
+
+def heatmap_records(result, mode):
+    """熱圖資料 (位置 x 換成的棋種)：每種換法一筆，供 st.vega_lite_chart 使用"""
+    return [{"位置": f"位{row['pos']}", "換成": row["label"], "net_score": row["scores"][mode], "變化": row["deltas"][mode],
+             "新增格局": "、".join(row["added"]) or "-", "消失格局": "、".join(row["removed"]) or "-"}
+            for row in result.rows]
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or len(sys.argv[1]) != 5: sys.exit("用法: python whatif.py 帥兵卒仕象")
+    by_name = {}
+    for kind, (name, _) in enumerate(PIECE_KINDS): by_name.setdefault(name, kind)
+    try: current = Gua([by_name[name] for name in sys.argv[1]])
+    except KeyError as e: sys.exit(f"未知的棋名: {e.args[0]}")
+    over = board_edit.deck_violations(current.codes)
+    if over: sys.exit(f"超過一副棋的張數：{'、'.join(over)}")
+    result = sweep(current)
+    print("原盤面：" + " ".join(f"{mode} {net:+g}" for mode, net in result.base["scores"].items()))
+    print("格局：" + ("、".join(result.base["patterns"]) or "無"))
+    for row in result.rows:
+        changes = " ".join(f"{mode} {delta:+g}" for mode, delta in row["deltas"].items() if delta)
+        patterns = "".join([f" +{name}" for name in row["added"]] + [f" -{name}" for name in row["removed"]])
+        print(f"位{row['pos']} → {row['label']}: {changes or '分數不變'}{patterns}")